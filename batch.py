@@ -0,0 +1,134 @@
+"""Converts lots of expressions at once, without telegram: reads them from a file (or stdin), writes answers as jsonl.
+
+python batch.py expressions.txt                     # one expression per line
+python batch.py requests.jsonl --field body         # jsonl: expression is in "body" of every object
+cat expressions.txt | python batch.py - > answers.jsonl
+
+Every input line gives exactly one output line, in the same order: the input object with "answer" added
+({"text": ..., "answer": ...} for plain text lines). Lines are handed to a pool of worker processes in chunks,
+and only a few chunks per worker are in flight at any moment, so memory use doesn't depend on size of the input.
+Rates are fetched (or loaded from snapshot) once, before workers start, and every worker uses exactly those rates.
+"""
+
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+from typing import Union
+
+CHUNK_SIZE = 1000  # lines per task: big enough to make passing them to a worker cheap
+CHUNKS_PER_WORKER = 4  # tasks in flight per worker: enough to keep every worker busy
+
+
+def freeze_rates(snapshot_path: Union[str, None] = None) -> str:
+    """Makes bot_parser of this process and of every process started later use rates from snapshot_path.
+    If there is no snapshot_path, rates are loaded the usual way (snapshot of the bot or API) and saved for them.
+    Returns path of the snapshot. Must be called before anything else in this process uses bot_parser.
+    """
+    from rates import RatesUnavailable, load_snapshot, save_snapshot
+    if snapshot_path is None:
+        from bot_parser import CurrencyConverter
+        CurrencyConverter.update_currency_rates()
+        if CurrencyConverter._rates_obsolete():  # loaded from an old snapshot
+            CurrencyConverter.update_currency_rates(max_age=0)
+        snapshot_path = os.path.join(tempfile.mkdtemp(), 'rates.snapshot')
+        save_snapshot(snapshot_path, CurrencyConverter.rates, CurrencyConverter._rates_fetched_at)
+        CurrencyConverter.FROZEN_RATES = True  # this process keeps using them too (see convert with workers=1)
+    elif load_snapshot(snapshot_path) is None:
+        raise RatesUnavailable(f'No rates snapshot at {snapshot_path}')
+    os.environ['BOT_RATES_SNAPSHOT'] = snapshot_path
+    os.environ['BOT_FROZEN_RATES'] = '1'
+    return snapshot_path
+
+
+def convert_line(parser, line: str, field: str) -> str:
+    """Output line (json, without the line break) for input line."""
+    text = line.rstrip('\r\n')
+    if text.lstrip().startswith('{'):
+        try:
+            entry = json.loads(text)
+            expression = entry[field]
+        except (ValueError, KeyError, TypeError) as e:  # TypeError: it's not an object, after all
+            return json.dumps({'line': text, 'error': f'{type(e).__name__}: {e}'}, ensure_ascii=False)
+    else:
+        entry = {'text': text}
+        expression = text
+    entry['answer'] = parser.parse(str(expression))
+    return json.dumps(entry, ensure_ascii=False)
+
+
+def _start_worker():
+    sys.stdout = sys.stderr  # bot_parser tells what it's doing, and stdout may be where answers go
+
+
+def convert_chunk(lines: list, field: str = 'text') -> str:
+    """Runs in a worker. Returns output lines for lines, joined (with line breaks)."""
+    from bot_parser import engine
+    parser = engine.telegram_parser
+    return ''.join(convert_line(parser, line, field) + '\n' for line in lines)
+
+
+def chunks(lines, size: int = CHUNK_SIZE):
+    chunk = []
+    for line in lines:
+        chunk.append(line)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def convert(lines, output, field: str = 'text', workers: Union[int, None] = None,
+            chunk_size: int = CHUNK_SIZE) -> int:
+    """Converts lines (any iterable of them, read lazily) and writes results to output in order.
+    Returns number of lines converted. Rates must be frozen beforehand (see freeze_rates).
+    workers=1 converts everything in this process.
+    """
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    if workers == 1:
+        for chunk in chunks(lines, chunk_size):
+            output.write(convert_chunk(chunk, field))
+            count += len(chunk)
+        return count
+
+    # spawn, not fork: this process may have threads running (e.g. the one that fetched rates)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_start_worker) as pool:
+        pending = deque()  # futures in input order
+        for chunk in chunks(lines, chunk_size):
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                output.write(pending.popleft().result())
+            pending.append(pool.submit(convert_chunk, chunk, field))
+            count += len(chunk)
+        while pending:
+            output.write(pending.popleft().result())
+    return count
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Converts expressions from a file, answers go to stdout.')
+    arguments.add_argument('input', help='text file with an expression per line or jsonl file, - for stdin')
+    arguments.add_argument('--output', '-o', help='where to write answers (stdout by default)')
+    arguments.add_argument('--field', default='text', help='field of jsonl objects with the expression')
+    arguments.add_argument('--workers', type=int, help='worker processes (number of cores by default)')
+    arguments.add_argument('--chunk-size', type=int, default=CHUNK_SIZE, help='lines per task')
+    arguments.add_argument('--rates', metavar='PATH',
+                           help='rates snapshot to use (rates of the bot, or fresh ones, by default)')
+    arguments = arguments.parse_args()
+
+    target = open(arguments.output, 'w', encoding='utf-8') if arguments.output else sys.stdout
+    _start_worker()
+    freeze_rates(arguments.rates)
+    source = sys.stdin if arguments.input == '-' else open(arguments.input, encoding='utf-8')
+    started = time.perf_counter()
+    with source, target:
+        converted = convert(source, target, arguments.field, arguments.workers, arguments.chunk_size)
+    elapsed = time.perf_counter() - started
+    print(f'{converted} lines in {elapsed:.1f} s ({converted / elapsed:.0f} lines/s)', file=sys.stderr)
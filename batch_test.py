@@ -0,0 +1,43 @@
+import io
+import json
+import os
+import unittest
+from unittest import mock
+from batch import *
+from replay_benchmark import RATES_PATH
+from replay_benchmark import freeze_rates as freeze_fixture_rates
+
+
+class EchoParser:
+    def parse(self, string):
+        return string.upper()
+
+
+class BatchTest(unittest.TestCase):
+
+    def test_convert_line(self):
+        parser = EchoParser()
+        self.assertEqual(json.loads(convert_line(parser, '100 usd in eur\n', 'text')),
+                         {'text': '100 usd in eur', 'answer': '100 USD IN EUR'})
+        self.assertEqual(json.loads(convert_line(parser, '{"id": 7, "body": "2 + 2"}\n', 'body')),
+                         {'id': 7, 'body': '2 + 2', 'answer': '2 + 2'})
+        for line in ('{"id": 7}', '{broken', '{"body": 1}]'):
+            self.assertIn('error', json.loads(convert_line(parser, line, 'body')))
+
+    def test_chunks(self):
+        self.assertEqual(list(chunks(iter('abcde'), 2)), [['a', 'b'], ['c', 'd'], ['e']])
+
+    def test_order(self):
+        lines = [f'{number} usd in eur\n' if number % 3 else f'{{"text": "{number} + 1"}}\n' for number in range(50)]
+        output = io.StringIO()
+        with mock.patch.dict(os.environ):
+            freeze_fixture_rates(RATES_PATH)  # workers are started with this environment
+            self.assertEqual(convert(iter(lines), output, workers=2, chunk_size=3), 50)
+        answers = [json.loads(line)['answer'] for line in output.getvalue().splitlines()]
+        self.assertEqual(len(answers), 50)
+        self.assertEqual(answers[3], '4.0')
+        self.assertTrue(answers[4].startswith('4.00 USD = '))
+
+
+if __name__ == '__main__':
+    unittest.main()
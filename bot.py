@@ -1,52 +1,180 @@
 """Run this file to launch the bot!
 Make sure to paste your API key into config_bot_sample.py and to rename it to config_bot.py first!
+Inline mode ("@your_bot 100 usd in e") works once it's enabled via @BotFather (/setinline).
+By default bot uses long polling. To receive updates via webhook instead, run:
+python bot.py --webhook https://your.domain/path --port 8443
+(bot listens for plain HTTP, your proxy should terminate TLS and forward requests to that port)
+To run several processes, add --reuse-port, and let them share rates instead of fetching them on their own:
+python bot.py --webhook ... --reuse-port --shared-rates bot_rates --rates-writer  (exactly one of them)
+python bot.py --webhook ... --reuse-port --shared-rates bot_rates  (all the others)
+Add --metrics-port 9100 to see what the bot is up to at http://127.0.0.1:9100/metrics
+Users and chats that send too much are ignored for a while, see --user-rate and the options after it.
 """
 
 from config_bot import TOKEN
+import argparse
 import telebot
-from bot_parser import CurrencyConverter, telegramParser
+from bot_parser import CurrencyConverter, engine, suggest_conversions
+from dispatcher import ChatDispatcher
+from limiter import Admission
+from metrics import METRICS, MetricsServer
+from rates import RatesUnavailable
+from webhook import WebhookServer
+import hashlib
 import time
+from urllib.parse import urlparse
 
 if __name__ == "__main__":
 
-    # initializing bot
-    bot = telebot.TeleBot(TOKEN)
+    arguments = argparse.ArgumentParser(description='Currency converter telegram bot.')
+    arguments.add_argument('--webhook', metavar='URL', help='public url of webhook (long polling if omitted)')
+    arguments.add_argument('--port', type=int, default=8443, help='local port for webhook server')
+    arguments.add_argument('--reuse-port', action='store_true',
+                           help='let several bot processes share the port')
+    arguments.add_argument('--secret', help='webhook secret token (derived from bot token by default)')
+    arguments.add_argument('--shared-rates', metavar='NAME',
+                           help='share currency rates with other bot processes via shared memory block NAME')
+    arguments.add_argument('--rates-writer', action='store_true',
+                           help='this process fetches rates for everyone sharing them (start it first)')
+    arguments.add_argument('--metrics-port', type=int,
+                           help='collect metrics and serve them at http://127.0.0.1:PORT/metrics (Prometheus format)')
+    arguments.add_argument('--user-rate', type=float, default=1,
+                           help='messages per second a user may send on average (others are ignored)')
+    arguments.add_argument('--user-burst', type=int, default=10, help='messages a user may send at once')
+    arguments.add_argument('--chat-rate', type=float, default=5, help='messages per second per chat')
+    arguments.add_argument('--chat-burst', type=int, default=30, help='messages a chat may send at once')
+    arguments = arguments.parse_args()
+
+    if arguments.shared_rates:  # before the engine loads any rates: readers only take them from shared memory
+        CurrencyConverter.share_rates(arguments.shared_rates, writer=arguments.rates_writer)
+    engine.warm_up()  # loads rates while bot connects to telegram
+
+    # initializing bot. Handlers run on dispatcher's workers, polling thread only hands messages over
+    bot = telebot.TeleBot(TOKEN, threaded=False)
+    admission = Admission(arguments.user_rate, arguments.user_burst, arguments.chat_rate, arguments.chat_burst)
+    dispatcher = ChatDispatcher(workers=8, queue_size=100, admission=admission)
+
+    if arguments.metrics_port:
+        METRICS.add_collector(dispatcher.metrics)
+        METRICS.add_collector(admission.metrics)
+        METRICS.enable()
+        MetricsServer(port=arguments.metrics_port).start()
 
     # ========== bot.handlers ===============
     @bot.message_handler(commands=['start', 'help'])
+    @dispatcher.handler
     def say_hello(message: telebot.types.Message):
         bot.reply_to(message, f'Привет, {message.from_user.full_name}!\n'
                               f'Этот бот позволяет конвертировать курсы валют.\n'
                               f'Например, введи "120 USD in GBP" или  "EUR 100 в CHF".\n'
                               f'Писать большими буквами - не обязательно. "100 eur" - тоже работает.\n'
-                              f'Напиши /values, чтобы получить список всех доступных валют'
+                              f'Напиши /values, чтобы получить список всех доступных валют '
+                              f'(или /values U, чтобы только тех, что начинаются на U).\n'
                               f'Для популярных валют предусмотрены псевдонимы.\n'
                               f'Например можно написать "1000 баксов в рублях".\n'
                               f'Можно писать 100\'000 или 100 000, или 100,000.\n'
                               f'Только не забывай про пробелы.\n'
-                              f'"100 USD in CHF" - работает. "100USD in CHF" - не работает.\n'
+                              f'"100 USD in CHF" - работает. "100USD in CHF" - тоже работает, а "100 USDinCHF" - нет.\n'
                               f'Ещё можно пользоваться этим ботом как простым калькулятором.\n'
                               f'Например, "150 * 20", "2 ^ 4".\n'
-                              f'Нет, много операций на строчку - нельзя.\n'
-                              f'Нет, "27 + 45 USD in EUR" - нельзя.\n'
-                              f'У автора погорел дедлайн и он не успел)\n'
+                              f'Можно и много операций на строчку, со скобками: "(2 + 3) * 4 ^ 2".\n'
+                              f'И даже "27 + 45 USD in EUR".\n'
+                              f'А по курсу прошлых дней - "100 USD in EUR 2022-06-01".\n'
+                              f'/history USD EUR покажет, как менялся курс за 30 дней.\n'
                               f'<3\n'
                               f'P.S. Напиши /start или /help, чтобы вывести это сообщение ещё раз.')
 
+    def values_page(number: int, prefix: str) -> tuple:
+        """Page of /values listing and keyboard to flip through pages (None if there's just one)."""
+        page, number, page_count = CurrencyConverter.currency_listing().page(number, prefix)
+        if page is None:
+            return f'Нет валют, которые начинаются на "{prefix}"', None
+        if page_count == 1:
+            return page, None
+        keyboard = telebot.types.InlineKeyboardMarkup()
+        keyboard.row(telebot.types.InlineKeyboardButton('◀', callback_data=f'values {number - 1} {prefix}'),
+                     telebot.types.InlineKeyboardButton(f'{number + 1}/{page_count}',
+                                                        callback_data=f'values {number} {prefix}'),
+                     telebot.types.InlineKeyboardButton('▶', callback_data=f'values {number + 1} {prefix}'))
+        return page, keyboard
+
     @bot.message_handler(commands=['values'])
+    @dispatcher.handler
     def list_currencies(message: telebot.types.Message):
-        bot.reply_to(message, f'{CurrencyConverter.return_list_of_currencies()}')
+        """/values lists all the currencies, /values u - only those starting with U."""
+        prefix = ''.join(message.text.split()[1:2])
+        page, keyboard = values_page(0, prefix)
+        bot.reply_to(message, page, reply_markup=keyboard)
+
+    def turn_values_page(call: telebot.types.CallbackQuery):
+        _, number, prefix = (call.data + ' ').split(' ', 2)
+        page, keyboard = values_page(int(number), prefix.strip())
+        if page != call.message.text:
+            bot.edit_message_text(page, call.message.chat.id, call.message.message_id, reply_markup=keyboard)
+        bot.answer_callback_query(call.id)
+
+    @bot.callback_query_handler(func=lambda call: call.data.startswith('values '))
+    def values_button(call: telebot.types.CallbackQuery):
+        if admission.admit(call.from_user.id, call.message.chat.id):  # buttons are pressed as fast as messages are sent
+            dispatcher.submit(call.message.chat.id, turn_values_page, call)
+
+
+    @bot.message_handler(commands=['history'])
+    @dispatcher.handler
+    def rates_history(message: telebot.types.Message):
+        """/history usd eur 30 - min, max and average rate over last 30 days."""
+        words = message.text.split()[1:]
+        days = int(words.pop()) if len(words) == 3 and words[-1].isdecimal() else 30
+        try:
+            engine.case_parser  # currency codes (and their synonyms) are known once the engine has started
+        except RatesUnavailable:
+            bot.reply_to(message, 'Не получилось узнать курсы валют. Попробуй чуть позже.')
+            return
+        codes = [CurrencyConverter.currency_code_operand.check(word) for word in words]
+        if len(codes) != 2 or None in codes or not 1 <= days <= 3660:
+            bot.reply_to(message, 'Напиши, например, /history USD EUR или /history USD EUR 90')
+            return
+        bot.reply_to(message, CurrencyConverter.describe_history(*codes, days))
 
 
     @bot.message_handler(content_types=['text'])
+    @dispatcher.handler
     def parse_command(message: telebot.types.Message):
-        bot.reply_to(message, telegramParser.parse(message.text))
+        try:
+            bot.reply_to(message, engine.telegram_parser.parse(message.text))
+        except RatesUnavailable:
+            bot.reply_to(message, 'Не получилось узнать курсы валют. Попробуй чуть позже.')
+
 
+    def answer_inline_query(query: telebot.types.InlineQuery):
+        results = [telebot.types.InlineQueryResultArticle(
+                       id=code, title=answer.split('\n')[0],
+                       input_message_content=telebot.types.InputTextMessageContent(answer))
+                   for code, answer in suggest_conversions(query.query)]
+        bot.answer_inline_query(query.id, results, cache_time=60)
+
+    @bot.inline_handler(func=lambda query: True)
+    def inline_conversion(query: telebot.types.InlineQuery):
+        """Inline mode: "@bot 100 usd in e" suggests conversions to EUR and others (enable it via @BotFather)."""
+        if admission.admit(query.from_user.id):
+            dispatcher.submit(query.from_user.id, answer_inline_query, query)
 
     @bot.message_handler(content_types=['sticker'])
+    @dispatcher.handler
     def praise_sticker(message: telebot.types.Message):
         bot.reply_to(message, 'Отличный стикер, Бро!')
 
+    if arguments.webhook:
+        # every process of the bot must use the same secret, hence no random one
+        secret_token = arguments.secret or hashlib.sha256(TOKEN.encode()).hexdigest()
+        bot.remove_webhook()
+        bot.set_webhook(url=arguments.webhook, secret_token=secret_token)
+        WebhookServer(lambda json_string: bot.process_new_updates([telebot.types.Update.de_json(json_string)]),
+                      path=urlparse(arguments.webhook).path or '/',
+                      secret_token=secret_token,
+                      port=arguments.port,
+                      reuse_port=arguments.reuse_port).run()
+
     while True:
         # Activating bot
         try:  # hopefully this will help with disconnects
@@ -1,37 +1,82 @@
 """This file is defining the "currency converter+ parser" aka "telegramParser".
-Import telegramParser to your app.
-Or launch this file in order to test the bot in console."""
+Import engine to your app and use engine.telegram_parser (importing telegramParser works too).
+Or launch this file in order to test the bot in console (batch.py converts whole files).
+Importing this file does no I/O: rates are loaded and parsers are built on first use (or by engine.warm_up())."""
 
-from config_bot import ISO_4217
 from parser_ import *
 from synonyms import CURRENCY_SYNONYMS
-import requests
-import json
+from dataclasses import dataclass
+from datetime import date
+from history import RatesHistory
+from listing import CurrencyListing
+from metrics import METRICS
+from money import ExactRates, format_amount
+import math
+import operator
+from suggestions import PrefixIndex
+from rates import CrossRates, HedgedRatesSource, RatesClient, RatesUnavailable, SharedRatesStore, \
+    load_snapshot, save_snapshot
+import atexit
+import os
+import threading
 import time
+from typing import Union
 
 
 in_operator = ParserOperator('in', aliases=['в'])
 
+_RATES_REFRESH_SECONDS = METRICS.histogram('rates_refresh_seconds',
+                                           'How long fetching rates from APIs took, by outcome '
+                                           '(updated, unchanged or failed)')
+
 
 class CurrencyConverter(ParserCase):
     """This extends ParserCase with logic necessary for currency conversion"""
-    API_URL = 'https://api.exchangerate.host/latest'
-    API_PARAMS = {'base': 'usd'}
+    # Rates are asked from the first provider, then (if it's slow or down) from the others. Base may be any currency.
+    RATE_PROVIDERS = [{'url': 'https://api.exchangerate.host/latest', 'params': {'base': 'usd'}, 'base': 'USD'},
+                      {'url': 'https://open.er-api.com/v6/latest/USD', 'base': 'USD'},
+                      {'url': 'https://api.frankfurter.app/latest', 'base': 'EUR'}]
+    HEDGE_AFTER = 1  # second. Ask next provider if previous one hasn't answered by then
     MAX_RETRIES = 5
-    TIMEOUT_BETWEEN_ATTEMPTS = 1  # second
+    TIMEOUT_BETWEEN_ATTEMPTS = 1  # second, doubles after every failed attempt (see RatesClient)
     RATES_BECOME_OBSOLETE_AFTER = 180  # seconds
-    rates = {}
+    REFRESH_AHEAD = 30  # seconds. Refresher thread updates rates this long before they become obsolete
+    SHARED_RATES_POLL = 1  # second. How often processes reading shared rates check for new ones
+    LISTING_PAGE_SIZE = 40  # currencies per page of /values
+    SNAPSHOT_PATH = os.environ.get('BOT_RATES_SNAPSHOT') or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rates.snapshot')
+    # rates from snapshot are used as they are: APIs are never contacted and rates never become obsolete.
+    # For benchmarks and other offline runs (set BOT_FROZEN_RATES=1 before importing this file)
+    FROZEN_RATES = bool(os.environ.get('BOT_FROZEN_RATES'))
+    # every day's rates are kept here (see RatesHistory), for questions like "100 usd in eur 2022-06-01"
+    HISTORY_PATH = os.environ.get('BOT_RATES_HISTORY') or \
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), 'rates_history')
+    rates = {}  # replaced as a whole on every update, never modified in place
+    cross_rates = None  # CrossRates built from rates, replaced along with them
+    exact_rates = None  # ExactRates built from rates (used to convert single amounts), replaced along with them
+    rates_version = 0  # incremented every time rates are replaced
     _rates_last_checked = None
-    _rates_obsolete = False
+    _rates_fetched_at = None
+    _refresher = None
+    _wake_refresher = threading.Event()
+    _rates_client = None
+    _shared_rates = None  # SharedRatesStore, see share_rates
+    _shared_rates_sequence = 0
+    currency_code_operand = None  # shared by all instances, updated along with rates
+    _listing = None  # CurrencyListing of current rates version, see currency_listing
+    _currency_index = (None, None)  # rates version and PrefixIndex built for it, see currency_index
+    _history = None
 
     def __init__(self, reverse: bool = False):
         CurrencyConverter.update_currency_rates()  # todo this happens twice, since I init two instances (norm and rev)
 
         # initializing operands
         currency_value_operand = genericFloatPositiveOperand
-        currency_code_operand = ParserOperand('list',
-                                              operand_list=list(CurrencyConverter.rates.keys()),
-                                              synonym_dict=CURRENCY_SYNONYMS)
+        if CurrencyConverter.currency_code_operand is None:
+            CurrencyConverter.currency_code_operand = ParserOperand('list',
+                                                                    operand_list=list(CurrencyConverter.rates.keys()),
+                                                                    synonym_dict=CURRENCY_SYNONYMS)
+        currency_code_operand = CurrencyConverter.currency_code_operand
 
         # calling ParserCase init with normal or reversed operand order
         if not reverse:
@@ -48,112 +93,323 @@ class CurrencyConverter(ParserCase):
             self.reversed = True
 
     @classmethod
-    def update_currency_rates(cls):
+    def update_currency_rates(cls, max_age: Union[float, None] = None):
         """Updates currency rates via API.
-        Only contacts API if more than RATES_BECOME_OBSOLETE_AFTER secondes have passed.
-        Terminates if API is unreacheble during initialization.
-        Sets cls._rates_obsolete flag if Api is unreacheble during execution."""
+        Only contacts APIs if more than max_age (RATES_BECOME_OBSOLETE_AFTER by default) secondes have passed.
+        During initialization rates are loaded from SNAPSHOT_PATH if possible (even obsolete ones,
+        refresher thread will take care of them). Raises RatesUnavailable if there's no snapshot and API is unreacheble.
+        If Api is unreacheble during execution, old rates are kept (see _rates_obsolete).
+        Processes reading shared rates (see share_rates) only ever take them from shared memory."""
+
+        if cls._shared_rates is not None and not cls._shared_rates.owner:
+            cls._read_shared_rates()
+            if cls._rates_last_checked is None:
+                raise RatesUnavailable(f'Nothing in shared rates {cls._shared_rates.name} yet, start the writer first')
+            return
+
+        if max_age is None:
+            max_age = cls.RATES_BECOME_OBSOLETE_AFTER
+
+        if cls._rates_last_checked is None and cls._load_rates_snapshot():
+            return
+        if cls.FROZEN_RATES:
+            if cls._rates_last_checked is None:
+                raise RatesUnavailable(f'Rates are frozen, but there is no snapshot at {cls.SNAPSHOT_PATH}')
+            return
 
         # if rates are up-to-date return without checking
         if cls._rates_last_checked is not None and \
-                time.time() - cls._rates_last_checked < cls.RATES_BECOME_OBSOLETE_AFTER:
+                time.time() - cls._rates_last_checked < max_age:
             return
 
-        # Try to contact the API_URL MAX_RETRIES times
-        for tries in range(cls.MAX_RETRIES):
-            print(f'Attempt #{tries+1} to reach API.')
-            try:  # didn't now this will raise an exception
-                answer = requests.get(cls.API_URL, params=cls.API_PARAMS, timeout=3)
-            except requests.exceptions.ReadTimeout:
-                time.sleep(cls.TIMEOUT_BETWEEN_ATTEMPTS)
-                continue
-            except requests.exceptions.ConnectionError:
-                time.sleep(cls.TIMEOUT_BETWEEN_ATTEMPTS)
-                continue
-            if answer.status_code != 200:
-                time.sleep(cls.TIMEOUT_BETWEEN_ATTEMPTS)
-            else:
-                break
-        else:  # (nobreak) failed to get rates...
+        if cls._rates_client is None:
+            cls._rates_client = HedgedRatesSource([RatesClient(**provider,
+                                                               max_retries=cls.MAX_RETRIES,
+                                                               backoff=cls.TIMEOUT_BETWEEN_ATTEMPTS)
+                                                   for provider in cls.RATE_PROVIDERS],
+                                                  hedge_after=cls.HEDGE_AFTER)
+
+        # Try to contact providers (each one MAX_RETRIES times)
+        started = time.perf_counter()
+        try:
+            rates = cls._rates_client.fetch()
+        except RatesUnavailable:  # failed to get rates...
+            if METRICS.enabled:
+                _RATES_REFRESH_SECONDS.observe(time.perf_counter() - started, outcome='failed')
             if cls._rates_last_checked is not None:  # ...during runtime:
-                cls._rates_obsolete = True  # This will add a warning to answer
                 cls._rates_last_checked = time.time()  # this stops new attempts to reach api for some time
                 print('FYI, currency conversion API is down!')
                 return
             else:  # ...during __init__. No point in going further then.
                 print('Was unable to get currency rates! What a shame!')
-                quit(1)
+                raise
 
         # On Success:
-        cls.rates = json.loads(answer.content)['rates']
-        cls._rates_obsolete = False
+        if METRICS.enabled:
+            _RATES_REFRESH_SECONDS.observe(time.perf_counter() - started,
+                                           outcome='unchanged' if rates is None else 'updated')
+        if rates is None:  # same as before
+            cls._rates_fetched_at = cls._rates_last_checked = time.time()
+            print("Rates haven't changed since last time")
+        else:
+            cls._set_rates(rates, time.time())
+            print("Sucsessfully fetched rates from API")
+        try:
+            save_snapshot(cls.SNAPSHOT_PATH, cls.rates, cls._rates_fetched_at)
+        except (OSError, UnicodeEncodeError) as e:
+            print(f'Unable to save rates snapshot: {e}')
+        if cls._shared_rates is not None and cls._shared_rates.owner:
+            cls._shared_rates.write(cls.rates, cls._rates_fetched_at)
+        try:
+            cls.history().append(cls.rates, cls._rates_fetched_at)
+        except (OSError, ValueError) as e:
+            print(f'Unable to add rates to history: {e}')
+
+    @classmethod
+    def _set_rates(cls, rates: dict, fetched_at: float):
+        cls.cross_rates = CrossRates.from_rates(rates)
+        cls.exact_rates = ExactRates(rates)
+        cls.rates = rates
+        cls.rates_version += 1
+        if cls.currency_code_operand is not None:  # new list of currencies => rebuild operand's index
+            cls.currency_code_operand.operand_list = list(rates.keys())
+        cls._rates_fetched_at = fetched_at
         cls._rates_last_checked = time.time()
-        print("Sucsessfully fetched rates from API")
 
     @classmethod
-    def return_list_of_currencies(cls):
-        """If ISO_4217 dictionary exists, try to fetch human-readable currency names from it."""
+    def _load_rates_snapshot(cls) -> bool:
+        """Loads rates saved by previous run. Returns False if there's nothing to load."""
+        snapshot = load_snapshot(cls.SNAPSHOT_PATH)
+        if snapshot is None:
+            return False
+        cls._set_rates(*snapshot)
+        print(f"Loaded rates from {cls.SNAPSHOT_PATH}")
+        return True
 
-        answer = ''
-        # todo: list aliases first
-        for currency_code in sorted(cls.rates.keys()):
-            answer += currency_code
-            try:
-                answer += f' ({ISO_4217[currency_code]})'
-            except KeyError:  # todo more types of error?
-                pass
-            except ReferenceError:
-                pass
-            answer += '\n'
+    @classmethod
+    def share_rates(cls, name: str, writer: bool = False):
+        """Shares rates between processes via shared memory block called name (see SharedRatesStore).
+        Exactly one process must be the writer: it fetches rates from API and publishes them.
+        Other processes never contact API and never write snapshot or history, their refresher thread
+        picks new rates up from shared memory. Call it before anything loads rates (i.e. before the engine starts).
+        """
+        if writer:
+            cls.update_currency_rates()  # rates are needed right away to share them
+            cls._shared_rates = SharedRatesStore(name, create=True)
+            atexit.register(cls._shared_rates.close)
+            cls._shared_rates.write(cls.rates, cls._rates_fetched_at)
+        else:
+            cls._shared_rates = SharedRatesStore(name)
+            cls._read_shared_rates()
+        cls._wake_refresher.set()
+
+    @classmethod
+    def _read_shared_rates(cls):
+        """Takes rates from shared memory if writer has published something new."""
+        snapshot = cls._shared_rates.read(newer_than=cls._shared_rates_sequence)
+        if snapshot is None:
+            return
+        rates, fetched_at, cls._shared_rates_sequence = snapshot
+        if rates == cls.rates:  # writer only confirmed that rates are still fresh
+            cls._rates_fetched_at = fetched_at
+            cls._rates_last_checked = time.time()
+        else:
+            cls._set_rates(rates, fetched_at)
+
+    @classmethod
+    def _rates_obsolete(cls) -> bool:
+        """Rates are obsolete if refresher didn't manage to update them in time (i.e. API is down)."""
+        if cls.FROZEN_RATES:
+            return False
+        return time.time() - cls._rates_fetched_at > cls.RATES_BECOME_OBSOLETE_AFTER
+
+    @classmethod
+    def start_refreshing(cls):
+        """Starts a daemon thread that updates rates before they become obsolete.
+        This way _action never has to wait for the API. Frozen rates are never refreshed.
+        """
+        if cls.FROZEN_RATES:
+            return
+        if cls._refresher is None or not cls._refresher.is_alive():
+            cls._refresher = threading.Thread(target=cls._refresh_forever, name='rates refresher', daemon=True)
+            cls._refresher.start()
+
+    @classmethod
+    def _refresh_forever(cls):
+        """Refresher thread's main loop. If API is down, it tries again every REFRESH_AHEAD seconds.
+        Rates loaded from an old snapshot get refreshed right away.
+        In processes that read shared rates, it checks shared memory every SHARED_RATES_POLL seconds instead.
+        """
+        while True:
+            cls._wake_refresher.clear()
+            if cls._shared_rates is not None and not cls._shared_rates.owner:
+                cls._read_shared_rates()
+                cls._wake_refresher.wait(cls.SHARED_RATES_POLL)
+                continue
 
+            wait = cls._rates_fetched_at + cls.RATES_BECOME_OBSOLETE_AFTER - cls.REFRESH_AHEAD - time.time()
+            if wait > 0 and cls._wake_refresher.wait(wait):
+                continue  # mode has changed
+            fetched_at = cls._rates_fetched_at
+            cls.update_currency_rates(max_age=0)
+            if cls._rates_fetched_at == fetched_at:  # API is down
+                cls._wake_refresher.wait(cls.REFRESH_AHEAD)
+
+    @classmethod
+    def metrics(cls) -> list:
+        """Collector for METRICS: age and version of rates, how rate providers are doing."""
+        answer = [('rates_version', 'gauge', 'Incremented every time rates are replaced', {}, cls.rates_version)]
+        if cls._rates_fetched_at is not None:
+            answer.append(('rates_age_seconds', 'gauge', 'Seconds since rates were fetched', {},
+                           time.time() - cls._rates_fetched_at))
+        if cls._rates_client is not None:
+            for name, stats in cls._rates_client.stats()['providers'].items():
+                for key in ('requests', 'wins', 'failures'):
+                    answer.append((f'rates_provider_{key}_total', 'counter', f'Rate provider {key}',
+                                   {'provider': name}, stats[key]))
         return answer
 
+    @classmethod
+    def history(cls) -> RatesHistory:
+        """Rates of every day since the bot was first launched. Only the process that fetches rates adds to it."""
+        if cls._history is None:
+            cls._history = RatesHistory(cls.HISTORY_PATH)
+        return cls._history
+
+    @classmethod
+    def historical_rate(cls, orig_currency: str, target_currency: str, day: date) -> tuple:
+        """(day the rate is from, rate) from history. No network I/O, raises ValueError if history doesn't know."""
+        if day > date.today():
+            raise ValueError(f'{day} ещё не наступило')
+        found = cls.history().rate(orig_currency, target_currency, day)
+        if found is None:
+            raise ValueError(f'Нет курсов {orig_currency}/{target_currency} на {day}')
+        return found
+
+    @classmethod
+    def describe_history(cls, orig_currency: str, target_currency: str, days: int = 30) -> str:
+        """Min, max and average rate over last days days (see /history). No network I/O."""
+        stats = cls.history().stats(orig_currency, target_currency, days)
+        if stats is None:
+            return f'Нет курсов {orig_currency}/{target_currency} за последние {days} дней'
+        return (f"1 {orig_currency} в {target_currency} с {stats['from'].isoformat()} по {stats['to'].isoformat()}:\n"
+                f"мин {stats['min']:.4g}\nмакс {stats['max']:.4g}\nсреднее {stats['avg']:.4g}")
+
+    @classmethod
+    def convert_many(cls, values, from_codes, to_codes):
+        """Converts lots of amounts at once, see CrossRates.convert_many. No parsing involved."""
+        return cls.cross_rates.convert_many(values, from_codes, to_codes)
+
+    @classmethod
+    def currency_listing(cls) -> CurrencyListing:
+        """List of currencies (with human-readable names from ISO_4217) split into pages for /values.
+        Built once per rates version.
+        """
+        listing = cls._listing
+        if listing is None or listing.version != cls.rates_version:
+            from config_bot import ISO_4217
+            # todo: list aliases first
+            listing = CurrencyListing(cls.rates.keys(), ISO_4217, page_size=cls.LISTING_PAGE_SIZE,
+                                      version=cls.rates_version)
+            cls._listing = listing
+        return listing
+
+    @classmethod
+    def currency_index(cls) -> PrefixIndex:
+        """Suggests currency codes for the beginning of a code, a word of its ISO_4217 name or a synonym.
+        Built once per rates version, only currencies we have rates for are suggested.
+        """
+        version, index = cls._currency_index
+        if index is None or version != cls.rates_version:
+            from config_bot import ISO_4217
+            version = cls.rates_version
+            index = PrefixIndex()
+            for code in cls.rates:
+                index.add(code, code)
+                if code in ISO_4217:
+                    index.add(ISO_4217[code], code)
+                    for word in ISO_4217[code].split():
+                        index.add(word, code)
+            for synonym, code in CURRENCY_SYNONYMS.items():
+                if code in cls.rates:  # synonyms are regexes, only the simple ones are supported here
+                    if synonym.endswith('[\\w]*'):
+                        index.add(synonym[:-len('[\\w]*')], code, open_key=True)
+                    else:
+                        index.add(synonym.replace('\\', ''), code)
+            cls._currency_index = version, index.freeze()
+        return index
+
+    @classmethod
+    def return_list_of_currencies(cls):
+        """All the currencies in one string."""
+        return cls.currency_listing().text
+
+    def version(self):
+        """Answer changes when rates are replaced or become obsolete (there's a warning then)."""
+        return CurrencyConverter.rates_version, CurrencyConverter._rates_obsolete()
+
+    @protect_from_value_errors  # e.g. amount too large to be converted exactly (inf)
     def _action(self, value, orig_currency, target_currency):
         """Overrides parent's _action method."""
 
-        CurrencyConverter.update_currency_rates()  # only updates if necessary
+        # rates are kept fresh by refresher thread, which may replace them at any moment, so only read them once
+        exact_rates = CurrencyConverter.exact_rates
 
-        # check if we need to update exchange rates
-        if time.time() - CurrencyConverter._rates_last_checked > CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER:
-            CurrencyConverter.update_currency_rates()
         # checking "polarity"=)
         if self.reversed:
             orig_currency, value = value, orig_currency
 
-        # figuring exchange rate for given currency pair
-        if orig_currency == 'USD':
-            answer = value * CurrencyConverter.rates[target_currency]
-        elif target_currency == 'USD':
-            answer = value / CurrencyConverter.rates[orig_currency]
-        else:
-            answer = value * (CurrencyConverter.rates[target_currency] /
-                              CurrencyConverter.rates[orig_currency])
+        answer = exact_rates.convert_amount(value, orig_currency, target_currency)
+        return self.describe_conversion(value, orig_currency, answer, target_currency)
 
-        # this will be returned to user
-        string_to_return = f"{str(round(value, 2))} {orig_currency} = {str(round(answer, 2))} {target_currency}"
+    @staticmethod
+    def describe_conversion(value, orig_currency, answer, target_currency, day: Union[date, None] = None) -> str:
+        """This will be returned to user. Day is given for conversions at historical rates."""
+        string_to_return = f"{format_amount(value, orig_currency)} {orig_currency} = " \
+                           f"{format_amount(answer, target_currency)} {target_currency}"
+        if day is not None:
+            string_to_return += f' ({day.isoformat()})'
 
         # + make sure to shame user if he asks for silly things =)
         if orig_currency == target_currency:
             string_to_return += '\n🤔🤔🤔🤔🤔🤔🤔🤔🤔🤔'
 
         # + make sure to inform user that rates are obsolete
-        if CurrencyConverter._rates_obsolete:
+        if day is None and CurrencyConverter._rates_obsolete():
             string_to_return += '\n Please note that the rates are not up to date due to remote server problem.'
 
         return string_to_return
 
 
-# Initializing Currency conversion parser cases
-currencyConverterNormal = CurrencyConverter()
-currencyConverterReversed = CurrencyConverter(reverse=True)
-
 # Making some operators for arithmetic operations
 add_operator = ParserOperator('+')
 subtract_operator = ParserOperator('-')
 multiply_operator = ParserOperator('*')
 divide_operator = ParserOperator('/')
 power_operator = ParserOperator('^', aliases=['**'])  # hello, python =)
-sqrt_operator = ParserOperator('sqrt', aliases=['root'])  # todo unary operators
+sqrt_operator = ParserOperator('sqrt', aliases=['root'])
+
+MAX_POWER_MAGNITUDE = 308  # float can't go much further than 1.8e308
+
+
+def power(a: float, b: float) -> float:
+    """a ** b that doesn't even try to compute hopeless cases: magnitude of the result (b * log10|a|)
+    is estimated first.
+    """
+    if a < 0 and not float(b).is_integer():
+        raise ValueError('Атрицательное число в дробной степени')  # python would give us a complex number
+    if a != 0 and abs(a) != 1:
+        magnitude = b * math.log10(abs(a))
+        if magnitude > MAX_POWER_MAGNITUDE:
+            raise OverflowError(f'Получилось бы примерно 10^{magnitude:.0f}')
+    return a ** b
+
+
+def sqrt(a: float) -> float:
+    """math.sqrt, with an error message for humans instead of "math domain error"."""
+    if a < 0:
+        raise ValueError('Атрицательное число под корнем')
+    return math.sqrt(a)
 
 # And creating parser cases for said operations
 generic_parsers = list()
@@ -180,21 +436,268 @@ generic_parsers.append(ParserCase(genericFloatOperand,  # division
 generic_parsers.append(ParserCase(genericFloatPositiveOperand,  # power
                                   power_operator,
                                   genericFloatOperand,
-                                  quick_action=lambda a, b: str(a**b)))
+                                  quick_action=lambda a, b: str(power(a, b))))
 
-# todo: single operand operators =)
+# single operand operators are only supported by telegramParser (see below)
 # generic_parsers.append(ParserCase(sqrt_operator,
 #                                   genericFloatNotNegativeOperand,
 #                                   quick_action=lambda a: str(a ** 0.5)))
 
 
 # ======================================================
-# feeding all the parser cases created above into parser
-telegramParser = Parser(currencyConverterNormal, currencyConverterReversed, *generic_parsers)
+# Expressions like "27 + 45 USD in EUR" or "2 + 2 * 2" (see Engine below for the parsers themselves)
+@dataclass(frozen=True)
+class Money:
+    """Amount of some currency. If it's a result of conversion, source is the Money that got converted
+    and day is the day of historical rates it was converted at (None for current rates).
+    """
+    amount: float
+    currency: str
+    source: Union['Money', None] = None
+    day: Union[date, None] = None
+
+    def to(self, currency: str, day: Union[date, None] = None) -> 'Money':
+        if day is None:
+            return Money(CurrencyConverter.exact_rates.convert_amount(self.amount, self.currency, currency),
+                         currency, self)
+        day, rate = CurrencyConverter.historical_rate(self.currency, currency, day)
+        return Money(self.amount * rate, currency, self, day)
+
+
+@dataclass(frozen=True)
+class DatedCurrency:
+    """Currency as of some day: "EUR 2022-06-01" in "100 USD in EUR 2022-06-01"."""
+    currency: str
+    day: date
+
+
+def attach_currency(a, b) -> Union[Money, DatedCurrency]:
+    """Implicit operation: "45 USD" or "USD 45" (or "EUR 2022-06-01")."""
+    if isinstance(a, float) and isinstance(b, str):
+        return Money(a, b)
+    if isinstance(a, str) and isinstance(b, float):
+        return Money(b, a)
+    if isinstance(a, str) and isinstance(b, date):
+        return DatedCurrency(a, b)
+    if isinstance(a, date) and isinstance(b, str):
+        return DatedCurrency(b, a)
+    raise ParsingFailure('Expected an amount and a currency')
+
+
+def convert(a, b) -> Money:
+    """in operator: "45 USD in EUR" or "45 USD in EUR 2022-06-01" (at rates of that day)."""
+    if isinstance(a, Money) and isinstance(b, DatedCurrency):
+        return a.to(b.currency, b.day)
+    if not isinstance(a, Money) or not isinstance(b, str):
+        raise ParsingFailure('Expected money in currency')
+    return a.to(b)
+
+
+def money_arithmetic(action: callable, money_and_money: bool = True, number_and_money: bool = True,
+                     ratio: bool = False) -> callable:
+    """Lets binary arithmetic action work with Money. Money and a number: number is in the same currency.
+    Money and money: right one is converted to the currency of the left one, result is Money
+    (or just a number if ratio is True). Disallowed combinations (e.g. money * money) raise ParsingFailure.
+    """
+    def wrapper(a, b):
+        if isinstance(a, str) or isinstance(b, str):
+            raise ParsingFailure('Currency code without amount')
+        if not isinstance(a, (float, Money)) or not isinstance(b, (float, Money)):
+            raise ParsingFailure('Not a number')
+        if not isinstance(a, Money) and not isinstance(b, Money):
+            return action(a, b)
+        if isinstance(a, Money) and isinstance(b, Money):
+            if not money_and_money:
+                raise ParsingFailure('Not for money')
+            b = b.to(a.currency) if b.currency != a.currency else b
+            result = action(a.amount, b.amount)
+            return result if ratio else Money(result, a.currency)
+        if isinstance(a, Money):
+            return Money(action(a.amount, b), a.currency)
+        if not number_and_money:
+            raise ParsingFailure('Not for money')
+        return Money(action(a, b.amount), b.currency)
+    return wrapper
+
+
+def numbers_only(action: callable) -> callable:
+    def wrapper(*args):
+        if not all(isinstance(arg, float) for arg in args):
+            raise ParsingFailure('Numbers only')
+        return action(*args)
+    return wrapper
+
+
+def negate(a):
+    if isinstance(a, Money):
+        return Money(-a.amount, a.currency)
+    return numbers_only(lambda x: -x)(a)
+
+
+def format_result(value) -> str:
+    if isinstance(value, (str, date, DatedCurrency)):
+        raise ParsingFailure('Just a currency code')
+    if not math.isfinite(value.amount if isinstance(value, Money) else value):
+        raise OverflowError('Результат не влезает во float')
+    if isinstance(value, Money):
+        if value.source is not None:
+            return CurrencyConverter.describe_conversion(value.source.amount, value.source.currency,
+                                                         value.amount, value.currency, value.day)
+        return f'{format_amount(value.amount, value.currency)} {value.currency}'
+    return str(value)
+
+
+# Expressions like "27 + 45 USD in EUR" or "2 + 2 * 2". Same operators as generic_parsers, but any number of them.
+# And conversions at rates of some day: "100 USD in EUR 2022-06-01" (see CurrencyConverter.history)
+dateOperand = ParserOperand('date')
+conversion = Operation(in_operator, convert, precedence=0)
+telegram_operations = [
+    conversion,
+    Operation(add_operator, money_arithmetic(operator.add), precedence=1),
+    Operation(subtract_operator, money_arithmetic(operator.sub), precedence=1),
+    Operation(multiply_operator, money_arithmetic(operator.mul, money_and_money=False), precedence=2),
+    Operation(divide_operator, money_arithmetic(operator.truediv, number_and_money=False, ratio=True), precedence=2),
+    Operation(subtract_operator, negate, precedence=3, unary=True),
+    Operation(sqrt_operator, numbers_only(sqrt), precedence=3, unary=True),
+    Operation(power_operator, numbers_only(power), precedence=4, right_associative=True)]
+
+
+class Engine:
+    """Currency converter parser cases and parsers made of them. Nothing happens until the first use
+    (or warm_up): then rates are loaded (from snapshot or API), parser cases and parsers are built
+    and refresher thread is started.
+    Raises RatesUnavailable on first use if there are no rates at all (it will try again next time).
+    caseParser only understands one operation per message, telegramParser understands expressions.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._parts = None  # (normal converter, reversed converter, case parser, telegram parser)
+
+    @property
+    def ready(self) -> bool:
+        return self._parts is not None
+
+    def _start(self) -> tuple:
+        with self._lock:
+            if self._parts is None:
+                normal = CurrencyConverter()
+                reversed_ = CurrencyConverter(reverse=True)
+                CurrencyConverter.start_refreshing()
+                case_parser = CachingParser(normal, reversed_, *generic_parsers)
+                telegram_parser = CachingExpressionParser(
+                    *telegram_operations,
+                    operands=[genericFloatOperand, CurrencyConverter.currency_code_operand, dateOperand],
+                    implicit=Operation(ParserOperator(''), attach_currency),
+                    format_result=format_result,
+                    version=normal.version,
+                    dated=conversion)
+                self._parts = (normal, reversed_, case_parser, telegram_parser)
+            return self._parts
+
+    def warm_up(self) -> threading.Thread:
+        """Starts everything in background thread, so it's (hopefully) ready by the time first message comes."""
+        def warm_up():
+            try:
+                self._start()
+            except RatesUnavailable as e:
+                print(f'Warm up failed, will try again on first message: {e}')
+        thread = threading.Thread(target=warm_up, name='engine warm up', daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def currency_converter_normal(self) -> CurrencyConverter:
+        return (self._parts or self._start())[0]
+
+    @property
+    def currency_converter_reversed(self) -> CurrencyConverter:
+        return (self._parts or self._start())[1]
+
+    @property
+    def case_parser(self) -> CachingParser:
+        return (self._parts or self._start())[2]
+
+    @property
+    def telegram_parser(self) -> CachingExpressionParser:
+        return (self._parts or self._start())[3]
+
+
+engine = Engine()
+_ENGINE_ATTRIBUTES = {'currencyConverterNormal': 'currency_converter_normal',
+                      'currencyConverterReversed': 'currency_converter_reversed',
+                      'caseParser': 'case_parser',
+                      'telegramParser': 'telegram_parser'}
+
+
+def __getattr__(name: str):
+    """Old names (like telegramParser) still work, but start the engine."""
+    if name in _ENGINE_ATTRIBUTES:
+        return getattr(engine, _ENGINE_ATTRIBUTES[name])
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
+def parser_metrics() -> list:
+    """Collector for METRICS: answer and plan cache statistics of telegramParser (nothing until it's started)."""
+    if not engine.ready:
+        return []
+    cache = engine.telegram_parser.cache_stats()
+    plans = engine.telegram_parser.plan_stats()
+    return [('parser_cache_size', 'gauge', 'Answers in cache', {}, cache['size']),
+            ('parser_cache_hits_total', 'counter', 'Answers taken from cache', {}, cache['hits']),
+            ('parser_cache_misses_total', 'counter', 'Messages parsed from scratch', {}, cache['misses']),
+            ('parser_cache_evictions_total', 'counter', 'Answers evicted from cache', {}, cache['evictions']),
+            ('parser_cache_invalidations_total', 'counter', 'Answers thrown away because rates changed', {},
+             cache['invalidations']),
+            ('parser_plans_size', 'gauge', 'Compiled plans in cache', {}, plans['size']),
+            ('parser_plan_hits_total', 'counter', 'Messages that reused a compiled plan', {}, plans['hits']),
+            ('parser_plan_misses_total', 'counter', 'Messages that were compiled', {}, plans['misses']),
+            ('parser_plan_time_saved_seconds_total', 'counter', 'Estimated time saved by plan cache', {},
+             plans['time_saved'])]
+
+
+METRICS.add_collector(parser_metrics)
+METRICS.add_collector(CurrencyConverter.metrics)
+
+
+def suggest_conversions(query: str, limit: int = 10) -> list:
+    """Answers for inline mode: [(currency code, answer), ...]. Query is what user has typed so far, e.g.
+    "100 usd in e" gives conversions of 100 USD to every currency that starts with e (codes go first).
+    "100 usd in" suggests all currencies, complete query like "100 usd in eur" gives just its answer.
+    Only rates in memory are used, no network I/O.
+    """
+    words = query.split()
+    in_operators = {in_operator.operator, *in_operator.aliases}
+    if len(words) >= 2 and words[-1].lower() in in_operators:
+        amount, prefix = words[:-1], ''
+    elif len(words) >= 3 and words[-2].lower() in in_operators:
+        amount, prefix = words[:-2], words[-1]
+    else:
+        return []
+
+    try:
+        money = engine.telegram_parser.evaluate(' '.join(amount), require_operator=False)
+    except (ParsingFailure, ValueError, ArithmeticError):
+        return []
+    if not isinstance(money, Money) or not math.isfinite(money.amount):
+        return []
+
+    codes = CurrencyConverter.currency_index().lookup(prefix)
+    upper_prefix = prefix.upper()
+    codes = sorted(codes, key=lambda code: (code != upper_prefix, not code.startswith(upper_prefix)))[:limit]
+    if not codes:
+        return []
+    try:
+        converted = CurrencyConverter.convert_many([money.amount], money.currency, codes)
+    except KeyError:  # rates were replaced in the meantime, and some currency has gone
+        return []
+    return [(code, CurrencyConverter.describe_conversion(money.amount, money.currency, value, code))
+            for code, value in zip(codes, converted)]
+
 
 if __name__ == '__main__':
     """This lets you test telegramParser in the console if you so desire."""
 
     while True:
         what = input()
-        print(telegramParser.parse(what))
+        print(engine.telegram_parser.parse(what))
@@ -0,0 +1,276 @@
+from datetime import datetime, timezone
+import operator
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+import bot_parser
+from bot_parser import *
+from rates import SharedRatesStore
+
+# What a fresh interpreter has after "import bot_parser" (runs in a subprocess: other tests import everything)
+CHECK_IMPORT = """
+import sys
+import bot_parser
+print(bot_parser.engine.ready, *sorted(name for name in ('numpy', 'requests', 'config_bot', 'http.server')
+                                       if name in sys.modules))
+"""
+
+
+class StartupTest(unittest.TestCase):
+
+    def test_import_does_nothing(self):
+        environment = dict(os.environ, BOT_FROZEN_RATES='1',
+                           BOT_RATES_SNAPSHOT=os.path.join(tempfile.mkdtemp(), 'missing.snapshot'))
+        output = subprocess.run([sys.executable, '-c', CHECK_IMPORT], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                env=environment, capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.split(), ['False'])
+
+
+RATES = {'USD': 1.0, 'EUR': 0.5, 'JPY': 150.0, 'GBP': 0.8, 'KWD': 0.307}
+
+
+class FakeClock:
+    """Stands in for the time module in bot_parser."""
+
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def time(self) -> float:
+        return self.now
+
+    def perf_counter(self) -> float:
+        return self.now
+
+
+class FakeSource:
+    """Stands in for HedgedRatesSource: answers are taken from a list (exceptions are raised)."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = 0
+        self.called = threading.Event()
+
+    def fetch(self):
+        self.calls += 1
+        self.called.set()
+        answer = self.answers.pop(0)
+        if isinstance(answer, BaseException):
+            raise answer
+        return answer
+
+
+class StopRefresher(BaseException):
+    """Ends refresher thread (nothing in it catches BaseException)."""
+
+
+class ConverterTestCase(unittest.TestCase):
+    """Gives every test its own CurrencyConverter state (fresh RATES), clock and files."""
+    STATE = ('rates', 'cross_rates', 'exact_rates', 'rates_version', '_rates_last_checked', '_rates_fetched_at',
+             '_refresher', '_rates_client', '_shared_rates', '_shared_rates_sequence', 'currency_code_operand',
+             '_listing', '_currency_index', '_history', 'SNAPSHOT_PATH', 'HISTORY_PATH', 'FROZEN_RATES')
+
+    def setUp(self):
+        saved = {name: CurrencyConverter.__dict__[name] for name in self.STATE}
+        self.addCleanup(lambda: [setattr(CurrencyConverter, name, value) for name, value in saved.items()])
+        directory = tempfile.mkdtemp()
+        CurrencyConverter.SNAPSHOT_PATH = os.path.join(directory, 'rates.snapshot')
+        CurrencyConverter.HISTORY_PATH = os.path.join(directory, 'history')
+        CurrencyConverter.FROZEN_RATES = False
+        CurrencyConverter._history = None
+        CurrencyConverter._shared_rates = None
+        CurrencyConverter.currency_code_operand = None
+        self.clock = FakeClock()
+        patcher = mock.patch.object(bot_parser, 'time', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        CurrencyConverter._set_rates(dict(RATES), self.clock.now)
+
+
+class RefreshTest(ConverterTestCase):
+
+    def test_obsolete(self):
+        self.assertFalse(CurrencyConverter._rates_obsolete())
+        self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER + 1
+        self.assertTrue(CurrencyConverter._rates_obsolete())
+        CurrencyConverter.FROZEN_RATES = True
+        self.assertFalse(CurrencyConverter._rates_obsolete())
+
+    def test_stale_rates_are_refreshed(self):
+        CurrencyConverter._rates_client = FakeSource(dict(RATES, EUR=0.6))
+        CurrencyConverter.update_currency_rates()
+        self.assertEqual(CurrencyConverter._rates_client.calls, 0)  # fresh ones are not
+        self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER + 1
+        version = CurrencyConverter.rates_version
+        CurrencyConverter.update_currency_rates()
+        self.assertEqual(CurrencyConverter.rates['EUR'], 0.6)
+        self.assertEqual(CurrencyConverter.rates_version, version + 1)
+        self.assertEqual(CurrencyConverter._rates_fetched_at, self.clock.now)
+        self.assertFalse(CurrencyConverter._rates_obsolete())
+
+    def test_failed_refresh_keeps_rates(self):
+        CurrencyConverter._rates_client = FakeSource(RatesUnavailable('down'))
+        self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER + 1
+        rates, version = CurrencyConverter.rates, CurrencyConverter.rates_version
+        CurrencyConverter.update_currency_rates()
+        self.assertIs(CurrencyConverter.rates, rates)
+        self.assertEqual(CurrencyConverter.rates_version, version)
+        self.assertTrue(CurrencyConverter._rates_obsolete())
+        CurrencyConverter.update_currency_rates()  # failure is remembered, API isn't asked again right away
+        self.assertEqual(CurrencyConverter._rates_client.calls, 1)
+
+    def test_refresher_thread(self):
+        CurrencyConverter._rates_fetched_at -= CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER  # old snapshot
+        source = CurrencyConverter._rates_client = FakeSource(dict(RATES, EUR=0.6), StopRefresher())
+        refresher = threading.Thread(target=CurrencyConverter._refresh_forever, daemon=True)
+        with mock.patch('threading.excepthook'):  # StopRefresher is expected
+            refresher.start()
+            self.assertTrue(source.called.wait(5))
+            source.called.clear()
+            self.assertFalse(source.called.wait(0.2))  # fresh rates: refresher waits for them to get old
+            self.assertEqual(CurrencyConverter.rates['EUR'], 0.6)
+            self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER
+            CurrencyConverter._wake_refresher.set()
+            refresher.join(5)
+        self.assertFalse(refresher.is_alive())
+        self.assertEqual(source.calls, 2)
+
+    def test_nothing_runs_on_message_path(self):
+        case = CurrencyConverter()
+        CurrencyConverter._rates_client = FakeSource()  # any fetch would fail
+        self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER + 1
+        answer = case.parse('100 USD in EUR')
+        self.assertTrue(answer.startswith('100.00 USD = 50.00 EUR'))
+        self.assertIn('not up to date', answer)
+        self.assertEqual(CurrencyConverter._rates_client.calls, 0)
+
+
+class EngineTestCase(ConverterTestCase):
+    """Gives every test an engine of its own (rates are frozen: no refresher thread)."""
+
+    def setUp(self):
+        super().setUp()
+        CurrencyConverter.FROZEN_RATES = True
+        self.engine = Engine()
+
+
+class DatesTest(EngineTestCase):
+
+    def test_subtraction_is_not_a_date(self):
+        for string, answer in (('5000-20-30', '4950.0'), ('2000-10-5', '1985.0'), ('2022-06-01', '2015.0'),
+                               ('2022-06-01 - 1', '2014.0'), ('10 - 2022-06-01', '-2019.0')):
+            self.assertEqual(self.engine.telegram_parser.parse(string), answer)
+
+    def test_dated_conversion(self):
+        fetched_at = datetime(2022, 6, 1, 12, tzinfo=timezone.utc).timestamp()
+        CurrencyConverter.history().append(dict(RATES, EUR=0.9), fetched_at)
+        answer = self.engine.telegram_parser.parse('100 USD in EUR 2022-06-01')
+        self.assertTrue(answer.startswith('100.00 USD = 90.00 EUR'), answer)
+        self.assertEqual(self.engine.telegram_parser.parse('100 USD in EUR 2022-02-30'),
+                         "Can't parse '100 USD in EUR 2022-02-30'")
+
+
+class MoneyTest(EngineTestCase):
+
+    def test_money(self):
+        money = Money(10.0, 'USD').to('JPY')
+        self.assertEqual((money.amount, money.currency, money.source), (1500.0, 'JPY', Money(10.0, 'USD')))
+        self.assertEqual(convert(Money(1.0, 'USD'), 'EUR').amount, 0.5)
+        self.assertRaises(ParsingFailure, convert, 1.0, 'EUR')
+        add = money_arithmetic(operator.add)
+        self.assertEqual(add(Money(10.0, 'USD'), Money(10.0, 'EUR')), Money(30.0, 'USD'))
+        self.assertEqual(add(Money(10.0, 'USD'), 1.5), Money(11.5, 'USD'))
+        ratio = money_arithmetic(operator.truediv, ratio=True)
+        self.assertEqual(ratio(Money(10.0, 'USD'), Money(10.0, 'EUR')), 0.5)
+        self.assertRaises(ParsingFailure, money_arithmetic(operator.mul, money_and_money=False),
+                          Money(1.0, 'USD'), Money(1.0, 'USD'))
+
+    def test_format_result(self):
+        self.assertEqual(format_result(Money(1.005, 'USD')), '1.01 USD')  # half way, decided by decimal digits
+        self.assertEqual(format_result(Money(1234.5, 'JPY')), '1235 JPY')
+        self.assertEqual(format_result(Money(1.2345, 'KWD')), '1.235 KWD')
+        self.assertEqual(format_result(Money(10.0, 'USD').to('EUR')), '10.00 USD = 5.00 EUR')
+        self.assertEqual(format_result(2.5), '2.5')
+        self.assertRaises(ParsingFailure, format_result, 'USD')
+        self.assertRaises(OverflowError, format_result, Money(float('inf'), 'USD'))
+
+    def test_conversions(self):
+        for string, answer in (('1 usd in jpy', '1.00 USD = 150 JPY'),
+                               ('100 JPY in USD', '100 JPY = 0.67 USD'),
+                               ('0.01 usd in jpy', '0.01 USD = 2 JPY'),  # 1.5 yen
+                               ('1 jpy in usd', '1 JPY = 0.01 USD'),
+                               ('10 usd in kwd', '10.00 USD = 3.070 KWD'),
+                               ('(10 + 5) USD in EUR', '15.00 USD = 7.50 EUR'),
+                               ('10 USD + 10 EUR', '30.00 USD'),
+                               ('10 usd * 2', '20.00 USD'),
+                               ('10 usd / 10 eur', '0.5')):
+            self.assertEqual(self.engine.telegram_parser.parse(string), answer)
+        self.assertEqual(self.engine.case_parser.parse('1 usd in jpy'), '1.00 USD = 150 JPY')
+
+
+class PowerTest(EngineTestCase):
+
+    def test_power(self):
+        self.assertEqual(power(2.0, 10.0), 1024.0)
+        self.assertEqual(power(-2.0, 3.0), -8.0)
+        self.assertEqual(power(10.0, 308.0), 1e308)  # just under the cap
+        self.assertEqual(power(2.0, -5000.0), 0.0)
+        for a, b in ((10.0, 308.5), (2.0, 1e12), (-2.0, 2001.0), (0.5, -2000.0), (10.0, 1e308)):
+            self.assertRaises(OverflowError, power, a, b)  # before even trying
+        self.assertRaises(ValueError, power, -8.0, 0.5)
+        self.assertEqual(sqrt(16.0), 4.0)
+        self.assertRaises(ValueError, sqrt, -1.0)
+
+    def test_refusals(self):
+        for string in ('10 ^ 308.5', '2 ^ 1024', '2 ^ 100000000000', '(-2) ^ 2001', '9 ^ 9 ^ 9', '2 ** 99999'):
+            self.assertTrue(self.engine.telegram_parser.parse(string).startswith('Слищком многа:'), string)
+        self.assertTrue(self.engine.case_parser.parse('2 ^ 100000000000').startswith('Слищком многа:'))
+        self.assertEqual(self.engine.telegram_parser.parse('(-8) ^ 0.5'),
+                         'Ощибочка вышла:\nАтрицательное число в дробной степени')
+        self.assertEqual(self.engine.telegram_parser.parse('sqrt -1'), 'Ощибочка вышла:\nАтрицательное число под корнем')
+        self.assertEqual(self.engine.telegram_parser.parse('10 ^ 308'), '1e+308')
+        self.assertEqual(self.engine.case_parser.parse('2 ^ 1023'), '8.98846567431158e+307')
+
+
+class SharedRatesTest(ConverterTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = SharedRatesStore(f'bot_parser_test_{os.getpid()}', create=True)
+        self.addCleanup(self.store.close)
+        # this process starts as a reader: nothing is loaded yet, any fetch would fail
+        CurrencyConverter.rates, CurrencyConverter._rates_last_checked = {}, None
+        CurrencyConverter._rates_fetched_at = None
+        CurrencyConverter._rates_client = FakeSource()
+
+    def share(self):
+        CurrencyConverter.share_rates(self.store.name)
+        self.addCleanup(CurrencyConverter._shared_rates.close)
+
+    def test_reader_waits_for_writer(self):
+        self.share()
+        with self.assertRaises(RatesUnavailable):
+            CurrencyConverter()
+        self.store.write(dict(RATES, EUR=0.6), self.clock.now)
+        self.assertEqual(CurrencyConverter().parse('100 USD in EUR'), '100.00 USD = 60.00 EUR')
+
+    def test_reader_is_read_only(self):
+        self.store.write(dict(RATES, EUR=0.6), self.clock.now)
+        self.share()
+        CurrencyConverter()
+        self.clock.now += CurrencyConverter.RATES_BECOME_OBSOLETE_AFTER + 1
+        CurrencyConverter.update_currency_rates(max_age=0)
+        self.assertEqual(CurrencyConverter.rates['EUR'], 0.6)
+        self.store.write(dict(RATES, EUR=0.7), self.clock.now)
+        CurrencyConverter.update_currency_rates(max_age=0)
+        self.assertEqual(CurrencyConverter.rates['EUR'], 0.7)
+        self.assertEqual(CurrencyConverter._rates_client.calls, 0)
+        self.assertFalse(os.path.exists(CurrencyConverter.SNAPSHOT_PATH))
+        self.assertFalse(os.path.exists(CurrencyConverter.HISTORY_PATH))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""This file defines ChatDispatcher, which runs bot handlers on a pool of worker threads.
+Messages from the same chat always go to the same worker, so replies within a chat keep their order,
+while a slow message in one chat doesn't stall the others.
+"""
+
+import queue
+import threading
+import time
+import traceback
+from typing import Union
+from limiter import Admission
+
+
+class ChatDispatcher:
+    """Pool of worker threads, each with a bounded queue of its own. Chat id decides the worker.
+    When a worker's queue is full, submit waits for up to submit_timeout seconds (this slows down
+    whoever feeds the dispatcher, e.g. polling), then gives up and counts the message as rejected.
+    With admission, handler drops messages of users and chats that are over their limits before they
+    get anywhere near a queue, and counts them as shed.
+    """
+
+    def __init__(self, workers: int = 8, queue_size: int = 100, submit_timeout: float = 5,
+                 admission: Union[Admission, None] = None):
+        if workers < 1 or queue_size < 1:
+            raise ValueError('Need at least one worker and a queue of at least one message')
+        self.submit_timeout = submit_timeout
+        self.admission = admission
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self._lock = threading.Lock()
+        self.processed = 0
+        self.rejected = 0
+        self.failed = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+        for number, worker_queue in enumerate(self._queues):
+            threading.Thread(target=self._work, args=(worker_queue,), name=f'dispatcher worker #{number}',
+                             daemon=True).start()
+
+    def submit(self, chat_id: int, func: callable, *args) -> bool:
+        """Schedules func(*args). Returns False if it was rejected because the queue is full."""
+        try:
+            self._queues[hash(chat_id) % len(self._queues)].put((time.perf_counter(), func, args),
+                                                                 timeout=self.submit_timeout)
+        except queue.Full:
+            with self._lock:
+                self.rejected += 1
+            return False
+        return True
+
+    def handler(self, func: callable) -> callable:
+        """Decorator for bot handlers that take a message: handler gets called on a worker thread.
+        Put it below bot.message_handler decorator.
+        """
+        def wrapper(message):
+            if self.admission is not None and not self.admission.admit(message.from_user.id, message.chat.id):
+                return
+            self.submit(message.chat.id, func, message)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+
+    def _work(self, worker_queue: queue.Queue):
+        while True:
+            submitted_at, func, args = worker_queue.get()
+            try:
+                func(*args)
+            except Exception:  # one broken message shouldn't kill the worker
+                traceback.print_exc()
+                with self._lock:
+                    self.failed += 1
+            latency = time.perf_counter() - submitted_at
+            with self._lock:
+                self.processed += 1
+                self._latency_total += latency
+                self._latency_max = max(self._latency_max, latency)
+            worker_queue.task_done()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(worker_queue.qsize() for worker_queue in self._queues)
+
+    def join(self):
+        """Waits until everything submitted so far is processed."""
+        for worker_queue in self._queues:
+            worker_queue.join()
+
+    def stats(self) -> dict:
+        """Queue depth, message counters and latency (seconds from submit until handler returned)."""
+        with self._lock:
+            return {'queue_depth': self.queue_depth,
+                    'processed': self.processed,
+                    'rejected': self.rejected,
+                    'failed': self.failed,
+                    'shed': self.admission.shed if self.admission is not None else 0,
+                    'latency_avg': self._latency_total / self.processed if self.processed else 0.0,
+                    'latency_max': self._latency_max}
+
+    def metrics(self) -> list:
+        """Collector for METRICS: message counters (only ever grow) and gauges for the rest of stats."""
+        answer = []
+        for key, value in self.stats().items():
+            if key in ('processed', 'rejected', 'failed', 'shed'):
+                answer.append((f'dispatcher_{key}_total', 'counter', f'Messages {key} by ChatDispatcher', {}, value))
+            else:
+                answer.append((f'dispatcher_{key}', 'gauge', f'ChatDispatcher {key}', {}, value))
+        return answer
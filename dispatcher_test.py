@@ -0,0 +1,69 @@
+import threading
+import time
+import types
+import unittest
+from dispatcher import *
+
+
+class ChatDispatcherTest(unittest.TestCase):
+
+    def test_chat_order(self):
+        dispatcher = ChatDispatcher(workers=4, queue_size=1000)
+        replies = {chat_id: [] for chat_id in range(10)}
+        for number in range(100):
+            for chat_id in replies:
+                dispatcher.submit(chat_id, replies[chat_id].append, number)
+        dispatcher.join()
+        for chat_id in replies:
+            self.assertEqual(replies[chat_id], list(range(100)))
+        self.assertEqual(dispatcher.stats()['processed'], 1000)
+
+    def test_slow_chat_does_not_block_others(self):
+        dispatcher = ChatDispatcher(workers=2, queue_size=10)
+        release = threading.Event()
+        done = threading.Event()
+        dispatcher.submit(0, release.wait)
+        dispatcher.submit(1, done.set)
+        self.assertTrue(done.wait(1))
+        release.set()
+
+    def test_back_pressure(self):
+        dispatcher = ChatDispatcher(workers=1, queue_size=1, submit_timeout=0.01)
+        release = threading.Event()
+        dispatcher.submit(0, release.wait)
+        time.sleep(0.05)  # let worker pick up the first one
+        self.assertTrue(dispatcher.submit(0, lambda: None))
+        self.assertFalse(dispatcher.submit(0, lambda: None))
+        stats = dispatcher.stats()
+        self.assertEqual(stats['rejected'], 1)
+        self.assertEqual(stats['queue_depth'], 1)
+        release.set()
+        dispatcher.join()
+
+    def test_failing_handler(self):
+        dispatcher = ChatDispatcher(workers=1)
+        dispatcher.submit(0, lambda: 1 / 0)
+        dispatcher.submit(0, lambda: None)
+        dispatcher.join()
+        self.assertEqual(dispatcher.stats()['failed'], 1)
+        self.assertEqual(dispatcher.stats()['processed'], 2)
+        metrics = {name: (kind, value) for name, kind, _, _, value in dispatcher.metrics()}
+        self.assertEqual(metrics['dispatcher_failed_total'], ('counter', 1))
+        self.assertEqual(metrics['dispatcher_queue_depth'], ('gauge', 0))
+
+    def test_admission(self):
+        dispatcher = ChatDispatcher(workers=1, admission=Admission(user_rate=0.001, user_burst=2,
+                                                                   chat_rate=1000, chat_burst=1000))
+        handled = []
+        handler = dispatcher.handler(handled.append)
+        messages = [types.SimpleNamespace(chat=types.SimpleNamespace(id=-1), from_user=types.SimpleNamespace(id=user))
+                    for user in (1, 1, 1, 2)]
+        for message in messages:
+            handler(message)
+        dispatcher.join()
+        self.assertEqual(handled, [messages[0], messages[1], messages[3]])
+        self.assertEqual(dispatcher.stats()['shed'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,228 @@
+"""Feeds the parsers nasty messages and measures the worst case: how long the slowest message takes to answer.
+Works offline, rates are frozen from the fixture (replay_rates.json) same as in replay_benchmark.py.
+
+python fuzz_benchmark.py                         # exit code 1 if something crashed or took longer than --budget
+python fuzz_benchmark.py --save before.json      # remember results of this revision...
+python fuzz_benchmark.py --baseline before.json  # ...and compare another one with them (exit code 1 on regression)
+
+Messages are made by generators: families of known troublemakers (long numbers, operator chains, parentheses,
+synonyms glued together, lots of words for ParserCase to split...) and random mixes of pieces of expressions.
+Each of them is made as large as the parser lets through (just under max_length characters and max_tokens
+tokens, with fewer pieces but the same tail, like "in eur"), and larger than that (to see refusal is cheap too).
+Caches are cleared before every message.
+Every regex run on messages is also checked for linear time: time of a 4 times longer input should be
+about 4 times longer, not 16 times.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from replay_benchmark import RATES_PATH, freeze_rates
+
+PIECES = ('1', '12', '0', '.', ',', "'", 'e', 'e+', '-', '+', '*', '/', '^', '**', '(', ')', ' ', ' ', ' ',
+          'usd', 'USD', 'eur', 'бакс', 'баксов', 'рубл', '$', '€', 'in', 'в', 'sqrt', 'root',
+          '2022-06-01', '01.06.2022', 'x', 'ё')
+MESSAGE_LENGTH = 500
+
+
+def repeat(piece: str, tail: str = '') -> callable:
+    """Generator of piece repeated as many times as fits into size characters (followed by tail).
+    Smaller sizes drop whole pieces from the front, tail stays.
+    """
+    def generate(size: int, rng: random.Random) -> str:
+        return piece * max(1, (size - len(tail)) // len(piece)) + tail
+    return generate
+
+
+def nested(size: int, rng: random.Random) -> str:
+    depth = (size - 1) // 2
+    return '(' * depth + '1' + ')' * depth
+
+
+def random_mix(size: int, rng: random.Random) -> str:
+    pieces = []
+    length = 0
+    while length < size:
+        pieces.append(rng.choice(PIECES))
+        length += len(pieces[-1])
+    return ''.join(pieces)[:size]
+
+
+GENERATORS = {
+    'long number': repeat('1'),
+    'digit groups': repeat('1,', 'x'),
+    'apostrophes': repeat("1'", 'x'),
+    'dots': repeat('1.'),
+    'exponents': repeat('1e'),
+    'dates': repeat('2022-06-01-'),
+    'plus chain': repeat('1+', '1'),
+    'power chain': repeat('2^', '2'),
+    'unary chain': repeat('- ', '1'),
+    'parentheses': nested,
+    'implicit chain': repeat('1 usd ', 'in eur'),
+    'words': repeat('usd ', 'in eur'),
+    'numbers': repeat('1 ', 'usd in eur'),
+    'synonyms': repeat('баксов', ' in eur'),
+    'synonym words': repeat('бакс ', 'в бакс'),
+    'long word': repeat('x', ' in eur'),
+    'random': random_mix,
+}
+
+
+def shrink(generator: callable, parser, tokenize: callable, seed: int) -> str:
+    """Largest message of generator that parser doesn't refuse for its size (tokenize must not refuse it).
+    Messages are made again, smaller and smaller, rather than cut: cutting would lose tails like "in eur".
+    """
+    size = max_length(parser)
+    while True:
+        message = generator(size, random.Random(seed))
+        if size <= 1 or len(message) <= max_length(parser) and \
+                len(tokenize(message)) <= getattr(parser, 'max_tokens', float('inf')):
+            return message
+        size = size * 9 // 10
+
+
+def max_length(parser) -> int:
+    """Parsers of old revisions had no limits, their messages are as long as those of new ones by default."""
+    return getattr(parser, 'max_length', MESSAGE_LENGTH)
+
+
+def measure(parser, message: str, repeats: int) -> tuple:
+    """(Median time to answer message from scratch, answer). Raises whatever parse raises."""
+    times = []
+    answer = None
+    for _ in range(repeats):
+        parser.clear_cache()
+        if hasattr(parser, 'clear_plans'):
+            parser.clear_plans()
+        started = time.perf_counter()
+        answer = parser.parse(message)
+        times.append(time.perf_counter() - started)
+    times.sort()
+    return times[len(times) // 2], answer
+
+
+def regex_growth(parser, rng: random.Random, size: int = 2000) -> dict:
+    """How many times longer every regex (tokenizer, operand checks) takes on a 4 times longer input,
+    for the generator that is worst for it. About 4 is linear.
+    """
+    checks = {'tokenizer': lambda string: sum(1 for _ in parser._token_regex.finditer(string))}
+    for operand in parser.operands:
+        checks[f'{operand.operand_type} operand'] = operand.check
+
+    def best_time(check, string):
+        best = float('inf')
+        for _ in range(9):
+            started = time.perf_counter()
+            check(string)
+            best = min(best, time.perf_counter() - started)
+        return best
+
+    growth = {}
+    for name, check in checks.items():
+        worst = 0.0
+        for generator in GENERATORS.values():
+            small = best_time(check, generator(size, random.Random(0)))
+            large = best_time(check, generator(size * 4, random.Random(0)))
+            worst = max(worst, large / max(small, 1e-7))
+        growth[name] = worst
+    return growth
+
+
+def run(samples: int = 50, repeats: int = 5, seed: int = 0) -> dict:
+    from bot_parser import engine
+
+    telegram_parser = engine.telegram_parser
+
+    def telegram_tokens(string: str) -> list:
+        return [match for match in telegram_parser._token_regex.finditer(string) if match.lastgroup != 'space']
+
+    parsers = {'telegram': (telegram_parser, telegram_tokens), 'case': (engine.case_parser, str.split)}
+    rng = random.Random(seed)
+    report = {'parsers': {}, 'crashes': []}
+    for parser_name, (parser, tokenize) in parsers.items():
+        worst = {}
+        for generator_name, generator in GENERATORS.items():
+            seeds = [rng.randrange(2 ** 32) for _ in range(samples if generator is random_mix else 1)]
+            too_long = generator(max_length(parser), random.Random(seeds[0]))
+            messages = [shrink(generator, parser, tokenize, seed) for seed in seeds] + \
+                [too_long + 'x' * (max_length(parser) + 1 - len(too_long))]
+            slowest = 0.0, ''
+            for message in messages:
+                try:
+                    seconds, answer = measure(parser, message, repeats)
+                    if not isinstance(answer, str):
+                        raise TypeError(f'Answer is {type(answer).__name__}, not str')
+                except Exception as e:  # that's what fuzzing is for
+                    report['crashes'].append({'parser': parser_name, 'message': message,
+                                              'error': f'{type(e).__name__}: {e}'})
+                    continue
+                slowest = max(slowest, (seconds, message))
+            worst[generator_name] = {'worst_ms': slowest[0] * 1000, 'message': slowest[1][:80]}
+        report['parsers'][parser_name] = worst
+    report['worst_ms'] = max(stats['worst_ms'] for worst in report['parsers'].values() for stats in worst.values())
+    report['regex_growth'] = regex_growth(engine.telegram_parser, rng)
+    return report
+
+
+def print_report(report: dict):
+    for parser_name, worst in report['parsers'].items():
+        print(f'{parser_name} parser')
+        for generator_name, stats in worst.items():
+            print(f'  {generator_name:<16}{stats["worst_ms"]:>9.2f} ms  {stats["message"]!r}')
+    print(f'worst case: {report["worst_ms"]:.2f} ms')
+    print('regex time growth for 4x longer input: ' +
+          ', '.join(f'{name} {growth:.1f}x' for name, growth in report['regex_growth'].items()))
+    for crash in report['crashes']:
+        print(f'CRASH {crash["parser"]} parser: {crash["error"]} on {crash["message"][:80]!r}')
+
+
+def problems(report: dict, budget_ms: float, baseline: dict = None, tolerance: float = 0.5) -> list:
+    found = [f'crash: {crash["error"]}' for crash in report['crashes']]
+    if report['worst_ms'] > budget_ms:
+        found.append(f'worst case {report["worst_ms"]:.2f} ms, budget is {budget_ms} ms')
+    for name, growth in report['regex_growth'].items():
+        if growth > 8:  # linear is 4, quadratic is 16
+            found.append(f'{name} is not linear: {growth:.1f}x time for 4x input')
+    if baseline is not None:
+        if report['worst_ms'] > baseline['worst_ms'] * (1 + tolerance):
+            found.append(f'worst case: {baseline["worst_ms"]:.2f} -> {report["worst_ms"]:.2f} ms')
+        for parser_name, worst in report['parsers'].items():
+            for generator_name, stats in worst.items():
+                before = baseline['parsers'].get(parser_name, {}).get(generator_name)
+                # tiny ones are all noise
+                if before is not None and stats['worst_ms'] > max(before['worst_ms'] * (1 + tolerance), 0.5):
+                    found.append(f'{parser_name} parser, {generator_name}: '
+                                 f'{before["worst_ms"]:.2f} -> {stats["worst_ms"]:.2f} ms')
+    return found
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Measures worst case latency of the parsers on nasty messages.')
+    arguments.add_argument('--rates', default=RATES_PATH, help='json file with {"fetched_at": ..., "rates": {...}}')
+    arguments.add_argument('--samples', type=int, default=50, help='random messages per parser')
+    arguments.add_argument('--repeats', type=int, default=5, help='times every message is parsed (median counts)')
+    arguments.add_argument('--seed', type=int, default=0, help='seed of random messages')
+    arguments.add_argument('--budget', type=float, default=20, help='worst case that is still fine, ms')
+    arguments.add_argument('--save', metavar='PATH', help='save results as json')
+    arguments.add_argument('--baseline', metavar='PATH', help='compare with results saved by --save')
+    arguments.add_argument('--tolerance', type=float, default=0.5,
+                           help='how much worse than baseline is still fine (0.5 is 50%%)')
+    arguments = arguments.parse_args()
+
+    freeze_rates(arguments.rates)
+    result = run(arguments.samples, arguments.repeats, arguments.seed)
+    print_report(result)
+    if arguments.save:
+        with open(arguments.save, 'w', encoding='utf-8') as output:
+            json.dump(result, output, indent=4, ensure_ascii=False)
+    baseline_report = None
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as baseline_file:
+            baseline_report = json.load(baseline_file)
+    found_problems = problems(result, arguments.budget, baseline_report, arguments.tolerance)
+    for problem in found_problems:
+        print(f'REGRESSION {problem}')
+    sys.exit(1 if found_problems else 0)
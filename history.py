@@ -0,0 +1,244 @@
+"""This file defines RatesHistory: every day's currency rates, kept on disk so the bot can answer questions
+about the past ("100 usd in eur 2022-06-01") without asking anyone.
+Storage is columnar: a directory with one file of dates (dates.i4, int32 ordinals, sorted) and one file
+per currency (EUR.f8, float64 rate against the base currency, NaN if there was no rate that day).
+Row n of every file is the same day. Files are only ever appended to (or the last row is rewritten),
+and they are memory-mapped for reading, so a lookup touches a few pages instead of loading everything.
+"""
+
+from datetime import date, datetime, timezone
+import os
+import re
+import threading
+from typing import Union
+
+_DATES = 'dates.i4'
+_COLUMN = '.f8'
+_CODE = re.compile(r'[A-Z]{3}')  # currency codes become file names, nothing else may
+
+
+class _PairAggregates:
+    """Aggregates of one currency pair over the whole history: prefix sums (for averages) and
+    sparse tables (for min/max), so any range is answered in O(1).
+    """
+    __slots__ = ('values', 'sums', 'counts', 'minimums', 'maximums')
+
+    def __init__(self, values):
+        import numpy
+        self.values = values
+        known = ~numpy.isnan(values)
+        self.sums = numpy.concatenate(([0.0], numpy.cumsum(numpy.where(known, values, 0.0))))
+        self.counts = numpy.concatenate(([0], numpy.cumsum(known)))
+        self.minimums = [values]  # minimums[k][i] is the minimum of values[i:i + 2 ** k]
+        self.maximums = [values]
+        width = 1
+        while width * 2 <= len(values):
+            self.minimums.append(numpy.fmin(self.minimums[-1][:-width], self.minimums[-1][width:]))
+            self.maximums.append(numpy.fmax(self.maximums[-1][:-width], self.maximums[-1][width:]))
+            width *= 2
+
+    def range(self, start: int, end: int) -> Union[tuple, None]:
+        """(min, max, average, number of known values, first and last known row) of rows start...end - 1,
+        None if none of them is known.
+        """
+        import numpy
+        count = int(self.counts[end] - self.counts[start])
+        if not count:
+            return None
+        level = (end - start).bit_length() - 1
+        width = 1 << level
+        # either half may have no known values at all (NaN), fmin/fmax skip it like they do in the tables
+        minimum = numpy.fmin(self.minimums[level][start], self.minimums[level][end - width])
+        maximum = numpy.fmax(self.maximums[level][start], self.maximums[level][end - width])
+        # counts go up by one at every known row
+        first = int(numpy.searchsorted(self.counts, self.counts[start], side='right')) - 1
+        last = int(numpy.searchsorted(self.counts, self.counts[end], side='left')) - 1
+        return float(minimum), float(maximum), float(self.sums[end] - self.sums[start]) / count, count, first, last
+
+
+class RatesHistory:
+    """Rates of every day, stored in directory (it's created on first append).
+    One process appends (the one that fetches rates), any number of them may read the same directory.
+    append(rates, fetched_at) adds a row for the day (UTC) of fetched_at, or replaces that day's row
+    if there is one already: the last rates fetched during a day become the rates of that day.
+    Lookups find the row in O(log n) (binary search by date). If there's no row for the day itself
+    (bot was down), the closest earlier day is used, as long as it's not more than max_gap days older.
+    Aggregates (min/max/average over a range of days) are prepared once per currency pair and history
+    version, for up to aggregate_cache_size pairs.
+    """
+
+    def __init__(self, directory: str, max_gap: int = 7, aggregate_cache_size: int = 64):
+        self.directory = directory
+        self.max_gap = max_gap
+        self.aggregate_cache_size = aggregate_cache_size
+        self._lock = threading.Lock()
+        self._version = None  # (size, modification time) of dates file the maps below were made for
+        self._dates = None  # memory-mapped dates (None until the files are mapped)
+        self._columns = {}  # currency code -> memory-mapped column
+        self._aggregates = {}  # (orig currency, target currency) -> _PairAggregates of current version
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _refresh(self):
+        """Maps the files again if somebody has appended to them. Must hold the lock."""
+        import numpy
+        try:
+            stat = os.stat(self._path(_DATES))
+            version = stat.st_size, stat.st_mtime_ns
+        except FileNotFoundError:
+            version = None
+        if self._dates is not None and version == self._version:
+            return
+        self._version = version
+        self._aggregates = {}
+        self._columns = {}
+        rows = version[0] // 4 if version is not None else 0
+        if not rows:
+            self._dates = numpy.zeros(0, dtype=numpy.int32)
+            return
+        self._dates = numpy.memmap(self._path(_DATES), dtype=numpy.int32, mode='r', shape=(rows,))
+        for name in os.listdir(self.directory):
+            # a column shorter than dates is being written right now (new currency), it'll be there next time
+            if name.endswith(_COLUMN) and _CODE.fullmatch(name[:-len(_COLUMN)]) and \
+                    os.path.getsize(self._path(name)) >= rows * 8:
+                self._columns[name[:-len(_COLUMN)]] = numpy.memmap(self._path(name), dtype=numpy.float64,
+                                                                   mode='r', shape=(rows,))
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._dates)
+
+    def span(self) -> Union[tuple, None]:
+        """(first day, last day) or None if history is empty."""
+        with self._lock:
+            self._refresh()
+            if not len(self._dates):
+                return None
+            return date.fromordinal(int(self._dates[0])), date.fromordinal(int(self._dates[-1]))
+
+    def append(self, rates: dict, fetched_at: float):
+        """Adds rates fetched at fetched_at (unix time). Days must not go back in time (ValueError).
+        Codes other than three capital letters are left out. Rates are fetched every few minutes,
+        so if the day is there already only the columns whose rate has changed are written (nothing at all if none).
+        """
+        import numpy
+        day = datetime.fromtimestamp(fetched_at, timezone.utc).date().toordinal()
+        rates = {code: value for code, value in rates.items() if _CODE.fullmatch(code)}
+        with self._lock:
+            self._refresh()
+            rows = len(self._dates)
+            last_day = int(self._dates[-1]) if rows else None
+            if last_day is not None and day < last_day:
+                raise ValueError(f'History already has {date.fromordinal(last_day)}, '
+                                 f'can\'t add {date.fromordinal(day)}')
+            row = rows - 1 if day == last_day else rows
+            changed = {}
+            for code in set(rates) | set(self._columns):
+                value = numpy.float64(rates.get(code, float('nan')))
+                column = self._columns.get(code)
+                if row < rows and column is not None and (column[row] == value or
+                                                          numpy.isnan(column[row]) and numpy.isnan(value)):
+                    continue
+                changed[code] = value
+            if row < rows and not changed:
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            # columns first, dates last: a row exists once its date is written (or replaced)
+            for code, value in changed.items():
+                path = self._path(code + _COLUMN)
+                with open(path, 'r+b' if os.path.exists(path) else 'w+b') as file:
+                    file.seek(0, os.SEEK_END)
+                    if file.tell() < row * 8:  # new currency: nothing was known about it before
+                        file.write(numpy.full(row - file.tell() // 8, numpy.nan).tobytes())
+                    file.seek(row * 8)
+                    file.write(value.tobytes())
+                    file.truncate()
+            with open(self._path(_DATES), 'r+b' if rows else 'wb') as file:
+                file.seek(row * 4)
+                file.write(numpy.int32(day).tobytes())
+                file.truncate()
+            self._dates = None  # maps are made again on next use
+
+    def _row(self, day: date) -> Union[int, None]:
+        """Row of day (or of the closest earlier one, see max_gap). Must hold the lock."""
+        import numpy
+        ordinal = day.toordinal()
+        row = int(numpy.searchsorted(self._dates, ordinal, side='right')) - 1
+        if row < 0 or ordinal - int(self._dates[row]) > self.max_gap:
+            return None
+        return row
+
+    def rate(self, orig_currency: str, target_currency: str, day: date) -> Union[tuple, None]:
+        """(day the rate is from, how many target_currency you got for 1 orig_currency that day)
+        or None if history doesn't know.
+        """
+        with self._lock:
+            self._refresh()
+            row = self._row(day)
+            orig = self._columns.get(orig_currency)
+            target = self._columns.get(target_currency)
+            if row is None or orig is None or target is None:
+                return None
+            rate = float(target[row] / orig[row])
+            if rate != rate:  # NaN, one of them had no rate that day
+                return None
+            return date.fromordinal(int(self._dates[row])), rate
+
+    def rates_on(self, day: date) -> Union[tuple, None]:
+        """(day the rates are from, {currency code: rate against base currency}) or None."""
+        with self._lock:
+            self._refresh()
+            row = self._row(day)
+            if row is None:
+                return None
+            rates = {code: float(column[row]) for code, column in self._columns.items()}
+            return date.fromordinal(int(self._dates[row])), {code: rate for code, rate in rates.items()
+                                                             if rate == rate}
+
+    def stats(self, orig_currency: str, target_currency: str, days: int = 30,
+              end: Union[date, None] = None) -> Union[dict, None]:
+        """Min, max and average rate of orig_currency in target_currency over days days up to end
+        (last day in history by default). None if history doesn't know any of them.
+        """
+        import numpy
+        with self._lock:
+            self._refresh()
+            if not len(self._dates):
+                return None
+            end_ordinal = end.toordinal() if end is not None else int(self._dates[-1])
+            aggregates = self._pair_aggregates(orig_currency, target_currency)
+            if aggregates is None:
+                return None
+            stop = int(numpy.searchsorted(self._dates, end_ordinal, side='right'))
+            start = int(numpy.searchsorted(self._dates, end_ordinal - days + 1, side='left'))
+            if start >= stop:
+                return None
+            found = aggregates.range(start, stop)
+            if found is None:
+                return None
+            minimum, maximum, average, count, first, last = found
+            return {'from': date.fromordinal(int(self._dates[first])),
+                    'to': date.fromordinal(int(self._dates[last])),
+                    'days': count, 'min': minimum, 'max': maximum, 'avg': average}
+
+    def _pair_aggregates(self, orig_currency: str, target_currency: str) -> Union[_PairAggregates, None]:
+        """Must hold the lock."""
+        import numpy
+        key = orig_currency, target_currency
+        aggregates = self._aggregates.pop(key, None)
+        if aggregates is None:
+            orig = self._columns.get(orig_currency)
+            target = self._columns.get(target_currency)
+            if orig is None or target is None:
+                return None
+            aggregates = _PairAggregates(numpy.asarray(target / orig))
+        self._aggregates[key] = aggregates  # most recently used ones are at the end
+        while len(self._aggregates) > self.aggregate_cache_size:
+            del self._aggregates[next(iter(self._aggregates))]
+        return aggregates
+
+
+if __name__ == '__main__':
+    print(__doc__)
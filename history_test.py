@@ -0,0 +1,97 @@
+from datetime import date
+import os
+import tempfile
+import unittest
+from history import *
+
+DAY = 24 * 60 * 60
+JUNE_1 = 1654041600  # 2022-06-01 00:00 UTC
+
+
+class RatesHistoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.history = RatesHistory(os.path.join(self.directory.name, 'history'), max_gap=3)
+        for day in range(10):
+            if day in (4, 5):  # bot was down
+                continue
+            rates = {'USD': 1, 'EUR': 0.9 + day / 100, 'RUB': 80 + day}
+            if day >= 7:
+                rates['GEL'] = 2.7
+            self.history.append(rates, JUNE_1 + day * DAY + 3600)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_empty(self):
+        history = RatesHistory(os.path.join(self.directory.name, 'nothing'))
+        self.assertEqual(len(history), 0)
+        self.assertIsNone(history.span())
+        self.assertIsNone(history.rate('USD', 'EUR', date(2022, 6, 1)))
+        self.assertIsNone(history.stats('USD', 'EUR'))
+
+    def test_rate(self):
+        self.assertEqual(len(self.history), 8)
+        self.assertEqual(self.history.span(), (date(2022, 6, 1), date(2022, 6, 10)))
+        self.assertEqual(self.history.rate('USD', 'RUB', date(2022, 6, 3)), (date(2022, 6, 3), 82))
+        self.assertEqual(self.history.rate('RUB', 'USD', date(2022, 6, 1)), (date(2022, 6, 1), 1 / 80))
+        self.assertEqual(self.history.rate('USD', 'RUB', date(2022, 6, 6)), (date(2022, 6, 4), 83))  # gap
+        self.assertIsNone(self.history.rate('USD', 'RUB', date(2022, 5, 31)))
+        self.assertIsNone(self.history.rate('USD', 'RUB', date(2022, 6, 14)))  # more than max_gap days later
+        self.assertIsNone(self.history.rate('USD', 'GEL', date(2022, 6, 1)))  # not known back then
+        self.assertEqual(self.history.rate('USD', 'GEL', date(2022, 6, 9)), (date(2022, 6, 9), 2.7))
+        self.assertIsNone(self.history.rate('USD', 'XXX', date(2022, 6, 9)))
+
+    def test_append(self):
+        self.history.append({'USD': 1, 'EUR': 1, 'RUB': 100}, JUNE_1 + 9 * DAY + 7200)  # same day again
+        self.assertEqual(len(self.history), 8)
+        self.assertEqual(self.history.rate('USD', 'RUB', date(2022, 6, 10)), (date(2022, 6, 10), 100))
+        self.assertIsNone(self.history.rate('USD', 'GEL', date(2022, 6, 10)))  # gone
+        with self.assertRaises(ValueError):
+            self.history.append({'USD': 1}, JUNE_1)
+        # another reader of the same directory sees everything
+        reader = RatesHistory(self.history.directory)
+        self.assertEqual(reader.rates_on(date(2022, 6, 10)), (date(2022, 6, 10), {'USD': 1, 'EUR': 1, 'RUB': 100}))
+
+    def test_only_changes_are_written(self):
+        directory = self.history.directory
+        for name in os.listdir(directory):
+            os.utime(os.path.join(directory, name), ns=(0, 0))
+        self.history.append({'USD': 1, 'EUR': 0.99, 'RUB': 89, 'GEL': 2.7}, JUNE_1 + 9 * DAY + 7200)  # same rates
+        self.history.append({'USD': 1, 'EUR': 0.99, 'RUB': 90, 'GEL': 2.7}, JUNE_1 + 9 * DAY + 9000)
+        touched = sorted(name for name in os.listdir(directory) if os.stat(os.path.join(directory, name)).st_mtime_ns)
+        self.assertEqual(touched, ['RUB.f8', 'dates.i4'])
+        self.assertEqual(self.history.rate('USD', 'RUB', date(2022, 6, 10)), (date(2022, 6, 10), 90))
+
+    def test_codes(self):
+        self.history.append({'USD': 1, 'EUR': 1, '../../USD': 5, 'usd': 2, 'EURO': 3, '': 4}, JUNE_1 + 10 * DAY)
+        self.assertEqual(sorted(os.listdir(self.history.directory)),
+                         ['EUR.f8', 'GEL.f8', 'RUB.f8', 'USD.f8', 'dates.i4'])
+        self.assertEqual(os.listdir(self.directory.name), ['history'])
+        self.assertEqual(self.history.rate('USD', 'EUR', date(2022, 6, 11)), (date(2022, 6, 11), 1))
+
+    def test_stats(self):
+        stats = self.history.stats('USD', 'RUB', days=5)  # June 6th - 10th, 5th and 6th are missing
+        self.assertEqual((stats['from'], stats['to'], stats['days']), (date(2022, 6, 7), date(2022, 6, 10), 4))
+        self.assertEqual((stats['min'], stats['max'], stats['avg']), (86, 89, 87.5))
+        stats = self.history.stats('RUB', 'USD', days=3, end=date(2022, 6, 3))
+        self.assertAlmostEqual(stats['max'], 1 / 80)
+        self.assertAlmostEqual(stats['avg'], (1 / 80 + 1 / 81 + 1 / 82) / 3)
+        stats = self.history.stats('EUR', 'GEL', days=30)
+        self.assertEqual((stats['from'], stats['days']), (date(2022, 6, 8), 3))  # unknown days are skipped
+        self.assertIsNone(self.history.stats('USD', 'RUB', days=3, end=date(2022, 5, 20)))
+
+    def test_stats_of_new_currency(self):
+        # GEL appeared on June 8th, these ranges start before it
+        for days, end, known in ((3, date(2022, 6, 8), 1), (8, date(2022, 6, 9), 2), (10, None, 3)):
+            stats = self.history.stats('USD', 'GEL', days=days, end=end)
+            self.assertEqual((stats['from'], stats['to']), (date(2022, 6, 8), end or date(2022, 6, 10)))
+            self.assertEqual((stats['min'], stats['max'], stats['days']), (2.7, 2.7, known))
+            self.assertAlmostEqual(stats['avg'], 2.7)
+        stats = self.history.stats('GEL', 'RUB', days=30)
+        self.assertEqual((stats['from'], stats['to']), (date(2022, 6, 8), date(2022, 6, 10)))
+        self.assertEqual((stats['min'], stats['max']), (87 / 2.7, 89 / 2.7))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+"""This file defines RateLimiter, which keeps one user (or chat) from taking all the bot's time, and Admission,
+which puts a limiter per user and a limiter per chat in front of the handlers.
+Limits are GCRA (a token bucket that only needs one number per key): a key may send rate messages per second
+on average, and up to burst of them at once. Messages over the limit are shed: nobody parses or answers them.
+"""
+
+from array import array
+import threading
+import time
+from typing import Union
+
+_EMPTY = -2 ** 63  # no telegram id is that small
+_MIX = 0x9E3779B97F4A7C15  # spreads consecutive ids over the table
+
+
+class RateLimiter:
+    """GCRA limiter for integer keys (user or chat ids): rate requests per second, bursts of up to burst.
+    State is one float per key: theoretical arrival time (TAT), the moment the key's bucket is full again.
+    Keys and TATs live in two arrays (open addressing, linear probing), 16 bytes per slot and the table
+    is at most half full, so a million keys take about 32 MB and no python object is made per key.
+    A key whose TAT has passed is no different from a key that was never seen, so its slot is free to take
+    (lazy expiry): such slots are reused on insertion and dropped whenever the table is rebuilt.
+    Every check is a hash, a probe or two and a comparison. Rejected checks don't change anything.
+    """
+
+    def __init__(self, rate: float, burst: int = 1, capacity: int = 1024, clock: callable = time.monotonic):
+        if rate <= 0 or burst < 1:
+            raise ValueError('Rate must be positive and burst at least 1')
+        self.interval = 1 / rate  # seconds one request takes from the bucket
+        self.tolerance = self.interval * (burst - 1)  # how far ahead of now TAT may get
+        self.clock = clock
+        size = 8
+        while size < capacity * 2:
+            size *= 2
+        self._keys = array('q', [_EMPTY]) * size
+        self._tats = array('d', [0.0]) * size
+        self._used = 0  # slots that aren't empty (including expired ones)
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.shed = 0
+
+    def _slot(self, key: int, now: float) -> int:
+        """Slot of key, or a free one (expired or empty) to put it into. Must hold the lock."""
+        keys, tats = self._keys, self._tats
+        mask = len(keys) - 1
+        index = ((key * _MIX) >> 16) & mask
+        free = -1
+        while True:
+            stored = keys[index]
+            if stored == key:
+                return index
+            if stored == _EMPTY:
+                return index if free < 0 else free
+            if free < 0 and tats[index] <= now:  # expired: reusable, but key may still be further on
+                free = index
+            index = (index + 1) & mask
+
+    def allow(self, key: int) -> bool:
+        """Takes one request from key's bucket. False if it's empty (request should be shed)."""
+        with self._lock:
+            now = self.clock()
+            index = self._slot(key, now)
+            keys, tats = self._keys, self._tats
+            tat = tats[index] if keys[index] == key and tats[index] > now else now
+            if tat - now > self.tolerance:
+                self.shed += 1
+                return False
+            if keys[index] == _EMPTY:
+                self._used += 1
+            keys[index] = key
+            tats[index] = tat + self.interval
+            self.allowed += 1
+            if self._used * 2 > len(keys):
+                self._rebuild(now)
+            return True
+
+    def _rebuild(self, now: float):
+        """Moves keys that haven't expired into a new table, twice as large if they fill more than a quarter of
+        the old one. Must hold the lock.
+        """
+        keys, tats = self._keys, self._tats
+        live = [(key, tat) for key, tat in zip(keys, tats) if key != _EMPTY and tat > now]
+        size = len(keys) * 2 if len(live) * 4 > len(keys) else len(keys)
+        self._keys = array('q', [_EMPTY]) * size
+        self._tats = array('d', [0.0]) * size
+        self._used = len(live)
+        for key, tat in live:
+            index = self._slot(key, now)
+            self._keys[index] = key
+            self._tats[index] = tat
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {'keys': self._used,
+                    'capacity': len(self._keys) // 2,
+                    'bytes': self._keys.itemsize * len(self._keys) + self._tats.itemsize * len(self._tats),
+                    'allowed': self.allowed,
+                    'shed': self.shed}
+
+
+class Admission:
+    """Per user and per chat limits (a group chat may have lots of users, each of them within limits).
+    admit(user_id, chat_id) checks the user first, so a spamming user doesn't use up the chat's limit.
+    """
+
+    def __init__(self, user_rate: float, user_burst: int, chat_rate: float, chat_burst: int, **kwargs):
+        self.users = RateLimiter(user_rate, user_burst, **kwargs)
+        self.chats = RateLimiter(chat_rate, chat_burst, **kwargs)
+
+    def admit(self, user_id: int, chat_id: Union[int, None] = None) -> bool:
+        if not self.users.allow(user_id):
+            return False
+        return chat_id is None or chat_id == user_id or self.chats.allow(chat_id)
+
+    @property
+    def shed(self) -> int:
+        return self.users.shed + self.chats.shed
+
+    def metrics(self) -> list:
+        """Collector for METRICS."""
+        answer = []
+        for kind, limiter in (('user', self.users), ('chat', self.chats)):
+            stats = limiter.stats()
+            answer += [('limiter_allowed_total', 'counter', 'Requests let through', {'limit': kind}, stats['allowed']),
+                       ('limiter_shed_total', 'counter', 'Requests shed for going over the limit', {'limit': kind},
+                        stats['shed']),
+                       ('limiter_keys', 'gauge', 'Users or chats the limiter keeps track of', {'limit': kind},
+                        stats['keys']),
+                       ('limiter_bytes', 'gauge', 'Memory taken by limiter tables', {'limit': kind},
+                        stats['bytes'])]
+        return answer
+
+
+if __name__ == '__main__':
+    print(__doc__)
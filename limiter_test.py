@@ -0,0 +1,98 @@
+import unittest
+from limiter import *
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_burst_then_rate(self):
+        limiter = RateLimiter(rate=2, burst=3, clock=self.clock)
+        self.assertEqual([limiter.allow(1) for _ in range(5)], [True, True, True, False, False])
+        self.clock.now += 0.5  # one request worth of time
+        self.assertTrue(limiter.allow(1))
+        self.assertFalse(limiter.allow(1))
+        self.clock.now += 10  # bucket is full again
+        self.assertEqual([limiter.allow(1) for _ in range(4)], [True, True, True, False])
+        self.assertEqual(limiter.stats()['shed'], 4)
+        self.assertEqual(limiter.stats()['allowed'], 7)
+
+    def test_keys_are_independent(self):
+        limiter = RateLimiter(rate=1, burst=1, clock=self.clock)
+        self.assertTrue(limiter.allow(1))
+        self.assertFalse(limiter.allow(1))
+        self.assertTrue(limiter.allow(-1))  # group chats have negative ids
+        self.assertTrue(limiter.allow(2 ** 40))
+
+    def test_rejection_changes_nothing(self):
+        limiter = RateLimiter(rate=1, burst=1, clock=self.clock)
+        limiter.allow(1)
+        for _ in range(100):
+            limiter.allow(1)
+        self.clock.now += 1  # spamming didn't push the next allowed moment further
+        self.assertTrue(limiter.allow(1))
+
+    def test_many_keys(self):
+        limiter = RateLimiter(rate=1, burst=2, capacity=16, clock=self.clock)
+        for key in range(10000):
+            self.assertTrue(limiter.allow(key))
+        for key in range(10000):
+            self.assertTrue(limiter.allow(key))
+        for key in range(0, 10000, 7):
+            self.assertFalse(limiter.allow(key))
+        self.assertEqual(limiter.stats()['keys'], 10000)
+
+    def test_expired_keys_are_dropped(self):
+        limiter = RateLimiter(rate=1, burst=1, capacity=16, clock=self.clock)
+        for round_number in range(100):
+            for key in range(10):
+                self.assertTrue(limiter.allow(round_number * 10 + key))
+            self.clock.now += 2
+        stats = limiter.stats()
+        self.assertLessEqual(stats['capacity'], 32)  # 1000 keys were seen, but only 10 at a time
+        self.assertLessEqual(stats['keys'], 32)
+
+    def test_expired_slot_reuse_keeps_state(self):
+        limiter = RateLimiter(rate=1, burst=1, capacity=16, clock=self.clock)
+        for key in range(20):  # some of them share probe sequences
+            limiter.allow(key)
+        self.clock.now += 0.5
+        limiter.allow(100)
+        self.clock.now += 0.6  # first 20 have expired, 100 hasn't
+        for key in range(1000, 1005):
+            limiter.allow(key)
+        self.assertFalse(limiter.allow(100))
+
+    def test_bad_limits(self):
+        self.assertRaises(ValueError, RateLimiter, 0)
+        self.assertRaises(ValueError, RateLimiter, 1, 0)
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def test_user_and_chat(self):
+        clock = Clock()
+        admission = Admission(user_rate=1, user_burst=2, chat_rate=1, chat_burst=3, clock=clock)
+        self.assertTrue(admission.admit(1, -100))
+        self.assertTrue(admission.admit(1, -100))
+        self.assertFalse(admission.admit(1, -100))  # user is over the limit
+        self.assertTrue(admission.admit(2, -100))
+        self.assertFalse(admission.admit(3, -100))  # chat is
+        self.assertTrue(admission.admit(3, 3))  # private chat: user limit only
+        self.assertTrue(admission.admit(4))  # inline query
+        self.assertEqual(admission.shed, 2)
+        shed = [value for name, _, _, labels, value in admission.metrics() if name == 'limiter_shed_total']
+        self.assertEqual(shed, [1, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
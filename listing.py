@@ -0,0 +1,64 @@
+"""This file defines CurrencyListing: the list of currencies for /values command.
+It is rendered once (per rates version) and split into pages that fit into a telegram message,
+so /values and flipping through its pages only pick a ready string.
+"""
+
+from typing import Union
+
+MESSAGE_LIMIT = 4096  # characters telegram allows in one message
+
+
+class CurrencyListing:
+    """Lines like "USD (US Dollar)" sorted by code, split into pages of up to page_size lines
+    (and no more than MESSAGE_LIMIT characters).
+    Pages are also prepared for every prefix of every code ("U", "US", "USD"), so filtering is a dict lookup.
+    Version is whatever the listing was built from (e.g. rates version), it is not used by the listing itself.
+    """
+
+    def __init__(self, codes, names: Union[dict, None] = None, page_size: int = 30, version=None):
+        if page_size < 1:
+            raise ValueError('Page must have at least one line')
+        self.page_size = page_size
+        self.version = version
+        names = names or {}
+        lines_by_prefix = {'': []}
+        for code in sorted(codes):
+            line = f'{code} ({names[code]})' if code in names else code
+            lines_by_prefix[''].append(line)
+            for length in range(1, len(code) + 1):
+                lines_by_prefix.setdefault(code[:length].upper(), []).append(line)
+        self.text = ''.join(f'{line}\n' for line in lines_by_prefix[''])
+        self._pages = {prefix: self._paginate(lines) for prefix, lines in lines_by_prefix.items()}
+
+    def _paginate(self, lines: list) -> list:
+        pages = []
+        page = []
+        length = 0
+        for line in lines:
+            if page and (len(page) == self.page_size or length + len(line) + 1 > MESSAGE_LIMIT):
+                pages.append('\n'.join(page))
+                page = []
+                length = 0
+            page.append(line)
+            length += len(line) + 1
+        if page:
+            pages.append('\n'.join(page))
+        return pages
+
+    def pages(self, prefix: str = '') -> list:
+        """Ready to send pages of currencies whose code starts with prefix. Empty list if there are none."""
+        return self._pages.get(prefix.strip().upper(), [])
+
+    def page(self, number: int, prefix: str = '') -> tuple:
+        """Returns (page, number, page count). Number is counted from 0 and clamped to existing pages.
+        Page is None if no code starts with prefix.
+        """
+        pages = self.pages(prefix)
+        if not pages:
+            return None, 0, 0
+        number = min(max(number, 0), len(pages) - 1)
+        return pages[number], number, len(pages)
+
+
+if __name__ == '__main__':
+    print(__doc__)
@@ -0,0 +1,37 @@
+import unittest
+from listing import *
+
+
+class CurrencyListingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.listing = CurrencyListing(['USD', 'EUR', 'UAH', 'RUB', 'XYZ'],
+                                       {'USD': 'US Dollar', 'EUR': 'Euro', 'UAH': 'Hryvnia', 'RUB': 'Russian Ruble'},
+                                       page_size=2)
+
+    def test_text(self):
+        self.assertEqual(self.listing.text, 'EUR (Euro)\nRUB (Russian Ruble)\nUAH (Hryvnia)\nUSD (US Dollar)\nXYZ\n')
+
+    def test_pages(self):
+        self.assertEqual(self.listing.pages(), ['EUR (Euro)\nRUB (Russian Ruble)', 'UAH (Hryvnia)\nUSD (US Dollar)',
+                                                'XYZ'])
+        self.assertEqual(self.listing.page(1), ('UAH (Hryvnia)\nUSD (US Dollar)', 1, 3))
+        self.assertEqual(self.listing.page(10), ('XYZ', 2, 3))
+        self.assertEqual(self.listing.page(-1)[1], 0)
+
+    def test_prefix(self):
+        self.assertEqual(self.listing.pages('u'), ['UAH (Hryvnia)\nUSD (US Dollar)'])
+        self.assertEqual(self.listing.pages(' us '), ['USD (US Dollar)'])
+        self.assertEqual(self.listing.pages('USD'), ['USD (US Dollar)'])
+        self.assertEqual(self.listing.page(0, 'Q'), (None, 0, 0))
+        self.assertEqual(self.listing.pages('USDT'), [])
+
+    def test_message_limit(self):
+        listing = CurrencyListing([f'{number:03}' for number in range(500)], {'000': 'x' * (MESSAGE_LIMIT - 10)},
+                                  page_size=100)
+        self.assertTrue(all(len(page) <= MESSAGE_LIMIT for page in listing.pages()))
+        self.assertEqual(len(listing.pages()), 6)
+
+
+if __name__ == '__main__':
+    unittest.main()
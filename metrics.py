@@ -0,0 +1,187 @@
+"""This file defines METRICS: counters and histograms of what the bot is doing (which parser cases match,
+how long they take, how rates refresh goes) and MetricsServer, which exports them over HTTP.
+Instrumentation is off by default and costs a single attribute check then. Call METRICS.enable() to turn it on.
+"""
+
+from bisect import bisect_left
+import threading
+from typing import Union
+
+# seconds, from 10 microseconds (cached answer) to 10 seconds (slow API)
+DEFAULT_BUCKETS = (1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1, 2.5, 5, 10)
+
+
+class Counter:
+    """Number that only grows. Every distinct set of labels has a number of its own."""
+    kind = 'counter'
+
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        """[(name, labels, value), ...]"""
+        with self._lock:
+            return [(self.name, dict(key), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Counts observed values (e.g. durations) in buckets, along with their sum and count."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # labels -> [count per bucket (+ one for everything above the last one), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    def samples(self) -> list:
+        """[(name, labels, value), ...] the way Prometheus wants them: cumulative buckets, sum and count."""
+        with self._lock:
+            values = [(dict(key), list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for labels, counts, total in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                samples.append((f'{self.name}_bucket', {**labels, 'le': _format_bound(bound)}, cumulative))
+            samples.append((f'{self.name}_sum', labels, total))
+            samples.append((f'{self.name}_count', labels, cumulative))
+        return samples
+
+
+class Registry:
+    """Keeps metrics. Instrumented code checks enabled before measuring anything.
+    Collectors are functions called on export, for numbers that are already counted elsewhere
+    (like CachingParser.cache_stats): each returns [(name, kind, help, labels, value), ...].
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def enable(self, enabled: bool = True):
+        self.enabled = enabled
+
+    def _get(self, metric_class, name: str, help_text: str, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = metric_class(name, help_text, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f'{name} is already a {metric.kind}')
+            return metric
+
+    def counter(self, name: str, help_text: str) -> Counter:
+        """Returns counter called name (creates it if there's none)."""
+        return self._get(Counter, name, help_text)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        """Returns histogram called name (creates it if there's none)."""
+        return self._get(Histogram, name, help_text, buckets=buckets)
+
+    def add_collector(self, collector: callable):
+        with self._lock:
+            self._collectors.append(collector)
+
+    def collect(self) -> list:
+        """[(name, kind, help, [(sample name, labels, value), ...]), ...] for every metric and collector."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        families = [(metric.name, metric.kind, metric.help_text, metric.samples()) for metric in metrics]
+        collected = {}
+        for collector in collectors:
+            for name, kind, help_text, labels, value in collector():
+                collected.setdefault(name, (name, kind, help_text, []))[3].append((name, labels, value))
+        return families + list(collected.values())
+
+
+def _format_bound(bound: float) -> str:
+    return '+Inf' if bound == float('inf') else repr(float(bound))
+
+
+def _escape(value) -> str:
+    """For label values."""
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _escape_help(help_text: str) -> str:
+    """HELP lines only escape backslashes and newlines, quotes stay as they are."""
+    return help_text.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def prometheus_text(registry: Registry) -> str:
+    """Renders registry in Prometheus text exposition format."""
+    lines = []
+    for name, kind, help_text, samples in registry.collect():
+        lines.append(f'# HELP {name} {_escape_help(help_text)}')
+        lines.append(f'# TYPE {name} {kind}')
+        for sample_name, labels, value in samples:
+            if labels:
+                rendered = ','.join(f'{label}="{_escape(label_value)}"' for label, label_value in labels.items())
+                lines.append(f'{sample_name}{{{rendered}}} {value}')
+            else:
+                lines.append(f'{sample_name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves registry rendered by render (Prometheus text format by default) at /metrics.
+    Listens on localhost by default: metrics are for whoever runs the bot, not for the whole internet.
+    """
+
+    def __init__(self, registry: Union[Registry, None] = None, host: str = '127.0.0.1', port: int = 9100,
+                 render: callable = prometheus_text, content_type: str = 'text/plain; version=0.0.4'):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # takes a while, and is rarely needed
+        registry = registry or METRICS
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = render(registry).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', f'{content_type}; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self.port = self._server.server_address[1]
+
+    def start(self) -> 'MetricsServer':
+        threading.Thread(target=self._server.serve_forever, name='metrics server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+METRICS = Registry()
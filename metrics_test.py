@@ -0,0 +1,53 @@
+import unittest
+import urllib.request
+from metrics import *
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = Registry()
+
+    def test_counter(self):
+        counter = self.registry.counter('messages_total', 'Messages')
+        counter.inc()
+        counter.inc(2, result='ok')
+        counter.inc(result='ok')
+        self.assertIs(self.registry.counter('messages_total', 'Messages'), counter)
+        self.assertEqual(counter.samples(),
+                         [('messages_total', {}, 1), ('messages_total', {'result': 'ok'}, 3)])
+        with self.assertRaises(ValueError):
+            self.registry.histogram('messages_total', 'Messages')
+
+    def test_histogram(self):
+        histogram = self.registry.histogram('latency_seconds', 'Latency', buckets=(0.1, 1))
+        for value in (0.05, 0.1, 0.5, 5):
+            histogram.observe(value, case='x')
+        self.assertEqual(histogram.samples(), [('latency_seconds_bucket', {'case': 'x', 'le': '0.1'}, 2),
+                                               ('latency_seconds_bucket', {'case': 'x', 'le': '1.0'}, 3),
+                                               ('latency_seconds_bucket', {'case': 'x', 'le': '+Inf'}, 4),
+                                               ('latency_seconds_sum', {'case': 'x'}, 5.65),
+                                               ('latency_seconds_count', {'case': 'x'}, 4)])
+
+    def test_prometheus_text(self):
+        self.registry.counter('errors_total', 'Errors "so far"\\now').inc(case='a\nb"')
+        self.registry.add_collector(lambda: [('queue_depth', 'gauge', 'Queue', {}, 7)])
+        self.assertEqual(prometheus_text(self.registry), '# HELP errors_total Errors "so far"\\\\now\n'
+                                                         '# TYPE errors_total counter\n'
+                                                         'errors_total{case="a\\nb\\""} 1\n'
+                                                         '# HELP queue_depth Queue\n'
+                                                         '# TYPE queue_depth gauge\n'
+                                                         'queue_depth 7\n')
+
+    def test_server(self):
+        self.registry.counter('requests_total', 'Requests').inc()
+        server = MetricsServer(self.registry, port=0).start()
+        try:
+            with urllib.request.urlopen(f'http://127.0.0.1:{server.port}/metrics') as response:
+                self.assertIn('requests_total 1', response.read().decode())
+        finally:
+            server.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
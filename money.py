@@ -0,0 +1,183 @@
+"""This file defines exact money arithmetic: amounts are integers of minor units of their currency (cents, or yen
+for JPY, or fils for KWD), rates are integers scaled by a power of ten, and a conversion is one integer multiplication
+and one division, rounded once, to the minor unit of the target currency. No float errors, no round(value, 2)
+for currencies that don't have cents, and it's faster than both floats with round() and Decimal
+(see money_benchmark.py).
+"""
+
+from math import gcd
+import threading
+from typing import Union
+
+# Number of digits after the decimal point (ISO 4217 "minor unit") of currencies that don't have 2 of them.
+# Every other currency has 2.
+CURRENCY_EXPONENTS = {
+    # no minor units
+    'BIF': 0, 'BYR': 0, 'CLP': 0, 'DJF': 0, 'GNF': 0, 'ISK': 0, 'JPY': 0, 'KMF': 0, 'KRW': 0, 'PYG': 0,
+    'RWF': 0, 'UGX': 0, 'UYI': 0, 'VND': 0, 'VUV': 0, 'XAF': 0, 'XOF': 0, 'XPF': 0,
+    # thousandths
+    'BHD': 3, 'IQD': 3, 'JOD': 3, 'KWD': 3, 'LYD': 3, 'OMR': 3, 'TND': 3,
+    # ten-thousandths
+    'CLF': 4, 'UYW': 4,
+    # ISO 4217 has no minor unit for these (precious metals, SDR), they're worth too much to round to cents
+    'XAG': 6, 'XAU': 6, 'XDR': 6, 'XPD': 6, 'XPT': 6,
+    # not ISO 4217, but some rate APIs have it
+    'BTC': 8,
+}
+DEFAULT_EXPONENT = 2
+_FORMATS = {currency: ('%.{}f'.format(digits), 10 ** digits) for currency, digits in CURRENCY_EXPONENTS.items()}
+_DEFAULT_FORMAT = '%.{}f'.format(DEFAULT_EXPONENT), 10 ** DEFAULT_EXPONENT
+
+
+def exponent(currency: str) -> int:
+    return CURRENCY_EXPONENTS.get(currency, DEFAULT_EXPONENT)
+
+
+def to_minor(amount: Union[float, int], currency: str) -> int:
+    """Amount in minor units of currency. Digits beyond the minor unit are rounded (half away from zero).
+    Raises OverflowError for infinity and ValueError for NaN.
+    """
+    digits = exponent(currency)
+    if isinstance(amount, int):
+        return amount * 10 ** digits
+    scaled = amount * 10 ** digits
+    if abs(scaled) < 2 ** 52:  # float is precise enough for round() to find the right integer...
+        minor = round(scaled)
+        if abs(abs(scaled - minor) - 0.5) > 1e-6:
+            return minor
+    # ...unless it's (about) half way between two of them, like 1.005 (which is 1.00499999999999989... as float)
+    # or too large. Then it's decided by decimal digits of amount, the ones repr shows.
+    if scaled != scaled:
+        raise ValueError('NaN is not an amount')
+    if scaled in (float('inf'), float('-inf')):
+        raise OverflowError('Infinite amount')
+    numerator, denominator = _decimal(amount)
+    return _divide(numerator * 10 ** digits, denominator)
+
+
+def from_minor(minor: int, currency: str) -> float:
+    """Nearest float. to_minor(from_minor(x)) == x for anything float can hold precisely."""
+    return minor / 10 ** exponent(currency)
+
+
+def format_minor(minor: int, currency: str) -> str:
+    """'1234.50' for 123450 USD, '1234' for 1234 JPY, '1.500' for 1500 KWD."""
+    if -2 ** 53 < minor < 2 ** 53:  # float is exact enough to print these digits, and that's faster than str tricks
+        template, power = _FORMATS.get(currency, _DEFAULT_FORMAT)
+        return template % (minor / power)
+    digits = exponent(currency)
+    if not digits:
+        return str(minor)
+    whole, fraction = divmod(abs(minor), 10 ** digits)
+    return f"{'-' if minor < 0 else ''}{whole}.{fraction:0{digits}d}"
+
+
+def format_amount(amount: Union[float, int], currency: str) -> str:
+    """Amount with as many digits after the point as currency has (floats too large to have them look like 1e+300)."""
+    if isinstance(amount, float) and not -2 ** 53 < amount < 2 ** 53:
+        return repr(amount)
+    return format_minor(to_minor(amount, currency), currency)
+
+
+def _decimal(value: float) -> tuple:
+    """(integer, power of ten) such that value == integer / power of ten, for the shortest decimal
+    that is the same float (the one repr shows, i.e. what was in the API's json).
+    """
+    mantissa, _, power = repr(value).partition('e')
+    whole, _, fraction = mantissa.partition('.')
+    scale = len(fraction) - int(power or 0)
+    integer = int(whole + fraction)
+    if scale < 0:
+        return integer * 10 ** -scale, 1
+    return integer, 10 ** scale
+
+
+def _divide(numerator: int, denominator: int) -> int:
+    """numerator / denominator rounded half away from zero (denominator is positive)."""
+    quotient, remainder = divmod(abs(numerator), denominator)
+    if remainder * 2 >= denominator:
+        quotient += 1
+    return quotient if numerator >= 0 else -quotient
+
+
+class ExactRates:
+    """Rates (how much of a currency you get for 1 of the base currency) as scaled integers: 0.92071 is
+    (92071, 100000). For every currency pair asked for, the whole conversion (rates and exponents of both
+    currencies) is reduced to a single fraction once, so converting takes one multiplication and one division.
+    Raises KeyError for unknown currency codes (same as CrossRates), ValueError for currencies without a usable rate.
+    """
+
+    def __init__(self, rates: dict):
+        self.scaled = {}  # currency -> (integer, power of ten), rate is integer / power of ten
+        for currency, rate in rates.items():
+            self.scaled[currency] = _decimal(float(rate)) if rate > 0 else (0, 1)  # API may have junk
+        # orig currency -> target currency -> (2 * numerator, denominator, 2 * denominator, format of target)
+        self._factors = {}
+        self._lock = threading.Lock()
+
+    def _factor(self, orig_currency: str, target_currency: str) -> tuple:
+        orig_integer, orig_scale = self.scaled[orig_currency]
+        target_integer, target_scale = self.scaled[target_currency]
+        if not orig_integer or not target_integer:
+            raise ValueError(f'Нет курса {orig_currency if not orig_integer else target_currency}')
+        # minor units of orig -> orig -> base -> target -> minor units of target
+        numerator = target_integer * orig_scale * 10 ** exponent(target_currency)
+        denominator = orig_integer * target_scale * 10 ** exponent(orig_currency)
+        common = gcd(numerator, denominator)
+        numerator, denominator = numerator // common, denominator // common
+        factor = 2 * numerator, denominator, 2 * denominator, _FORMATS.get(target_currency, _DEFAULT_FORMAT)
+        with self._lock:
+            self._factors.setdefault(orig_currency, {})[target_currency] = factor
+        return factor
+
+    def convert(self, minor: int, orig_currency: str, target_currency: str) -> int:
+        """Minor units of orig_currency -> minor units of target_currency, rounded half away from zero."""
+        try:
+            double_numerator, denominator, double_denominator, _ = self._factors[orig_currency][target_currency]
+        except KeyError:
+            double_numerator, denominator, double_denominator, _ = self._factor(orig_currency, target_currency)
+        if minor < 0:
+            return -((-minor * double_numerator + denominator) // double_denominator)
+        # minor * numerator / denominator + 1/2, rounded down
+        return (minor * double_numerator + denominator) // double_denominator
+
+    def convert_formatted(self, minor: int, orig_currency: str, target_currency: str) -> str:
+        """format_minor(convert(...)) in one go, for when there's lots of them to show."""
+        try:
+            double_numerator, denominator, double_denominator, (template, power) = \
+                self._factors[orig_currency][target_currency]
+        except KeyError:
+            double_numerator, denominator, double_denominator, (template, power) = \
+                self._factor(orig_currency, target_currency)
+        if minor >= 0:
+            converted = (minor * double_numerator + denominator) // double_denominator
+        else:
+            converted = -((-minor * double_numerator + denominator) // double_denominator)
+        if -2 ** 53 < converted < 2 ** 53:
+            return template % (converted / power)
+        return format_minor(converted, target_currency)
+
+    def convert_amount(self, amount: Union[float, int], orig_currency: str, target_currency: str) -> float:
+        """Same for amounts that aren't in minor units: the whole amount (its decimal digits, the ones repr shows)
+        is converted and rounded once, to minor units of target_currency. 1.005 USD is not rounded to 1.01 first.
+        Raises OverflowError for infinity and ValueError for NaN.
+        """
+        if isinstance(amount, int):
+            integer, scale = amount, 1
+        elif amount != amount:
+            raise ValueError('NaN is not an amount')
+        elif amount in (float('inf'), float('-inf')):
+            raise OverflowError('Infinite amount')
+        else:
+            integer, scale = _decimal(amount)
+        try:
+            double_numerator, _, double_denominator, _ = self._factors[orig_currency][target_currency]
+        except KeyError:
+            double_numerator, _, double_denominator, _ = self._factor(orig_currency, target_currency)
+        # amount * 10 ** exponent(orig) is what convert would get as minor, the factor does the rest
+        minor = _divide(integer * 10 ** exponent(orig_currency) * double_numerator, scale * double_denominator)
+        return from_minor(minor, target_currency)
+
+
+if __name__ == '__main__':
+    print(__doc__)
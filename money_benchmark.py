@@ -0,0 +1,113 @@
+"""Compares ways to convert money: floats (as CurrencyConverter did before money.py), Decimal and exact integers
+(money.ExactRates). Every way converts the same random amounts between random currencies with rates from
+replay_rates.json, results are checked against exact rational arithmetic (fractions.Fraction).
+A result is wrong if it differs from the exact one rounded (half away from zero) to the minor unit of its currency.
+
+python money_benchmark.py                # 100 000 conversions
+python money_benchmark.py --count 1000000
+Exit code is 1 if ExactRates got anything wrong or was slower than floats (the way they were used before) or Decimal.
+"float dict" is there for reference: floats with everything prepared beforehand, about as fast as ExactRates
+(it's one multiplication and one division either way, python's overhead is the rest), but still wrong sometimes.
+"""
+
+import argparse
+from decimal import ROUND_HALF_UP, Decimal
+from fractions import Fraction
+import json
+import random
+import sys
+import time
+from money import ExactRates, exponent, format_minor
+from rates import CrossRates
+from replay_benchmark import RATES_PATH
+
+
+def samples(rates: dict, count: int, seed: int = 1) -> list:
+    """[(amount in minor units, orig currency, target currency), ...]: mostly round amounts, like people ask."""
+    generator = random.Random(seed)
+    codes = sorted(rates)
+    result = []
+    for _ in range(count):
+        orig = generator.choice(codes)
+        amount = generator.choice((1, 10, 100, 1000, 250, 5000)) * generator.choice((1, 1, 1, 3, 7)) \
+            if generator.random() < 0.7 else generator.randrange(1, 10 ** 7) / 100
+        result.append((round(amount * 10 ** exponent(orig)), orig, generator.choice(codes)))
+    return result
+
+
+def exact_answer(minor: int, orig: str, target: str, rates: dict) -> str:
+    value = Fraction(minor, 10 ** exponent(orig)) * Fraction(repr(rates[target])) / Fraction(repr(rates[orig]))
+    scaled = value * 10 ** exponent(target)
+    rounded = int(abs(scaled) + Fraction(1, 2))  # half away from zero
+    return format_minor(rounded if scaled >= 0 else -rounded, target)
+
+
+def with_floats(rates: dict) -> callable:
+    """What CurrencyConverter._action did: float rate from CrossRates, round(value, 2) whatever the currency."""
+    cross_rates = CrossRates.from_rates(rates)
+
+    def convert(minor, orig, target):
+        return str(round(minor / 10 ** exponent(orig) * cross_rates.rate(orig, target), 2))
+    return convert
+
+
+def with_float_dict(rates: dict) -> callable:
+    """Floats done right(ish): rates in a dict, as many digits as target currency has."""
+    powers = {code: 10 ** exponent(code) for code in rates}
+    templates = {code: f'%.{exponent(code)}f' for code in rates}
+
+    def convert(minor, orig, target):
+        return templates[target] % (minor / powers[orig] * rates[target] / rates[orig])
+    return convert
+
+
+def with_decimals(rates: dict) -> callable:
+    decimal_rates = {code: Decimal(repr(rate)) for code, rate in rates.items()}
+    quanta = {code: Decimal(1).scaleb(-exponent(code)) for code in rates}
+
+    def convert(minor, orig, target):
+        value = Decimal(minor).scaleb(-exponent(orig)) * decimal_rates[target] / decimal_rates[orig]
+        return str(value.quantize(quanta[target], rounding=ROUND_HALF_UP))
+    return convert
+
+
+def with_integers(rates: dict) -> callable:
+    return ExactRates(rates).convert_formatted
+
+
+WAYS = {'float (before)': with_floats, 'float dict': with_float_dict, 'Decimal': with_decimals,
+        'ExactRates': with_integers}
+
+
+def run(rates: dict, count: int, repeat: int = 5) -> dict:
+    """{way: (nanoseconds per conversion, number of wrong answers)}"""
+    conversions = samples(rates, count)
+    expected = [exact_answer(minor, orig, target, rates) for minor, orig, target in conversions]
+    result = {}
+    for name, way in WAYS.items():
+        convert = way(rates)
+        for minor, orig, target in conversions:  # warm up (ExactRates prepares every pair once)
+            convert(minor, orig, target)
+        elapsed = None
+        for _ in range(repeat):  # best of repeat runs: that's the one least disturbed by everything else
+            started = time.perf_counter()
+            answers = [convert(minor, orig, target) for minor, orig, target in conversions]
+            elapsed = min(elapsed or float('inf'), time.perf_counter() - started)
+        result[name] = elapsed / count * 1e9, sum(answer != right for answer, right in zip(answers, expected))
+    return result
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Compares float, Decimal and integer money conversions.')
+    arguments.add_argument('--count', type=int, default=100000, help='how many conversions')
+    arguments.add_argument('--rates', default=RATES_PATH, help='json file with {"fetched_at": ..., "rates": {...}}')
+    arguments = arguments.parse_args()
+
+    with open(arguments.rates, encoding='utf-8') as file:
+        fixture_rates = {code: rate for code, rate in json.load(file)['rates'].items() if rate > 0}
+    report = run(fixture_rates, arguments.count)
+    print(f'{"":<16}{"ns/conversion":>15}{"wrong":>10}')
+    for way, (nanoseconds, wrong) in report.items():
+        print(f'{way:<16}{nanoseconds:>15.0f}{wrong:>10}')
+    exact_time, exact_wrong = report['ExactRates']
+    sys.exit(0 if exact_wrong == 0 and exact_time < min(report['float (before)'][0], report['Decimal'][0]) else 1)
@@ -0,0 +1,80 @@
+from fractions import Fraction
+import random
+import unittest
+from money import *
+
+
+class MinorUnitsTest(unittest.TestCase):
+
+    def test_to_minor(self):
+        self.assertEqual(to_minor(12.34, 'USD'), 1234)
+        self.assertEqual(to_minor(0.29, 'USD'), 29)  # 28.999999999999996 as float
+        self.assertEqual(to_minor(1.005, 'USD'), 101)  # 1.00499999999999989 as float
+        self.assertEqual(to_minor(-2.675, 'USD'), -268)
+        self.assertEqual(to_minor(12.5, 'JPY'), 13)
+        self.assertEqual(to_minor(1.5, 'KWD'), 1500)
+        self.assertEqual(to_minor(7, 'BHD'), 7000)
+        self.assertEqual(to_minor(1e20, 'USD'), 10 ** 22)
+        with self.assertRaises(OverflowError):
+            to_minor(float('inf'), 'USD')
+        with self.assertRaises(ValueError):
+            to_minor(float('nan'), 'USD')
+
+    def test_format(self):
+        self.assertEqual(format_minor(123450, 'USD'), '1234.50')
+        self.assertEqual(format_minor(-5, 'EUR'), '-0.05')
+        self.assertEqual(format_minor(1234, 'JPY'), '1234')
+        self.assertEqual(format_minor(1500, 'KWD'), '1.500')
+        self.assertEqual(format_minor(10 ** 20 + 1, 'USD'), '1000000000000000000.01')
+        self.assertEqual(format_amount(0.1 + 0.2, 'USD'), '0.30')
+        self.assertEqual(format_amount(1e300, 'USD'), '1e+300')
+        for minor in range(-1000, 1000):
+            self.assertEqual(to_minor(from_minor(minor, 'KWD'), 'KWD'), minor)
+
+
+class ExactRatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.rates = {'USD': 1.0, 'EUR': 0.9207, 'JPY': 149.62, 'KWD': 0.30812, 'BTC': 1.6e-05, 'HALF': 0.5,
+                      'JUNK': 0.0}
+        self.exact_rates = ExactRates(self.rates)
+
+    def exact(self, minor: int, orig: str, target: str) -> int:
+        value = Fraction(minor, 10 ** exponent(orig)) * Fraction(repr(self.rates[target])) \
+            / Fraction(repr(self.rates[orig])) * 10 ** exponent(target)
+        rounded = int(abs(value) + Fraction(1, 2))
+        return rounded if value >= 0 else -rounded
+
+    def test_convert(self):
+        self.assertEqual(self.exact_rates.convert(10000, 'USD', 'JPY'), 14962)
+        self.assertEqual(self.exact_rates.convert(1500, 'KWD', 'USD'), 487)
+        self.assertEqual(self.exact_rates.convert(1, 'USD', 'HALF'), 1)  # half a cent
+        self.assertEqual(self.exact_rates.convert(-1, 'USD', 'HALF'), -1)
+        self.assertEqual(self.exact_rates.convert_formatted(10000, 'USD', 'KWD'), '30.812')
+        self.assertEqual(self.exact_rates.convert_amount(100.0, 'USD', 'EUR'), 92.07)
+        self.assertEqual(self.exact_rates.convert_amount(100, 'USD', 'EUR'), 92.07)
+        half = ExactRates({'USD': 1.0, 'EUR': 0.5, 'RUB': 80.0})
+        self.assertEqual(half.convert_amount(1.005, 'USD', 'EUR'), 0.5)  # 0.5025, not 1.01 * 0.5
+        self.assertEqual(half.convert_amount(0.004, 'USD', 'RUB'), 0.32)  # less than a cent is still money
+        self.assertEqual(half.convert_amount(-0.015, 'USD', 'EUR'), -0.01)  # -0.0075
+        self.assertEqual(half.convert_amount(1e-20, 'USD', 'RUB'), 0.0)
+        self.assertRaises(OverflowError, half.convert_amount, float('inf'), 'USD', 'EUR')
+        self.assertRaises(ValueError, half.convert_amount, float('nan'), 'USD', 'EUR')
+        generator = random.Random(4217)
+        codes = [code for code in self.rates if code != 'JUNK']
+        for _ in range(2000):
+            minor, orig, target = generator.randrange(-10 ** 9, 10 ** 9), generator.choice(codes), \
+                generator.choice(codes)
+            self.assertEqual(self.exact_rates.convert(minor, orig, target), self.exact(minor, orig, target))
+            self.assertEqual(self.exact_rates.convert_formatted(minor, orig, target),
+                             format_minor(self.exact(minor, orig, target), target))
+
+    def test_errors(self):
+        with self.assertRaises(KeyError):
+            self.exact_rates.convert(100, 'USD', 'XXX')
+        with self.assertRaises(ValueError):
+            self.exact_rates.convert(100, 'USD', 'JUNK')
+
+
+if __name__ == '__main__':
+    unittest.main()
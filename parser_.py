@@ -2,9 +2,25 @@
 Import all of the above into your project to create your own parser.
 """
 
+from collections import OrderedDict
 from dataclasses import dataclass, field
+from datetime import date
 import re
+import threading
+import time
 from typing import Union
+from metrics import METRICS
+
+_CASE_SECONDS = METRICS.histogram('parser_case_seconds',
+                                  'Time spent by Parser trying a ParserCase, by case and result (matched/failed)')
+_CHECK_OPERANDS_SECONDS = METRICS.histogram('parser_check_operands_seconds',
+                                            'Time spent by ParserCase.check_operands, by case')
+_CASES_TRIED = METRICS.histogram('parser_cases_tried', 'How many cases Parser tried per message',
+                                 buckets=(0, 1, 2, 3, 5, 10, 20))
+_EXPRESSION_SECONDS = METRICS.histogram('parser_expression_seconds',
+                                        'Time spent by ExpressionParser per message, by top operation and result '
+                                        '(ok, refused: error message instead of an answer, failed: not an expression)')
+_COMPILE_SECONDS = METRICS.histogram('parser_compile_seconds', 'Time spent compiling plans (plan cache misses)')
 
 
 class ParsingFailure(Exception):
@@ -12,6 +28,16 @@ class ParsingFailure(Exception):
     pass
 
 
+class NoOperator(ParsingFailure):
+    """Raised by ParserCase if its operator isn't in the string at all (so the answer can't depend on its version)."""
+    pass
+
+
+class TooExpensive(ArithmeticError):
+    """Raised if calculating an answer would take too much time (see ExpressionParser)."""
+    pass
+
+
 def combinations(iterable) -> tuple:
     """This splits list into two in every possible way."""
     length = len(iterable)
@@ -22,15 +48,29 @@ def combinations(iterable) -> tuple:
     return
 
 
+def error_message(e: Union[ValueError, ArithmeticError]) -> str:
+    """What user sees instead of an answer if calculation failed."""
+    if isinstance(e, OverflowError):
+        return f"Слищком многа:\n{e}"
+    if isinstance(e, TooExpensive):
+        return f"Слищком долга:\n{e}"
+    return f"Ощибочка вышла:\n{e}"
+
+
+def _refuse(e: Union[ValueError, ArithmeticError], tried: Union[list, None]) -> str:
+    """error_message for Parser._parse. Refusals for size are marked as not to be remembered (see Parser._parse)."""
+    if tried is not None and isinstance(e, TooExpensive):
+        tried.append(None)
+    return error_message(e)
+
+
 def protect_from_value_errors(func):
     """Helper decorator."""  # todo: maybe add more types of exceptions
     def wrapper(*args):
         try:
             return func(*args)
-        except ValueError as e:
-            return f"Ощибочка вышла:\n{e}"
-        except OverflowError as e:
-            return f"Слищком многа:\n{e}"
+        except (ValueError, ArithmeticError) as e:
+            return error_message(e)
     return wrapper
 
 
@@ -52,24 +92,45 @@ class ParserOperator:
         return self.operator
 
 
+# Numbers ParserOperand of type 'float' understands (spaces are removed beforehand):
+# 100, -12.5, 1.25e6, thousands separated with commas or apostrophes (120'000, 120,000)
+# and decimal comma with up to two digits after it (12,45 12,4 12,)
+# todo it works great for currencies, but not for numbers in general
+_FLOAT_GRAMMAR = re.compile(r"""
+    (?P<sign>[+-]?)
+    (?:
+        (?P<whole>\d+),(?P<fraction>\d{0,2})
+      | (?P<grouped>\d+(?:[,']\d+)*)?(?P<rest>\.\d*)?(?P<exponent>[eE][+-]?\d+)?
+    )
+    """, flags=re.VERBOSE)
+_THOUSANDS_SEPARATORS = str.maketrans('', '', ",'")
+# Dates ParserOperand of type 'date' understands: 2022-06-01 and 01.06.2022
+_DATE_GRAMMAR = re.compile(r'(?P<year>\d{4})-(?P<month>\d\d?)-(?P<day>\d\d?)'
+                           r'|(?P<day2>\d\d?)\.(?P<month2>\d\d?)\.(?P<year2>\d{4})')
+_MASK_DIGITS = str.maketrans('123456789', '000000000')
+_DIGIT = re.compile(r'\d')
+
+
 class ParserOperand:
     """Specify limitations imposed on particular type of operand.
-    Operand type may be list, string, float or int.
+    Operand type may be list, string, float, int or date (datetime.date).
     Note: string and int are not implemented at the moment.
     For list, you must specify a list of compatible strings.
     You can optionally provide a dictionary of synonyms for list type operand.
-    Any string matching a key in this dictionary will be replaced with the value of said key.
+    Any string matching a key (regex) in this dictionary will be replaced with the value of said key.
+    If several keys match at the same place, the first one in the dictionary wins.
     You can optionaly provide an additional check on the operand via operand_checker.
     For example operand_checker=lambda x: x > 0 will match only positive numbers.
+    Generation grows every time operand_list or synonym_dict is changed.
     """
     def __init__(self, operand_type: str,
                  operand_checker: Union[callable, None] = None,
                  operand_list: Union[list, None] = None,
                  synonym_dict: Union[dict, None] = None):
 
-        possible_operand_types = ('list', 'string', 'float', 'int')
+        possible_operand_types = ('list', 'string', 'float', 'int', 'date')
         if operand_type not in possible_operand_types:
-            raise ValueError("Incorrect operand type. Try 'list', 'string' 'float' or 'int'")
+            raise ValueError("Incorrect operand type. Try 'list', 'string' 'float', 'int' or 'date'")
         if operand_type in ('string', 'int'):
             raise NotImplementedError('Maybe next time')
         if operand_type == 'list' and not isinstance(operand_list, list):
@@ -81,6 +142,8 @@ class ParserOperand:
         elif operand_type == 'list':
             self.check = self._check_list
             self._operand_type = 'list'
+        elif operand_type == 'date':
+            self.check = self._check_date
         self._operand_type = operand_type
 
         if operand_checker is not None:
@@ -88,13 +151,11 @@ class ParserOperand:
         else:
             self._operand_checker = lambda x: True  # All hail Hindi Code!
 
+        self.generation = 0
         if operand_list is not None:
             self.operand_list = operand_list
 
-        if synonym_dict is not None:
-            self.synonym_dict = synonym_dict
-        else:
-            self.synonym_dict = None
+        self.synonym_dict = synonym_dict
 
     def __str__(self):
         return self.operand_type
@@ -103,62 +164,89 @@ class ParserOperand:
     def operand_type(self):
         return self._operand_type
 
+    @property
+    def operand_list(self) -> list:
+        return self._operand_list
+
+    @operand_list.setter
+    def operand_list(self, operand_list: list):
+        """Assign a new list (e.g. after currency rates were refreshed) to rebuild the lookup index."""
+        self._operand_list = operand_list
+        self.generation += 1
+        self._operand_index = {}
+        for each in operand_list:  # first one wins, same as searching the list
+            self._operand_index.setdefault(each.lower(), each)
+
+    @property
+    def synonym_dict(self) -> Union[dict, None]:
+        return self._synonym_dict
+
+    @synonym_dict.setter
+    def synonym_dict(self, synonym_dict: Union[dict, None]):
+        """All synonyms are compiled into a single regex, each one into a named group of its own."""
+        self._synonym_dict = synonym_dict
+        self.generation += 1
+        if not synonym_dict:
+            self._synonym_regex = None
+            return
+        self._synonym_values = {}
+        groups = []
+        for number, (synonym, value) in enumerate(synonym_dict.items()):
+            self._synonym_values[f'synonym{number}'] = value
+            groups.append(f'(?P<synonym{number}>{synonym})')
+        self._synonym_regex = re.compile('|'.join(groups), flags=re.IGNORECASE)
+
+    def _replace_synonym(self, match: re.Match) -> str:
+        return self._synonym_values[match.lastgroup]
+
     def _check_float(self, what: str) -> Union[float, None]:
         """Returns float if it is possible to interpret argument 'what' as such, None otherwise"""
 
-        what = re.sub('[ ]', '', what)  # turns 250 000 into 250000
+        what = what.replace(' ', '')  # turns 250 000 into 250000
+
+        match = _FLOAT_GRAMMAR.fullmatch(what)
+        if match is None:
+            return None
 
-        try:  # to simply convert into float
+        sign, whole, fraction, grouped, rest, _ = match.groups()
+        if whole is not None:  # turns 1,23 into 1.23
+            value = float(f"{sign}{whole}.{fraction}")
+        elif grouped is None and (rest is None or rest == '.'):
+            return None  # no digits at all
+        elif grouped is not None and not grouped.isdecimal():  # turns 10'000 or 10,000 into 10000
+            value = float(what.translate(_THOUSANDS_SEPARATORS))
+        else:
             value = float(what)
-            if self._operand_checker(value):
-                return value
-        except ValueError:
-            pass
 
-        try:  # to turn 1,23 into 1.23
-            value = float(re.sub('[,]', '.', what, 1))
+        if self._operand_checker(value):
+            return value
+        return None
+
+    def _check_date(self, what: str) -> Union[date, None]:
+        """Returns date if it is possible to interpret argument 'what' as such, None otherwise"""
+        match = _DATE_GRAMMAR.fullmatch(what.strip())
+        if match is None:
+            return None
+        year, month, day = (match['year'], match['month'], match['day']) if match['year'] is not None \
+            else (match['year2'], match['month2'], match['day2'])
+        try:
+            value = date(int(year), int(month), int(day))
+        except ValueError:  # 2022-02-30
+            return None
 
-            # Making sure we didn't turn 125,000 into 125.0
-            # todo it works great for currencies, but not for numbers in general
-            if len(re.split('[,]', what)[-1]) > 2:
-                raise ValueError
-            if self._operand_checker(value):
-                return value
-        except ValueError:
-            pass
-
-        try:  # to turn 10'000 or 10,000 into 10000
-            value = float(re.sub("[,']", '', what))
-            if self._operand_checker(value): return value
-        except ValueError:
-            pass
-
-        try:  # to do both
-            value = float(re.sub('[,]', '.', re.sub("[,']", '', what), 1))
-            if self._operand_checker(value): return value
-        except ValueError:
-            pass
-
-        # If all of the above failed, string can not be converted to float
+        if self._operand_checker(value):
+            return value
         return None
 
     def _check_list(self, what: str) -> Union[str, None]:
         """Returns str of operand in correct case if argument 'what' can be interpreted as such, None otherwise"""
         what = what.strip()
 
-        if self.synonym_dict is not None:  # substituting synonyms
-            for synonym in self.synonym_dict.keys():
-                what = re.sub(synonym,
-                              self.synonym_dict[synonym],
-                              what,
-                              flags=re.IGNORECASE)
+        if self._synonym_regex is not None:  # substituting synonyms (all of them in one pass)
+            what = self._synonym_regex.sub(self._replace_synonym, what)
 
-        for each in self.operand_list:  # searching for what in list of possible values for this operand.
-            if each.lower() == what.lower():
-                return each
-
-        # If all of the above failed:
-        return None
+        # searching for what in list of possible values for this operand. None if it's not there.
+        return self._operand_index.get(what.lower())
 
 
 # some general purpose operands are specified here:
@@ -176,12 +264,13 @@ class ParserCase:
     Quick action will be protected from errors via "protect_from_value_errors" decorator.
     To specify more complex behaviour create a child of this class and overload _action method.
     _action must return something that has a __str__ method.
+    Name is what the case is called in METRICS ("float + float" by default).
     You can use each Parser case as a standalone Parser (via "parse" method). Or feed multiple parser cases to a
     Parser class instance and check for all of them via Parser's "parse" method.
     """
 
     def __init__(self, *args: Union[ParserOperand, ParserOperator],
-                 quick_action: Union[callable, None] = None):
+                 quick_action: Union[callable, None] = None, name: Union[str, None] = None):
 
         self._operator = None
         self.left_side_operands = []
@@ -214,6 +303,8 @@ class ParserCase:
         if quick_action:  # overload _action with quick_action and protect it from errors
             self._action = protect_from_value_errors(quick_action)
 
+        self.name = name or ' '.join(str(arg) for arg in args)
+
     @property
     def get_operator(self):
         return str(self._operator)
@@ -230,9 +321,16 @@ class ParserCase:
 
         return str(args)
 
-    def parse(self, inputstring: str) -> str:
-        """Calls _action with correct operands in the correct order if able to make sense of inputstring,
-        Raises ParsingFailure otherwise.
+    def version(self):
+        """Anything that changes whenever _action may give a different answer for the same operands.
+        For example, currency converter would return something that changes along with currency rates.
+        Default (None) means _action only depends on its operands. CachingParser relies on this.
+        """
+        return None
+
+    def tokenize(self, inputstring: str) -> list:
+        """Splits inputstring into words, making sure operator of this case ends up as a separate word.
+        Result only depends on the operator, so cases sharing an operator can share the words.
         """
 
         inputstring = inputstring.strip()
@@ -240,14 +338,24 @@ class ParserCase:
         # Turn "2+3" into "2 + 3" todo Better approach needed
         inputstring = inputstring.replace(self.get_operator, " " + self.get_operator + " ", 1)  # Meh!
 
-        inputwords = inputstring.split()
+        return inputstring.split()
+
+    def parse(self, inputstring: str) -> str:
+        """Calls _action with correct operands in the correct order if able to make sense of inputstring,
+        Raises ParsingFailure otherwise.
+        """
+
+        return self.parse_words(self.tokenize(inputstring))
+
+    def parse_words(self, inputwords: list) -> str:
+        """Same as parse, but takes the output of tokenize instead of raw string."""
 
         # searching for index of operator
         for index, word in enumerate(inputwords):
             if self._operator.check(word):
                 break
         else:  #(nobreak)
-            raise ParsingFailure('No operator found in string')
+            raise NoOperator('No operator found in string')
 
         # splitting inputwords into 2 sublists containig everything to the left of the operator
         # and everything to the right of the operator
@@ -258,8 +366,13 @@ class ParserCase:
 
         # ====== Checking left and right operands =======
         # ====== If either fails, check_operands will raise ParsingFailure
-        result = self.check_operands(leftwords, self.left_side_operands)
-        result.append(*self.check_operands(rightwords, self.right_side_operands))
+        started = time.perf_counter() if METRICS.enabled else None
+        try:
+            result = self.check_operands(leftwords, self.left_side_operands)
+            result.append(*self.check_operands(rightwords, self.right_side_operands))
+        finally:
+            if started is not None:
+                _CHECK_OPERANDS_SECONDS.observe(time.perf_counter() - started, case=self.name)
 
         # === If parsing was successful - execute action
         return self._action(*result)
@@ -293,24 +406,577 @@ class ParserCase:
 
 
 class Parser:
-    """Feed multiple ParserCase instances into this Class to be able to check each of them via parse method. """
-    def __init__(self, *parsers: ParserCase):
+    """Feed multiple ParserCase instances into this Class to be able to check each of them via parse method.
+    Parse tries the cases in the order they were given.
+    Strings longer than max_length characters or with more than max_tokens words are refused right away
+    (the answer says so): a case tries every way to split words between its operands, so a long message
+    would cost much more than a normal one.
+    """
+    def __init__(self, *parsers: ParserCase, max_length: int = 500, max_tokens: int = 30):
         self.parsers=[]
         for parser in parsers:
             self.parsers.append(parser)
+        self.max_length = max_length
+        self.max_tokens = max_tokens
 
     @property
     def parser_count(self):
         return len(self.parsers)
 
-    def parse(self, string):
-        """Try every parser."""
+    def _parse(self, string, tried: Union[list, None] = None) -> tuple:
+        """Try every parser, in order. String is tokenized once per distinct operator.
+        If tried list is given, (case, case.version()) is appended to it for each case tried
+        (except the ones that don't have their operator in the string), and None if the answer is a refusal
+        for size (TooExpensive), which mustn't be remembered: limits may change.
+        Returns (True, answer) or (False, None) if nothing matched.
+        """
+        if len(string) > self.max_length:
+            return True, _refuse(TooExpensive(f'{len(string)} characters, {self.max_length} at most'), tried)
+        if len(string) >= 2 * self.max_tokens:  # shorter ones can't have that many words
+            word_count = len(string.split())
+            if word_count > self.max_tokens:
+                return True, _refuse(TooExpensive(f'{word_count} words, {self.max_tokens} at most'), tried)
+        measure = METRICS.enabled
+        words_by_operator = {}
+        cases_tried = 0
         for parser in self.parsers:
+            version = parser.version() if tried is not None else None
+            operator = parser.get_operator
+            words = words_by_operator.get(operator)
+            if words is None:
+                words = words_by_operator[operator] = parser.tokenize(string)
+            cases_tried += 1
+            started = time.perf_counter() if measure else None
             try:
-                return parser.parse(string)
+                answer = parser.parse_words(words)
+            except NoOperator:
+                continue
             except ParsingFailure:
+                if tried is not None:
+                    tried.append((parser, version))
+                if measure:
+                    _CASE_SECONDS.observe(time.perf_counter() - started, case=parser.name, result='failed')
                 continue
-        return f"Can't parse '{string}'"
+            if tried is not None:
+                tried.append((parser, version))
+            if measure:
+                _CASE_SECONDS.observe(time.perf_counter() - started, case=parser.name, result='matched')
+                _CASES_TRIED.observe(cases_tried)
+            return True, answer
+        if measure:
+            _CASES_TRIED.observe(cases_tried)
+        return False, None
+
+    def parse(self, string):
+        """Try every parser."""
+        matched, answer = self._parse(string)
+        if not matched:
+            return f"Can't parse '{string}'"
+        return answer
+
+
+class CachingParser(Parser):
+    """Parser that remembers up to cache_size answers (least recently used ones are evicted).
+    Messages that only differ in whitespace share an answer.
+    Along with the answer, version() of every case that was tried is remembered. If any of them has changed
+    since (e.g. currency rates were updated), the answer is thrown away and the message is parsed again.
+    So answers of cases that don't override version (like a calculator) never expire.
+    Refusals for size (too long, too many words or tokens, too many operations...) are not remembered.
+    Safe to use from several threads.
+    """
+    def __init__(self, *parsers: ParserCase, cache_size: int = 1000, **kwargs):
+        super().__init__(*parsers, **kwargs)
+        self.cache_size = cache_size
+        self._cache = OrderedDict()  # normalized string -> (matched, answer, ((case, version), ...))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def parse(self, string):
+        if len(string) > self.max_length:  # not worth remembering
+            return self._parse(string)[1]
+        key = ' '.join(string.split())
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None:
+                self._cache.move_to_end(key)
+
+        if entry is not None and all(case.version() == version for case, version in entry[2]):
+            with self._lock:
+                self.hits += 1
+            matched, answer = entry[0], entry[1]
+        else:
+            tried = []
+            matched, answer = self._parse(key, tried)
+            with self._lock:
+                self.misses += 1
+                if entry is not None:
+                    self.invalidations += 1
+                if None in tried:  # refused for its size
+                    self._cache.pop(key, None)
+                else:
+                    self._cache[key] = (matched, answer, tuple(tried))
+                    self._cache.move_to_end(key)
+                    while len(self._cache) > self.cache_size:
+                        self._cache.popitem(last=False)
+                        self.evictions += 1
+
+        if not matched:
+            return f"Can't parse '{string}'"
+        return answer
+
+    def cache_stats(self) -> dict:
+        with self._lock:
+            return {'size': len(self._cache),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'invalidations': self.invalidations}
+
+    def clear_cache(self):
+        with self._lock:
+            self._cache.clear()
+
+
+@dataclass(frozen=True)
+class Operation:
+    """Operator of ExpressionParser: what it's called (ParserOperator) and what it does (action).
+    Binary operations with higher precedence are calculated first. Unary ones apply to everything to the right
+    of them that has higher precedence than themselves (so "-2 ^ 2" is -4 if precedence of "-" is lower than "^").
+    Action may raise ParsingFailure if it doesn't like its operands (e.g. adding dollars to a currency code).
+    """
+    operator: ParserOperator
+    action: callable
+    precedence: int = 0
+    unary: bool = False
+    right_associative: bool = False
+
+
+class Literal:
+    """Leaf of expression tree: a value recognized by one of ExpressionParser's operands."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def evaluate(self, parameters: list, deadline: Union[float, None] = None):
+        return self.value
+
+
+class Parameter:
+    """Leaf of expression tree: a number, which is taken from the message every time the plan is evaluated."""
+    __slots__ = ('index',)
+
+    def __init__(self, index: int):
+        self.index = index
+
+    def evaluate(self, parameters: list, deadline: Union[float, None] = None):
+        return parameters[self.index]
+
+
+class Apply:
+    """Node of expression tree: operation applied to one or two subtrees."""
+    __slots__ = ('operation', 'arguments')
+
+    def __init__(self, operation: Operation, arguments: tuple):
+        self.operation = operation
+        self.arguments = arguments
+
+    def evaluate(self, parameters: list, deadline: Union[float, None] = None):
+        """Deadline is time.thread_time() after which evaluation is given up (TooExpensive)."""
+        arguments = [argument.evaluate(parameters, deadline) for argument in self.arguments]
+        if deadline is not None and time.thread_time() > deadline:
+            raise TooExpensive('Calculation took too long')
+        return self.operation.action(*arguments)
+
+    @property
+    def cost(self) -> int:
+        """Number of operations in the tree."""
+        return 1 + sum(getattr(argument, 'cost', 0) for argument in self.arguments)
+
+
+class Plan:
+    """Compiled expression: tree, plus where its numbers (Parameter nodes) are in the list of tokens.
+    The same plan works for every message of the same shape ("100 usd in rub" and "250 usd in rub").
+    Numeric plans are made of numbers only (no currency codes, dates...), e.g. "2 + 2 * 2".
+    """
+    __slots__ = ('tree', 'parameters', 'compile_time', 'cost', 'explicit_operations', 'numeric')
+
+    def __init__(self, tree: Union[Literal, Parameter, 'Apply'], parameters: list, compile_time: float = 0.0,
+                 explicit_operations: int = 0, numeric: bool = False):
+        self.tree = tree
+        self.numeric = numeric
+        self.parameters = parameters  # [(first token, number of tokens), ...]
+        self.compile_time = compile_time
+        self.cost = getattr(tree, 'cost', 0)
+        self.explicit_operations = explicit_operations
+
+    def bind(self, parser: 'ExpressionParser', tokens: list) -> Union[list, None]:
+        """Recognizes numbers of the message. None if some of them are not valid anymore."""
+        values = []
+        for start, length in self.parameters:
+            value = parser._value(tokens[start:start + length])
+            if value is None:
+                return None
+            values.append(value)
+        return values
+
+    def evaluate(self, parameters: list, deadline: Union[float, None] = None):
+        return self.tree.evaluate(parameters, deadline)
+
+
+class ExpressionParser(Parser):
+    """Recursive descent parser for expressions with any number of operations, precedence and parentheses.
+    For example "27 + 45 USD in EUR" or "2 + 2 * sqrt 16".
+    Message is compiled into a tree of Literal and Apply nodes once, then the tree is evaluated.
+    Values are recognized by operands (ParserOperand), tried in order. A value may consist of
+    several words (like "250 000"), up to max_value_words of them. If two values stand next to each other
+    without an operator in between ("45 USD"), they are combined by implicit operation (if given).
+    Operators made of symbols may be glued to values ("2+2"), word operators ("in") must be separate words.
+    "2022-06-01" is a subtraction, unless it's a valid date at the very end of a message that has a dated operation
+    in it (and there's a date operand): "100 USD in EUR 2022-06-01" with conversion as dated.
+    Result is turned into a string by format_result. An expression without any (explicit) operator is not parsed.
+    Works like any other Parser (e.g. CachingParser), version is what ParserCase.version would be.
+    Answers to numeric expressions (numbers only) don't depend on version, so CachingParser keeps them
+    when version changes (e.g. calculator answers survive currency rate updates).
+
+    Compiled plans are cached (up to plan_cache_size of them) by shape of the message: its tokens with every digit
+    replaced by 0. So "100 usd in rub" and "250 usd in rub" share a plan, and the second one skips operand checks
+    and synonym resolution: only its numbers are recognized, then the plan is evaluated.
+    (Digits are only masked, not dropped, because how numbers are split into values depends on their length,
+    e.g. "12,45" is 12.45 but "12,456" is 12456.) Messages that can't be compiled are remembered too.
+    Plans are thrown away when operand list or synonyms of any operand change.
+
+    One message can't take more than its share of CPU: messages longer than max_length characters or with more
+    than max_tokens tokens are refused before they're compiled (scanning stops at the first token too many),
+    so are ones with more than max_operations operations (as soon as compilation gets to one too many)
+    or parentheses and operations nested deeper than max_depth (compiling and evaluating are recursive).
+    Every regex used on the message matches in linear time. Evaluation is given up once it took more than
+    time_budget seconds of CPU time (checked between operations, so a single action should keep its own cost bounded).
+    """
+    def __init__(self, *operations: Operation, operands: list, implicit: Union[Operation, None] = None,
+                 format_result: callable = str, version: Union[callable, None] = None, max_value_words: int = 4,
+                 plan_cache_size: int = 1000, max_operations: int = 50, max_depth: int = 30,
+                 time_budget: Union[float, None] = 0.05, max_tokens: int = 200,
+                 dated: Union[Operation, None] = None, **kwargs):
+        super().__init__(max_tokens=max_tokens, **kwargs)
+        self.operations = operations
+        self.operands = operands
+        self.implicit = implicit
+        self.dated = dated
+        self._date_operand = next((operand for operand in operands if operand.operand_type == 'date'), None)
+        self.format_result = format_result
+        self._version = version
+        self.max_value_words = max_value_words
+        self.plan_cache_size = plan_cache_size
+        self.max_operations = max_operations
+        self.max_depth = max_depth
+        self.time_budget = time_budget
+        self._plans = OrderedDict()  # shape -> Plan or None if it can't be compiled
+        self._plans_generations = None
+        self._plans_lock = threading.Lock()
+        self.plan_hits = 0
+        self.plan_misses = 0
+        self.plan_evictions = 0
+        self.plan_time_saved = 0.0
+
+        self._binary = {}
+        self._unary = {}
+        symbols = set()
+        for operation in operations:
+            table = self._unary if operation.unary else self._binary
+            for name in (operation.operator.operator, *operation.operator.aliases):
+                table[name] = operation
+                if not re.fullmatch(r'\w+', name):
+                    symbols.add(name)
+        symbols = sorted(symbols, key=len, reverse=True)  # "**" before "*"
+        symbol_chars = re.escape(''.join(set(''.join(symbols))) + '()')
+        tokens = rf"""
+            (?P<number>(?:\d|\.\d)[\d.,']*(?:[eE][+-]?\d+)?)
+          | (?P<symbol>{'|'.join(re.escape(symbol) for symbol in symbols + ['(', ')'])})
+          | (?P<word>[^\s{symbol_chars}]+)
+          | (?P<space>\s+)
+            """
+        self._arithmetic_token_regex = re.compile(tokens, flags=re.VERBOSE)
+        self._token_regex = self._arithmetic_token_regex
+        if dated is not None and self._date_operand is not None:  # candidates, see _scan
+            self._token_regex = re.compile(r'(?P<date>\d{4}-\d\d?-\d\d?)(?=\s*$)|' + tokens, flags=re.VERBOSE)
+        self._dated_names = set() if dated is None else \
+            {name.lower() for name in (dated.operator.operator, *dated.operator.aliases)}
+
+    def version(self):
+        return self._version() if self._version is not None else None
+
+    def _scan(self, string: str) -> tuple:
+        """Returns tokens and shape of string (lowercase tokens, digits of numbers replaced by 0).
+        Raises TooExpensive if string is too long or has too many tokens.
+        """
+        if len(string) > self.max_length:
+            raise TooExpensive(f'{len(string)} characters, {self.max_length} at most')
+        tokens = []
+        shape = []
+        for match in self._token_regex.finditer(string):
+            kind = match.lastgroup
+            if kind == 'space':
+                continue
+            if kind == 'date' and (self._date_operand.check(match.group()) is None or
+                                   not any(token.lower() in self._dated_names for token in tokens)):
+                parts = self._arithmetic_token_regex.finditer(match.group())  # 5000-20-30 is just a subtraction
+            else:
+                parts = (match,)
+            for part in parts:
+                if len(tokens) == self.max_tokens:
+                    raise TooExpensive(f'More than {self.max_tokens} tokens')
+                token = part.group()
+                tokens.append(token)
+                shape.append(token.translate(_MASK_DIGITS) if part.lastgroup in ('number', 'date') else token.lower())
+        return tokens, tuple(shape)
+
+    def tokenize(self, string: str) -> list:
+        """Splits string into words, numbers and operators."""
+        return self._scan(string)[0]
+
+    def compile(self, string: str) -> Plan:
+        """Returns compiled plan. Raises ParsingFailure if string is not an expression."""
+        return self._compile_tokens(*self._scan(string))[0]
+
+    def _compile_tokens(self, tokens: list, shape: tuple) -> tuple:
+        """Returns plan and values of its parameters for these tokens."""
+        started = time.perf_counter()
+        compilation = _Compilation(self, tokens, shape)
+        tree = compilation.expression(0)
+        if compilation.position != len(tokens):
+            raise ParsingFailure(f'Unexpected {tokens[compilation.position]}')
+        plan = Plan(tree, compilation.parameters, time.perf_counter() - started, compilation.explicit_operations,
+                    compilation.numeric)
+        return plan, compilation.values
+
+    def _plan(self, tokens: list, shape: tuple) -> tuple:
+        """Returns (plan or None, parameters) from the plan cache or compiles the plan.
+        Raises ParsingFailure if tokens are not an expression.
+        """
+        generations = tuple(operand.generation for operand in self.operands)
+        with self._plans_lock:
+            if generations != self._plans_generations:
+                self._plans.clear()
+                self._plans_generations = generations
+            cached = shape in self._plans
+            plan = self._plans.get(shape)
+            if cached:
+                self._plans.move_to_end(shape)
+
+        if cached:
+            started = time.perf_counter()
+            parameters = plan.bind(self, tokens) if plan is not None else []
+            if parameters is not None:
+                with self._plans_lock:
+                    self.plan_hits += 1
+                    if plan is not None:
+                        self.plan_time_saved += plan.compile_time - (time.perf_counter() - started)
+                if plan is None:
+                    raise ParsingFailure('Same shape could not be compiled before')
+                return plan, parameters
+
+        try:
+            plan, parameters = self._compile_tokens(tokens, shape)
+            if METRICS.enabled:
+                _COMPILE_SECONDS.observe(plan.compile_time)
+        except ParsingFailure:
+            self._remember(shape, None)
+            raise
+        except TooExpensive:  # not remembered: limits may be raised later, and it's cheap to refuse again anyway
+            with self._plans_lock:
+                self.plan_misses += 1
+            raise
+        self._remember(shape, plan)
+        return plan, parameters
+
+    def _remember(self, shape: tuple, plan: Union[Plan, None]):
+        with self._plans_lock:
+            self.plan_misses += 1
+            self._plans[shape] = plan
+            self._plans.move_to_end(shape)
+            while len(self._plans) > self.plan_cache_size:
+                self._plans.popitem(last=False)
+                self.plan_evictions += 1
+
+    def plan_stats(self) -> dict:
+        """Plan cache counters. time_saved is an estimate (seconds): compile time of plans that were reused
+        minus time spent recognizing numbers of messages instead.
+        """
+        with self._plans_lock:
+            lookups = self.plan_hits + self.plan_misses
+            return {'size': len(self._plans),
+                    'hits': self.plan_hits,
+                    'misses': self.plan_misses,
+                    'hit_rate': self.plan_hits / lookups if lookups else 0.0,
+                    'evictions': self.plan_evictions,
+                    'time_saved': self.plan_time_saved}
+
+    def clear_plans(self):
+        with self._plans_lock:
+            self._plans.clear()
+
+    def _value(self, words: list):
+        """Returns value recognized by the first operand that accepts words, None if none of them does."""
+        string = ' '.join(words)
+        for operand in self.operands:
+            value = operand.check(string)
+            if value is not None:
+                return value
+        return None
+
+    def evaluate(self, string: str, require_operator: bool = True):
+        """Returns value of the expression as it is (not formatted).
+        With require_operator=False values without an (explicit) operator, like "100 usd", are evaluated too.
+        Raises ParsingFailure if string is not an expression, ValueError or ArithmeticError if it can't be calculated
+        (TooExpensive if it's too large to even try).
+        """
+        return self._evaluate_plan(*self._plan(*self._scan(string)), require_operator)
+
+    def _evaluate_plan(self, plan: Plan, parameters: list, require_operator: bool = True):
+        if require_operator and not plan.explicit_operations:
+            raise ParsingFailure('No operator found in string')
+        if plan.cost > self.max_operations:
+            raise TooExpensive(f'{plan.cost} operations, {self.max_operations} at most')
+        deadline = time.thread_time() + self.time_budget if self.time_budget is not None else None
+        return plan.evaluate(parameters, deadline)
+
+    def _parse(self, string, tried: Union[list, None] = None) -> tuple:
+        version = self.version()
+        if tried is not None:
+            tried.append((self, version))
+        started = time.perf_counter() if METRICS.enabled else None
+        operation = None
+        result = 'failed'
+        try:
+            plan, parameters = self._plan(*self._scan(string))
+            if tried is not None and plan.numeric:
+                tried.remove((self, version))  # answer doesn't depend on version
+            if isinstance(plan.tree, Apply):
+                operation = plan.tree.operation.operator.operator
+            answer = self.format_result(self._evaluate_plan(plan, parameters))
+            result = 'ok'
+            return True, answer
+        except ParsingFailure:
+            return False, None
+        except (ValueError, ArithmeticError) as e:
+            result = 'refused'
+            return True, _refuse(e, tried)
+        finally:
+            if started is not None:
+                _EXPRESSION_SECONDS.observe(time.perf_counter() - started, operation=operation or 'none',
+                                            result=result)
+
+
+class _Compilation:
+    """State of ExpressionParser.compile: tokens, position of the next one and parameters found so far."""
+
+    def __init__(self, parser: ExpressionParser, tokens: list, shape: tuple):
+        self.parser = parser
+        self.tokens = tokens
+        self.shape = shape
+        self.position = 0
+        self.explicit_operations = 0
+        self.operations = 0
+        self.depth = 0
+        self.numeric = True  # no values other than numbers so far
+        self.parameters = []
+        self.values = []
+
+    def _peek(self, position: Union[int, None] = None) -> Union[str, None]:
+        """Returns token at position (current one by default) or None if there are no more tokens."""
+        if position is None:
+            position = self.position
+        return self.tokens[position] if position < len(self.tokens) else None
+
+    def _is_value(self, token: Union[str, None]) -> bool:
+        return token is not None and token not in ('(', ')') and token.lower() not in self.parser._binary \
+            and token.lower() not in self.parser._unary
+
+    def _apply(self, operation: Operation, arguments: tuple) -> Apply:
+        self.operations += 1
+        if self.operations > self.parser.max_operations:
+            raise TooExpensive(f'More than {self.parser.max_operations} operations')
+        return Apply(operation, arguments)
+
+    def expression(self, min_precedence: int):
+        """Precedence climbing: parses operations with precedence >= min_precedence."""
+        self.depth += 1
+        if self.depth > self.parser.max_depth:
+            raise TooExpensive(f'Nested deeper than {self.parser.max_depth} levels')
+        left = self.unary()
+        while True:
+            token = self._peek()
+            operation = self.parser._binary.get(token.lower()) if token is not None else None
+            if operation is None or operation.precedence < min_precedence:
+                self.depth -= 1
+                return left
+            self.position += 1
+            self.explicit_operations += 1
+            right = self.expression(operation.precedence + (0 if operation.right_associative else 1))
+            left = self._apply(operation, (left, right))
+
+    def unary(self):
+        token = self._peek()
+        operation = self.parser._unary.get(token.lower()) if token is not None else None
+        if operation is None:
+            return self.primary()
+        self.position += 1
+        self.explicit_operations += 1
+        return self._apply(operation, (self.expression(operation.precedence),))
+
+    def primary(self):
+        tree = None
+        if self._peek() == '(':
+            self.position += 1
+            tree = self.expression(0)
+            if self._peek() != ')':
+                raise ParsingFailure('Missing )')
+            self.position += 1
+        elif not self._is_value(self._peek()):
+            raise ParsingFailure('Not enough operands')
+        end = self.position
+        while self._is_value(self._peek(end)):
+            end += 1
+
+        # splitting words between operators into values, longest values first ("(27 + 45) USD" works too)
+        while self.position < end:
+            for length in range(min(end - self.position, self.parser.max_value_words), 0, -1):
+                value = self.parser._value(self.tokens[self.position:self.position + length])
+                if value is not None:
+                    break
+            else:  # (nobreak)
+                raise ParsingFailure('No valid operands')
+            leaf = self._leaf(value, length)
+            self.position += length
+            if tree is None:
+                tree = leaf
+            elif self.parser.implicit is None:
+                raise ParsingFailure('Operator missing')
+            else:
+                tree = self._apply(self.parser.implicit, (tree, leaf))
+        return tree
+
+    def _leaf(self, value, length: int) -> Union[Literal, Parameter]:
+        """Value with any digits in it (a number, a date) becomes a Parameter, words are constants of the plan.
+        Even "0" is a Parameter: its shape is "0" as well, but so is the shape of "5".
+        """
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            self.numeric = False
+        words = self.tokens[self.position:self.position + length]
+        if not any(_DIGIT.search(word) for word in words):
+            return Literal(value)  # every message of this shape has the same words here
+        self.parameters.append((self.position, length))
+        self.values.append(value)
+        return Parameter(len(self.parameters) - 1)
+
+
+class CachingExpressionParser(CachingParser, ExpressionParser):
+    """ExpressionParser that caches its answers like CachingParser does."""
+    pass
 
 
 if __name__ == '__main__':
@@ -0,0 +1,152 @@
+"""Measures how long the parser takes to answer typical messages.
+Launch this file to see per-message latency of the expression parser compared to the old ParserCase cascade
+(both trying every case in turn and Parser.parse dispatch), with and without its plan cache,
+and to answering from the cache,
+how fast float operands are recognized compared to the old four-attempt cascade,
+and how long inline mode takes to suggest conversions for a query.
+Note: bot_parser fetches currency rates when its parsers are first used, so you'll need a working internet connection.
+"""
+
+import re
+import timeit
+from parser_ import ExpressionParser, Parser, ParsingFailure, genericFloatOperand
+
+MESSAGES = ('100 USD in EUR',
+            'EUR 100 в CHF',
+            '1000 баксов в рублях',
+            '250 000 rub in gbp',
+            '150 * 20',
+            '2 ^ 4',
+            '2+3',
+            '10 / 4',
+            'pink googles',
+            '27 + 45 USD in EUR',
+            '(2 + 3) * 4 ^ 2')
+
+FLOATS = ('100', '12.5', '120 000', "120'000", '120,000', '12,45', '1.25e6', '1.25 USD', 'in', 'EUR')
+
+
+def try_every_case(parser, string):
+    """This is how Parser.parse used to work: every case tokenizes and checks the string on its own."""
+    for case in parser.parsers:
+        try:
+            return case.parse(string)
+        except ParsingFailure:
+            continue
+    return f"Can't parse '{string}'"
+
+
+def compile_every_time(parser, string):
+    """This is how ExpressionParser used to work before plans were cached."""
+    try:
+        plan, parameters = parser._compile_tokens(*parser._scan(string))
+        if not plan.explicit_operations:
+            raise ParsingFailure('No operator found in string')
+        return parser.format_result(plan.evaluate(parameters))
+    except ParsingFailure:
+        return f"Can't parse '{string}'"
+
+
+def check_float_cascade(what):
+    """This is how ParserOperand._check_float used to work (with operand_checker=lambda x: True)."""
+    what = re.sub('[ ]', '', what)
+    try:
+        return float(what)
+    except ValueError:
+        pass
+    try:
+        value = float(re.sub('[,]', '.', what, 1))
+        if len(re.split('[,]', what)[-1]) > 2:
+            raise ValueError
+        return value
+    except ValueError:
+        pass
+    try:
+        return float(re.sub("[,']", '', what))
+    except ValueError:
+        pass
+    try:
+        return float(re.sub('[,]', '.', re.sub("[,']", '', what), 1))
+    except ValueError:
+        pass
+    return None
+
+
+def microseconds(func, repeat):
+    return timeit.timeit(func, number=repeat) / repeat * 1e6
+
+
+def run_floats(repeat: int = 20000):
+    """Prints microseconds per float operand check for both approaches."""
+    print(f'{"operand":<25}{"cascade, us":>16}{"grammar, us":>16}')
+    for what in FLOATS:
+        assert check_float_cascade(what) == genericFloatOperand.check(what)
+        old = microseconds(lambda: check_float_cascade(what), repeat)
+        new = microseconds(lambda: genericFloatOperand.check(what), repeat)
+        print(f'{what:<25}{old:>16.2f}{new:>16.2f}')
+
+
+def run_messages(repeat: int = 2000):
+    """Prints microseconds per message for every approach.
+    Cascade can't parse messages with several operations, so it's only checked against the expression parser
+    when it can.
+    """
+    from bot_parser import caseParser, telegramParser
+
+    print(f'{caseParser.parser_count} parser cases, {repeat} runs per message')
+    print(f'{"message":<25}{"every case, us":>16}{"dispatch, us":>16}{"compile, us":>16}{"plan, us":>16}'
+          f'{"cached, us":>16}')
+    for message in MESSAGES:
+        answer = Parser.parse(caseParser, message)
+        assert try_every_case(caseParser, message) == answer
+        assert answer.startswith("Can't parse") or answer == ExpressionParser.parse(telegramParser, message)
+        assert telegramParser.parse(message) == ExpressionParser.parse(telegramParser, message)
+        assert compile_every_time(telegramParser, message) == ExpressionParser.parse(telegramParser, message)
+        every_case = microseconds(lambda: try_every_case(caseParser, message), repeat)
+        dispatch = microseconds(lambda: Parser.parse(caseParser, message), repeat)
+        compiled = microseconds(lambda: compile_every_time(telegramParser, message), repeat)
+        planned = microseconds(lambda: ExpressionParser.parse(telegramParser, message), repeat)
+        cached = microseconds(lambda: telegramParser.parse(message), repeat)
+        print(f'{message:<25}{every_case:>16.1f}{dispatch:>16.1f}{compiled:>16.1f}{planned:>16.1f}{cached:>16.1f}')
+    print(telegramParser.cache_stats())
+
+
+def run_templates(count: int = 5000):
+    """Messages of the same shape with different numbers: answer cache doesn't help, plan cache does."""
+    from bot_parser import telegramParser
+
+    templates = ('{} usd in rub', '{} баксов в рублях', '{} + 45 usd in eur', '{} * 20')
+    print(f'{"template":<25}{"compile, us":>16}{"plan, us":>16}')
+    for template in templates:
+        messages = [template.format(number) for number in range(100, 100 + count)]
+        telegramParser.clear_plans()
+        started = timeit.default_timer()
+        for message in messages:
+            compile_every_time(telegramParser, message)
+        compiled = (timeit.default_timer() - started) / count * 1e6
+        started = timeit.default_timer()
+        for message in messages:
+            ExpressionParser.parse(telegramParser, message)
+        planned = (timeit.default_timer() - started) / count * 1e6
+        print(f'{template:<25}{compiled:>16.1f}{planned:>16.1f}')
+    print(telegramParser.plan_stats())
+
+
+def run_suggestions(repeat: int = 2000):
+    """Prints microseconds per inline query: prefix index lookup alone and whole suggest_conversions."""
+    from bot_parser import CurrencyConverter, suggest_conversions
+
+    index = CurrencyConverter.currency_index()
+    print(f'{"query":<25}{"lookup, us":>16}{"suggest, us":>16}{"results":>10}')
+    for query in ('100 usd in', '100 usd in e', '100 usd in eu', '1000 баксов в руб', '27 + 45 usd in g'):
+        prefix = query.split()[-1] if not query.endswith(' in') else ''
+        lookup = microseconds(lambda: index.lookup(prefix), repeat)
+        suggest = microseconds(lambda: suggest_conversions(query), repeat)
+        print(f'{query:<25}{lookup:>16.2f}{suggest:>16.1f}{len(suggest_conversions(query)):>10}')
+
+
+if __name__ == '__main__':
+    run_floats()
+    run_messages()
+    run_templates()
+    run_suggestions()
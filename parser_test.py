@@ -1,4 +1,7 @@
+from datetime import date
+import time
 import unittest
+import parser_
 from parser_ import *
 
 
@@ -51,8 +54,27 @@ class ParserOperandTest(unittest.TestCase):
             self.assertEqual(self.operand2.check(each.lower()), each)
         pass
 
-    def test_list_with_synonyms(self):  # todo synonyms
-        pass
+    def test_list_with_synonyms(self):
+        operand = ParserOperand('list', operand_list=['USD', 'RUB', 'EUR'],
+                                synonym_dict={'бакс[\\w]*': 'USD', 'рубл[\\w]*': 'RUB', '\\$': 'USD', 'евро': 'EUR'})
+        valid_inputs = {'баксов': 'USD', 'Рублях': 'RUB', '$': 'USD', 'usd': 'USD', ' ЕВРО ': 'EUR'}
+        for input, output in valid_inputs.items():
+            self.assertEqual(operand.check(input), output)
+        for input in ('баксы рубли', 'gbp', 'евровидение'):
+            self.assertIsNone(operand.check(input))
+
+    def test_list_update(self):
+        self.assertIsNone(self.operand2.check('baz'))
+        self.operand2.operand_list = ['foo', 'Baz']
+        self.assertEqual(self.operand2.check('BAZ'), 'Baz')
+        self.assertIsNone(self.operand2.check('bar'))
+
+    def test_date(self):
+        operand = ParserOperand('date')
+        self.assertEqual(operand.check('2022-06-01'), date(2022, 6, 1))
+        self.assertEqual(operand.check('1.6.2022'), date(2022, 6, 1))
+        for input in ('2022-02-30', '2022-06', '100', 'usd', '22-06-01'):
+            self.assertIsNone(operand.check(input))
 
 
 class CombinationsTest(unittest.TestCase):
@@ -106,5 +128,235 @@ class ParserCaseTest(unittest.TestCase):
             print(value)
 
 
+class ParserTest(unittest.TestCase):
+
+    def setUp(self):
+        in_operator = ParserOperator('in', aliases=['в', ])
+        code_operand = ParserOperand('list', operand_list=['USD', 'EUR', 'GBP', 'RUB'])
+        self.conversion = ParserCase(genericFloatPositiveOperand, code_operand, in_operator, code_operand,
+                                     quick_action=lambda *args: 'conversion')
+        self.addition = ParserCase(genericFloatOperand, ParserOperator('+'), genericFloatOperand,
+                                   quick_action=lambda a, b: str(a + b))
+        self.power = ParserCase(genericFloatOperand, ParserOperator('^', aliases=['**']), genericFloatOperand,
+                                quick_action=lambda a, b: str(a ** b))
+        self.parser = Parser(self.conversion, self.addition, self.power)
+
+    def test_parse(self):
+        self.assertEqual(self.parser.parse('100 USD in EUR'), 'conversion')
+        self.assertEqual(self.parser.parse('100 USD В EUR'), 'conversion')
+        self.assertEqual(self.parser.parse('2+3'), '5.0')
+        self.assertEqual(self.parser.parse('2 ** 3'), '8.0')
+        self.assertEqual(self.parser.parse('2 in 3'), "Can't parse '2 in 3'")
+
+    def test_limits(self):
+        self.parser.max_tokens = 5
+        self.assertEqual(self.parser.parse('250 000 USD in EUR'), 'conversion')
+        self.assertTrue(self.parser.parse('250 000 000 USD in EUR').startswith('Слищком долга'))
+        self.assertTrue(self.parser.parse('1' * 600 + ' + 1').startswith('Слищком долга'))
+        caching = CachingParser(self.addition)
+        self.assertTrue(caching.parse('1' * 600 + ' + 1').startswith('Слищком долга'))
+        self.assertEqual(caching.cache_stats()['size'], 0)
+
+    def test_appended_case(self):
+        self.parser.parsers.append(ParserCase(genericFloatOperand, ParserOperator('*'), genericFloatOperand,
+                                              quick_action=lambda a, b: str(a * b)))
+        self.assertEqual(self.parser.parse('2 * 3'), '6.0')
+
+
+class CachingParserTest(unittest.TestCase):
+
+    def setUp(self):
+        self.calls = 0
+        self.rate = 2
+
+        def convert(value, currency):
+            self.calls += 1
+            return f'{value * self.rate} {currency}'
+
+        in_operator = ParserOperator('in')
+        code_operand = ParserOperand('list', operand_list=['USD', 'EUR'])
+        self.conversion = ParserCase(genericFloatOperand, in_operator, code_operand, quick_action=convert)
+        self.conversion.version = lambda: self.rate
+        self.addition = ParserCase(genericFloatOperand, ParserOperator('+'), genericFloatOperand,
+                                   quick_action=lambda a, b: str(a + b))
+        self.parser = CachingParser(self.conversion, self.addition, cache_size=2)
+
+    def test_hits(self):
+        self.assertEqual(self.parser.parse('10 in usd'), '20.0 USD')
+        self.assertEqual(self.parser.parse(' 10  in usd '), '20.0 USD')
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(self.parser.parse('2 in 3'), "Can't parse '2 in 3'")
+        self.assertEqual(self.parser.parse('2  in 3'), "Can't parse '2  in 3'")
+        stats = self.parser.cache_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
+
+    def test_invalidation(self):
+        self.parser.parse('10 in usd')
+        self.parser.parse('1 + 2')
+        self.rate = 3
+        self.assertEqual(self.parser.parse('10 in usd'), '30.0 USD')
+        self.assertEqual(self.parser.parse('1 + 2'), '3.0')
+        stats = self.parser.cache_stats()
+        self.assertEqual((stats['hits'], stats['invalidations']), (1, 1))
+
+    def test_refusals(self):
+        cases = CachingParser(self.conversion, self.addition, max_length=20, max_tokens=3)
+        expression = CachingExpressionParser(Operation(ParserOperator('+'), lambda a, b: a + b),
+                                             operands=[genericFloatOperand], max_tokens=3)
+        for string, parser in (('1 + 2 + 3', cases), ('1' * 21, cases), ('1 + 2 + 3', expression),
+                               ('1 + 2 + 3', expression)):
+            self.assertTrue(parser.parse(string).startswith('Слищком долга'), string)
+        self.assertEqual(cases.cache_stats()['size'], 0)  # limits may be raised, so refusals aren't remembered
+        self.assertEqual(expression.cache_stats()['size'], 0)
+        expression.max_tokens = 5
+        self.assertEqual(expression.parse('1 + 2 + 3'), '6.0')
+
+    def test_eviction(self):
+        for string in ('1 + 1', '1 + 2', '1 + 3', '1 + 1'):
+            self.parser.parse(string)
+        stats = self.parser.cache_stats()
+        self.assertEqual((stats['size'], stats['hits'], stats['evictions']), (2, 0, 2))
+
+
+class ExpressionParserTest(unittest.TestCase):
+
+    def setUp(self):
+        code_operand = ParserOperand('list', operand_list=['USD', 'EUR'])
+
+        def attach(value, currency):
+            if not isinstance(value, float) or not isinstance(currency, str):
+                raise ParsingFailure('Expected number and currency')
+            return f'{value} {currency}'
+
+        self.parser = ExpressionParser(
+            Operation(ParserOperator('+'), lambda a, b: a + b, precedence=1),
+            Operation(ParserOperator('-'), lambda a, b: a - b, precedence=1),
+            Operation(ParserOperator('*'), lambda a, b: a * b, precedence=2),
+            Operation(ParserOperator('/'), lambda a, b: a / b, precedence=2),
+            Operation(ParserOperator('-'), lambda a: -a, precedence=3, unary=True),
+            Operation(ParserOperator('^', aliases=['**']), lambda a, b: a ** b, precedence=4,
+                      right_associative=True),
+            operands=[genericFloatOperand, code_operand],
+            implicit=Operation(ParserOperator(''), attach))
+
+    def test_precedence(self):
+        self.assertEqual(self.parser.parse('2 + 2 * 2'), '6.0')
+        self.assertEqual(self.parser.parse('(2 + 2) * 2'), '8.0')
+        self.assertEqual(self.parser.parse('10 - 2 - 3'), '5.0')
+        self.assertEqual(self.parser.parse('2 ** 3 ^ 2'), '512.0')
+        self.assertEqual(self.parser.parse('-2^2'), '-4.0')
+        self.assertEqual(self.parser.parse('2 * -3'), '-6.0')
+
+    def test_values(self):
+        self.assertEqual(self.parser.parse('250 000 + 1'), '250001.0')
+        self.assertEqual(self.parser.parse('2 usd'), "Can't parse '2 usd'")
+        self.assertEqual(self.parser.parse('(1 + 2) usd'), '3.0 USD')
+        self.assertEqual(self.parser.tokenize('2+3 usd'), ['2', '+', '3', 'usd'])
+
+    def test_plans(self):
+        self.assertEqual(self.parser.parse('100 +'), "Can't parse '100 +'")
+        self.assertEqual(self.parser.parse('(2 + 3) usd'), '5.0 USD')
+        self.assertEqual(self.parser.parse('(20 + 30) USD'), '50.0 USD')
+        self.assertEqual(self.parser.parse('(0 + 0) eur'), '0.0 EUR')
+        self.assertEqual(self.parser.parse('(0 + 0) usd'), '0.0 USD')
+        self.assertEqual(self.parser.parse('12,45 * 1'), '12.45')
+        self.assertEqual(self.parser.parse('12,456 * 1'), '12456.0')
+        self.assertEqual(self.parser.parse('200 +'), "Can't parse '200 +'")
+        stats = self.parser.plan_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 6))
+        self.parser.operands[1].operand_list = ['USD']
+        self.assertEqual(self.parser.parse('(2 + 3) eur'), "Can't parse '(2 + 3) eur'")
+        self.assertEqual(self.parser.plan_stats()['size'], 1)
+
+    def test_zeros(self):
+        for first, second, answer in (('0 + 1', '5 + 1', '6.0'), ('10 * 0', '10 * 3', '30.0'),
+                                      ('(0 + 0) usd', '(2 + 0) usd', '2.0 USD'), ('0,0 + 1', '2,5 + 1', '3.5')):
+            self.parser.parse(first)
+            self.assertEqual(self.parser.parse(second), answer)  # same shape, same plan, different numbers
+
+    def test_budget(self):
+        self.parser.max_operations = 3
+        self.assertEqual(self.parser.parse('1 + 2 + 3 + 4'), '10.0')
+        self.assertTrue(self.parser.parse('1 + 2 + 3 + 4 + 5').startswith('Слищком долга'))
+
+        def slow(a, b):
+            started = time.thread_time()
+            while time.thread_time() - started < 0.01:
+                pass
+            return a * b
+
+        parser = ExpressionParser(Operation(ParserOperator('*'), slow), operands=[genericFloatOperand],
+                                  time_budget=0.005)
+        self.assertEqual(parser.parse('2 * 3'), '6.0')
+        self.assertTrue(parser.parse('2 * 3 * 4').startswith('Слищком долга'))
+
+    def test_limits(self):
+        for string in ('1' * 501, '1 + ' * 101 + '1', '1+' * 60 + '1', '(' * 40 + '1' + ')' * 40,
+                       '2 ^ ' * 40 + '2', '- ' * 40 + '1', '1 usd ' * 60):
+            self.assertTrue(self.parser.parse(string).startswith('Слищком долга'), string)
+            self.assertRaises(TooExpensive, self.parser.evaluate, string)
+        self.assertEqual(self.parser.parse('(' * 20 + '1' + ')' * 20 + ' + 1'), '2.0')
+        self.assertEqual(self.parser.parse('1+' * 50 + '1'), '51.0')
+        self.parser.max_operations = 100  # limits may be raised, refusals aren't remembered
+        self.assertEqual(self.parser.parse('1+' * 60 + '1'), '61.0')
+
+    def test_dates(self):
+        def at(value, day):
+            if not isinstance(day, date):
+                raise ParsingFailure('Expected a date')
+            return f'{value} at {day.isoformat()}'
+
+        operation = Operation(ParserOperator('at'), at, precedence=0)
+        parser = ExpressionParser(operation, *self.parser.operations,
+                                  operands=[genericFloatOperand, ParserOperand('date')], dated=operation)
+        self.assertEqual(parser.tokenize('5 at 2022-06-01'), ['5', 'at', '2022-06-01'])
+        self.assertEqual(parser.parse('5 at 2022-06-01'), '5.0 at 2022-06-01')
+        self.assertEqual(parser.parse('5 AT 2022-6-1 '), '5.0 at 2022-06-01')
+        self.assertEqual(parser.parse('6 at 2022-07-11'), '6.0 at 2022-07-11')
+        self.assertEqual(parser.plan_stats()['hits'], 1)
+        self.assertEqual(parser.parse('5 at 1.6.2022'), '5.0 at 2022-06-01')
+        # anything but a valid date at the end of a dated operation is arithmetic
+        self.assertEqual(parser.tokenize('2022-06-01 - 1'), ['2022', '-', '06', '-', '01', '-', '1'])
+        self.assertEqual(parser.tokenize('2000-10-5'), ['2000', '-', '10', '-', '5'])
+        self.assertEqual(parser.parse('2000-10-5'), '1985.0')
+        self.assertEqual(parser.parse('5000-20-30'), '4950.0')
+        self.assertEqual(parser.parse('5 at 2022-02-30'), "Can't parse '5 at 2022-02-30'")
+        self.assertEqual(self.parser.tokenize('5 at 2022-06-01'), ['5', 'at', '2022', '-', '06', '-', '01'])
+
+    def test_cache(self):
+        version = [1]
+        parser = CachingExpressionParser(*self.parser.operations, operands=self.parser.operands,
+                                         implicit=self.parser.implicit, version=lambda: version[0])
+        parser.parse('2 + 2')
+        parser.parse('(1 + 2) usd')
+        version[0] = 2  # numbers only don't depend on version, currencies do
+        self.assertEqual(parser.parse('2 + 2'), '4.0')
+        self.assertEqual(parser.parse('(1 + 2) usd'), '3.0 USD')
+        stats = parser.cache_stats()
+        self.assertEqual((stats['hits'], stats['invalidations']), (1, 1))
+
+    def test_metrics(self):
+        histogram = parser_._EXPRESSION_SECONDS
+
+        def counts():
+            return {(labels['operation'], labels['result']): value
+                    for name, labels, value in histogram.samples() if name.endswith('_count')}
+
+        before = counts()
+        METRICS.enable()
+        self.addCleanup(METRICS.enable, False)
+        for string in ('2 + 2', '(1 + 2) usd', '1 / 0', '2 +', '2'):
+            self.parser.parse(string)
+        after = counts()
+        self.assertEqual({key: value - before.get(key, 0) for key, value in after.items()
+                          if value != before.get(key)},
+                         {('+', 'ok'): 1, ('none', 'ok'): 1, ('/', 'refused'): 1, ('none', 'failed'): 2})
+
+    def test_failures(self):
+        for string in ('2', '2 +', '(2 + 3', '2 + 3)', 'hello + world', 'usd eur + 1', ''):
+            self.assertEqual(self.parser.parse(string), f"Can't parse '{string}'")
+        self.assertTrue(self.parser.parse('1 / 0').startswith('Ощибочка вышла'))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,361 @@
+"""This file defines how currency rates are stored.
+On disk (between restarts) rates are kept in a snapshot: a small binary file with a header, currency codes
+and an array of doubles. Loading it is a lot faster than parsing API's json, and it works without internet.
+In memory, CrossRates keeps exchange rate for every currency pair, so conversions need no arithmetic on rates.
+RatesClient is what fetches rates from an API, HedgedRatesSource asks several APIs at once.
+SharedRatesStore lets one process share rates it fetched with other processes of the bot.
+"""
+
+from array import array
+from collections import deque
+from dataclasses import dataclass
+import json
+import os
+import random
+import struct
+import threading
+import time
+from typing import Union
+from urllib.parse import urlparse
+# numpy, requests, concurrent.futures and multiprocessing take a while to import, so they are only imported
+# when they're needed
+
+SNAPSHOT_MAGIC = b'RATES\x01'
+_HEADER = struct.Struct('<6sdII')  # magic, fetched_at, number of currencies, length of codes
+
+
+def save_snapshot(path: str, rates: dict, fetched_at: float):
+    """Writes rates to path. File is replaced atomically, so a crash never leaves half a snapshot."""
+    codes = '\n'.join(rates.keys()).encode('ascii')
+    values = array('d', rates.values())
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(_HEADER.pack(SNAPSHOT_MAGIC, fetched_at, len(values), len(codes)))
+        file.write(codes)
+        file.write(values.tobytes())
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str) -> Union[tuple, None]:
+    """Returns (rates, fetched_at) stored in path or None if there is no valid snapshot."""
+    try:
+        with open(path, 'rb') as file:
+            data = file.read()
+        magic, fetched_at, count, codes_length = _HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            return None
+        codes_end = _HEADER.size + codes_length
+        codes = data[_HEADER.size:codes_end].decode('ascii').split('\n')
+        values = array('d')
+        values.frombytes(data[codes_end:])
+    except (OSError, struct.error, UnicodeDecodeError, ValueError):
+        return None
+    if len(codes) != count or len(values) != count:
+        return None
+    return dict(zip(codes, values)), fetched_at
+
+
+@dataclass(frozen=True)
+class CrossRates:
+    """Dense matrix of cross rates built from USD-based rates.
+    matrix[index['EUR'], index['GBP']] is how many GBP you get for 1 EUR.
+    Codes are sorted, so arrays of codes are turned into indices with numpy.searchsorted.
+    """
+    codes: 'numpy.ndarray'
+    index: dict
+    matrix: 'numpy.ndarray'
+
+    @classmethod
+    def from_rates(cls, rates: dict) -> 'CrossRates':
+        import numpy
+        codes = numpy.array(sorted(rates.keys()))
+        usd_based = numpy.array([rates[code] for code in codes], dtype=float)
+        return cls(codes=codes,
+                   index={code: number for number, code in enumerate(codes.tolist())},
+                   matrix=usd_based[numpy.newaxis, :] / usd_based[:, numpy.newaxis])
+
+    def rate(self, orig_currency: str, target_currency: str) -> float:
+        """Raises KeyError for unknown currency codes."""
+        return float(self.matrix[self.index[orig_currency], self.index[target_currency]])
+
+    def _indices(self, codes) -> 'numpy.ndarray':
+        import numpy
+        codes = numpy.asarray(codes)
+        indices = numpy.minimum(numpy.searchsorted(self.codes, codes), len(self.codes) - 1)
+        unknown = self.codes[indices] != codes
+        if numpy.any(unknown):
+            raise KeyError(f'Unknown currency codes: {numpy.unique(codes[unknown]).tolist()}')
+        return indices
+
+    def convert_many(self, values, from_codes, to_codes) -> 'numpy.ndarray':
+        """Converts lots of amounts at once (e.g. a whole ledger) in a single vectorized operation.
+        Either of from_codes and to_codes may be a single code or a sequence with one code per value.
+        Raises KeyError for unknown currency codes.
+        """
+        import numpy
+        values = numpy.asarray(values, dtype=float)
+        return values * self.matrix[self._indices(from_codes), self._indices(to_codes)]
+
+
+class RatesUnavailable(Exception):
+    """Raised if API didn't give us rates after all the retries."""
+    pass
+
+
+def normalize_rates(rates: dict, base: str) -> dict:
+    """Turns rates based on any currency into USD-based ones. Raises KeyError if there's no USD rate."""
+    rates = dict(rates)
+    rates.setdefault(base, 1.0)  # some APIs don't list the base currency itself
+    usd = rates['USD']
+    if base == 'USD' and usd == 1:
+        return rates
+    return {code: value / usd for code, value in rates.items()}
+
+
+class RatesClient:
+    """Fetches rates from API via a pooled keep-alive session. Rates based on other currency than USD
+    (specify base) are converted to USD-based ones.
+    Requests are conditional (ETag / Last-Modified), so unchanged rates are neither downloaded nor parsed again.
+    Failed attempts are retried max_retries times with exponential backoff and jitter:
+    before attempt #n it waits for a random time between half and all of min(backoff * 2 ** n, max_backoff).
+    """
+    def __init__(self, url: str, params: Union[dict, None] = None, base: str = 'USD', max_retries: int = 5,
+                 timeout: float = 3, backoff: float = 0.5, max_backoff: float = 8, name: Union[str, None] = None):
+        self.url = url
+        self.params = params
+        self.base = base
+        self.name = name or urlparse(url).netloc
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        import requests
+        self.session = requests.Session()
+        self.session.mount('https://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self.session.mount('http://', requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+        self._validators = {}  # headers for conditional request
+        self._last_content = None
+        self.last_rates = None  # what fetch returned last time it returned something
+        self.last_fetched_at = None  # and when (time.time())
+
+    def _wait(self, attempt: int):
+        delay = min(self.backoff * 2 ** attempt, self.max_backoff)
+        time.sleep(delay * random.uniform(0.5, 1))
+
+    def fetch(self) -> Union[dict, None]:
+        """Returns new rates or None if they haven't changed since the last fetch.
+        Raises RatesUnavailable if API is down or its rates are no good (no USD rate: retries won't help).
+        """
+        import requests
+        for attempt in range(self.max_retries):
+            if attempt:
+                self._wait(attempt - 1)
+            print(f'Attempt #{attempt + 1} to reach {self.name}.')
+            try:
+                answer = self.session.get(self.url, params=self.params, timeout=self.timeout,
+                                          headers=self._validators)
+            except requests.exceptions.RequestException:
+                continue
+            if answer.status_code == 304:
+                return None
+            if answer.status_code != 200:
+                continue
+            if answer.content == self._last_content:  # server doesn't support conditional requests
+                return None
+            try:
+                rates = json.loads(answer.content)['rates']
+            except (ValueError, KeyError, TypeError):  # broken answer, let's hope next one is fine
+                continue
+            try:
+                rates = normalize_rates(rates, self.base)
+            except (KeyError, TypeError, ZeroDivisionError) as e:
+                raise RatesUnavailable(f'{self.name} gave rates without a valid USD rate: {e!r}')
+
+            self.last_rates = rates
+            self.last_fetched_at = time.time()
+            self._last_content = answer.content
+            self._validators = {}
+            if 'ETag' in answer.headers:
+                self._validators['If-None-Match'] = answer.headers['ETag']
+            if 'Last-Modified' in answer.headers:
+                self._validators['If-Modified-Since'] = answer.headers['Last-Modified']
+            return rates
+        raise RatesUnavailable(f'Unable to reach {self.url} after {self.max_retries} attempts')
+
+
+class HedgedRatesSource:
+    """Asks several providers (anything with name, fetch(), last_rates and last_fetched_at, like RatesClient) for rates.
+    Starts with the first provider. If it didn't answer within hedge_after seconds (or failed),
+    the next one is asked too, without cancelling the first. The first valid answer wins.
+    fetch() works like RatesClient.fetch: returns new rates, None if they haven't changed or raises RatesUnavailable.
+    Rates a provider fetched before the ones returned last time (e.g. by another provider) aren't new.
+    Keeps latency of every refresh and every provider, see stats().
+    """
+    def __init__(self, providers: list, hedge_after: float = 1, history: int = 1000):
+        if not providers:
+            raise ValueError('Need at least one provider')
+        from concurrent.futures import ThreadPoolExecutor
+        self.providers = list(providers)
+        self.hedge_after = hedge_after
+        self._executor = ThreadPoolExecutor(max_workers=len(self.providers), thread_name_prefix='rates provider')
+        self._lock = threading.Lock()
+        self._last_rates = None
+        self._last_fetched_at = None
+        self._refresh_latencies = deque(maxlen=history)
+        self._provider_stats = {provider.name: {'requests': 0, 'wins': 0, 'failures': 0,
+                                                'latencies': deque(maxlen=history)}
+                                for provider in self.providers}
+
+    def _fetch_from(self, provider) -> tuple:
+        """Runs on executor. Returns (rates the provider has, fresh or not, when it fetched them)."""
+        started = time.perf_counter()
+        stats = self._provider_stats[provider.name]
+        try:
+            rates = provider.fetch()
+        except RatesUnavailable:
+            with self._lock:
+                stats['requests'] += 1
+                stats['failures'] += 1
+            raise
+        with self._lock:
+            stats['requests'] += 1
+            stats['latencies'].append(time.perf_counter() - started)
+        if rates is None:
+            return provider.last_rates, provider.last_fetched_at
+        return rates, provider.last_fetched_at
+
+    def fetch(self) -> Union[dict, None]:
+        from concurrent.futures import FIRST_COMPLETED, wait
+        started = time.perf_counter()
+        waiting = list(self.providers)
+        running = {}  # future -> provider
+
+        def ask_next():
+            provider = waiting.pop(0)
+            running[self._executor.submit(self._fetch_from, provider)] = provider
+
+        ask_next()
+        while running:
+            done, _ = wait(running, timeout=self.hedge_after if waiting else None, return_when=FIRST_COMPLETED)
+            if not done:  # hedging
+                ask_next()
+                continue
+            for future in done:
+                provider = running.pop(future)
+                try:
+                    rates, fetched_at = future.result()
+                except RatesUnavailable:
+                    if waiting:
+                        ask_next()
+                    continue
+                if rates is None:  # provider claims nothing has changed, but never gave us anything
+                    continue
+                with self._lock:
+                    self._provider_stats[provider.name]['wins'] += 1
+                    self._refresh_latencies.append(time.perf_counter() - started)
+                if rates is self._last_rates or \
+                        self._last_fetched_at is not None and fetched_at < self._last_fetched_at:
+                    return None
+                self._last_rates = rates
+                self._last_fetched_at = fetched_at
+                return rates
+        raise RatesUnavailable(f'None of {len(self.providers)} providers answered')
+
+    @staticmethod
+    def _percentiles(latencies) -> dict:
+        if not latencies:
+            return {'p50': None, 'p99': None}
+        latencies = sorted(latencies)
+        return {'p50': latencies[len(latencies) // 2], 'p99': latencies[min(len(latencies) - 1,
+                                                                            len(latencies) * 99 // 100)]}
+
+    def stats(self) -> dict:
+        """Latency percentiles (seconds) of refreshes and of every provider, and how often each provider won."""
+        with self._lock:
+            answer = {'refresh': self._percentiles(self._refresh_latencies), 'providers': {}}
+            for name, stats in self._provider_stats.items():
+                answer['providers'][name] = {'requests': stats['requests'],
+                                             'wins': stats['wins'],
+                                             'failures': stats['failures'],
+                                             'hit_rate': stats['wins'] / stats['requests'] if stats['requests'] else 0,
+                                             **self._percentiles(stats['latencies'])}
+            return answer
+
+
+class SharedRatesStore:
+    """Rates in shared memory: one writer process publishes them, any number of reader processes read them.
+    Layout: sequence number (uint64), fetched_at (float64), number of currencies (uint64),
+    then `capacity` currency codes (8 ascii bytes each) and `capacity` float64 rates.
+    There are no locks. Writer makes sequence odd while it writes and even again when it's done,
+    reader retries if sequence was odd or changed while it was reading (a seqlock).
+    Create it in the writer with SharedRatesStore(name, create=True), attach to it everywhere else with
+    SharedRatesStore(name).
+    read() copies rates out of shared memory into a new dict, pass it newer_than to skip that when nothing's new.
+    """
+    _HEADER_SIZE = 24
+    _created_here = set()  # names of blocks created by this process
+
+    def __init__(self, name: str, create: bool = False, capacity: int = 512):
+        import numpy
+        from multiprocessing import resource_tracker, shared_memory
+        if create:
+            self._memory = shared_memory.SharedMemory(name=name, create=True,
+                                                      size=self._HEADER_SIZE + capacity * 16)
+            SharedRatesStore._created_here.add(name)
+        else:
+            self._memory = shared_memory.SharedMemory(name=name)
+            if name not in SharedRatesStore._created_here:
+                # Readers must not remove the block when they exit, that's writer's job
+                resource_tracker.unregister(self._memory._name, 'shared_memory')
+            capacity = (self._memory.size - self._HEADER_SIZE) // 16
+        self.name = name
+        self.capacity = capacity
+        self.owner = create
+        buffer = self._memory.buf
+        self._sequence = numpy.ndarray((1,), dtype=numpy.uint64, buffer=buffer, offset=0)
+        self._fetched_at = numpy.ndarray((1,), dtype=numpy.float64, buffer=buffer, offset=8)
+        self._count = numpy.ndarray((1,), dtype=numpy.uint64, buffer=buffer, offset=16)
+        self._codes = numpy.ndarray((capacity,), dtype='S8', buffer=buffer, offset=self._HEADER_SIZE)
+        self._values = numpy.ndarray((capacity,), dtype=numpy.float64, buffer=buffer,
+                                     offset=self._HEADER_SIZE + capacity * 8)
+
+    @property
+    def sequence(self) -> int:
+        """Even number that grows with every write. Zero means nothing was written yet."""
+        return int(self._sequence[0])
+
+    def write(self, rates: dict, fetched_at: float):
+        """Only one process (the one that created the store) may write."""
+        if len(rates) > self.capacity:
+            raise ValueError(f'Shared rates store only fits {self.capacity} currencies')
+        sequence = self.sequence
+        self._sequence[0] = sequence + 1
+        self._fetched_at[0] = fetched_at
+        self._count[0] = len(rates)
+        self._codes[:len(rates)] = [code.encode('ascii') for code in rates.keys()]
+        self._values[:len(rates)] = list(rates.values())
+        self._sequence[0] = sequence + 2
+
+    def read(self, newer_than: int = 0) -> Union[tuple, None]:
+        """Returns (rates, fetched_at, sequence) or None if nothing newer than sequence newer_than was written."""
+        while True:
+            sequence = self.sequence
+            if sequence <= newer_than:
+                return None
+            if sequence % 2:  # writer is busy
+                time.sleep(0)
+                continue
+            count = int(self._count[0])
+            fetched_at = float(self._fetched_at[0])
+            codes = self._codes[:count].tolist()
+            values = self._values[:count].tolist()
+            if self.sequence == sequence:
+                return {code.decode('ascii'): value for code, value in zip(codes, values)}, fetched_at, sequence
+
+    def close(self):
+        """Writer also removes the shared memory block."""
+        del self._sequence, self._fetched_at, self._count, self._codes, self._values
+        self._memory.close()
+        if self.owner:
+            self._memory.unlink()
+            SharedRatesStore._created_here.discard(self.name)
@@ -0,0 +1,215 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from rates import *
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'rates.snapshot')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_save_and_load(self):
+        rates = {'USD': 1, 'EUR': 0.92, 'RUB': 92.5}
+        save_snapshot(self.path, rates, 1234.5)
+        self.assertEqual(load_snapshot(self.path), (rates, 1234.5))
+
+    def test_no_snapshot(self):
+        self.assertIsNone(load_snapshot(self.path))
+        with open(self.path, 'wb') as file:
+            file.write(b'{"rates": {}}')
+        self.assertIsNone(load_snapshot(self.path))
+
+
+class CrossRatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cross_rates = CrossRates.from_rates({'USD': 1, 'EUR': 0.8, 'RUB': 80})
+
+    def test_rate(self):
+        self.assertAlmostEqual(self.cross_rates.rate('USD', 'RUB'), 80)
+        self.assertAlmostEqual(self.cross_rates.rate('RUB', 'USD'), 1 / 80)
+        self.assertAlmostEqual(self.cross_rates.rate('EUR', 'RUB'), 100)
+        self.assertEqual(self.cross_rates.rate('EUR', 'EUR'), 1)
+        with self.assertRaises(KeyError):
+            self.cross_rates.rate('GBP', 'USD')
+
+    def test_convert_many(self):
+        result = self.cross_rates.convert_many([1, 2, 100], ['USD', 'EUR', 'RUB'], ['RUB', 'RUB', 'EUR'])
+        for value, expected in zip(result, (80, 200, 1)):
+            self.assertAlmostEqual(value, expected)
+        result = self.cross_rates.convert_many([1, 2], 'EUR', 'USD')
+        for value, expected in zip(result, (1.25, 2.5)):
+            self.assertAlmostEqual(value, expected)
+        with self.assertRaises(KeyError):
+            self.cross_rates.convert_many([1, 2], ['USD', 'GBP'], 'EUR')
+        with self.assertRaises(KeyError):
+            self.cross_rates.convert_many([1], 'USD', 'ZZZ')
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    """Serves rates with an ETag. Fails the first `failures` requests."""
+    failures = 0
+    requests = 0
+    not_modified = 0
+    payload = json.dumps({'base': 'USD', 'rates': {'USD': 1, 'EUR': 0.8}}).encode()
+
+    def do_GET(self):
+        StubAPI.requests += 1
+        if StubAPI.failures:
+            StubAPI.failures -= 1
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.headers.get('If-None-Match') == '"v1"':
+            StubAPI.not_modified += 1
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(self.payload)))
+        self.end_headers()
+        self.wfile.write(self.payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class RatesClientTest(unittest.TestCase):
+
+    def setUp(self):
+        StubAPI.failures = StubAPI.requests = StubAPI.not_modified = 0
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPI)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        url = f'http://127.0.0.1:{self.server.server_address[1]}/latest'
+        self.client = RatesClient(url, max_retries=3, backoff=0.001)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_conditional_requests(self):
+        self.assertEqual(self.client.fetch(), {'USD': 1, 'EUR': 0.8})
+        self.assertIsNone(self.client.fetch())
+        self.assertEqual((StubAPI.requests, StubAPI.not_modified), (2, 1))
+
+    def test_retries(self):
+        StubAPI.failures = 2
+        self.assertEqual(self.client.fetch(), {'USD': 1, 'EUR': 0.8})
+        StubAPI.failures = 3
+        with self.assertRaises(RatesUnavailable):
+            self.client.fetch()
+        self.assertEqual(StubAPI.requests, 6)
+
+    def test_no_usd(self):
+        self.addCleanup(setattr, StubAPI, 'payload', StubAPI.payload)
+        StubAPI.payload = json.dumps({'base': 'EUR', 'rates': {'GBP': 0.9}}).encode()
+        client = RatesClient(self.client.url, base='EUR', max_retries=3, backoff=0.001)
+        with self.assertRaises(RatesUnavailable):
+            client.fetch()
+        self.assertEqual(StubAPI.requests, 1)  # not retried
+
+
+class FakeProvider:
+    """Answers with given rates after delay seconds, or fails if rates is None."""
+
+    def __init__(self, name, rates, delay=0.0):
+        self.name = name
+        self.rates = rates
+        self.delay = delay
+        self.last_rates = None
+        self.last_fetched_at = None
+        self.calls = 0
+
+    def fetch(self):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.rates is None:
+            raise RatesUnavailable(self.name)
+        if self.last_rates is self.rates:
+            return None
+        self.last_rates = self.rates
+        self.last_fetched_at = time.time()
+        return self.rates
+
+
+class HedgedRatesSourceTest(unittest.TestCase):
+
+    def test_normalize_rates(self):
+        self.assertEqual(normalize_rates({'USD': 2, 'GBP': 1}, 'EUR'), {'USD': 1, 'GBP': 0.5, 'EUR': 0.5})
+        with self.assertRaises(KeyError):
+            normalize_rates({'GBP': 1}, 'EUR')
+
+    def test_failover(self):
+        down = FakeProvider('down', None)
+        up = FakeProvider('up', {'USD': 1})
+        source = HedgedRatesSource([down, up], hedge_after=10)
+        self.assertEqual(source.fetch(), {'USD': 1})
+        self.assertIsNone(source.fetch())
+        stats = source.stats()['providers']
+        self.assertEqual((stats['down']['failures'], stats['up']['wins'], stats['up']['hit_rate']), (2, 2, 1))
+
+    def test_hedging(self):
+        slow = FakeProvider('slow', {'USD': 1, 'EUR': 1}, delay=0.5)
+        fast = FakeProvider('fast', {'USD': 1, 'EUR': 2})
+        source = HedgedRatesSource([slow, fast], hedge_after=0.01)
+        started = time.perf_counter()
+        self.assertEqual(source.fetch(), {'USD': 1, 'EUR': 2})
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertIsNotNone(source.stats()['refresh']['p99'])
+
+    def test_older_rates_of_other_provider(self):
+        old = FakeProvider('old', {'USD': 1, 'EUR': 1})
+        old.fetch()
+        old.last_fetched_at -= 60
+        new = FakeProvider('new', {'USD': 1, 'EUR': 2})
+        source = HedgedRatesSource([new, old], hedge_after=10)
+        self.assertEqual(source.fetch(), {'USD': 1, 'EUR': 2})
+        new.rates = None  # down, old one says its rates haven't changed since it fetched them
+        self.assertIsNone(source.fetch())
+        old.rates = {'USD': 1, 'EUR': 3}
+        self.assertEqual(source.fetch(), {'USD': 1, 'EUR': 3})
+
+    def test_all_down(self):
+        source = HedgedRatesSource([FakeProvider('a', None), FakeProvider('b', None)], hedge_after=0.01)
+        with self.assertRaises(RatesUnavailable):
+            source.fetch()
+
+
+class SharedRatesStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.writer = SharedRatesStore(f'rates_test_{os.getpid()}', create=True, capacity=4)
+        self.reader = SharedRatesStore(f'rates_test_{os.getpid()}')
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+
+    def test_read_write(self):
+        self.assertIsNone(self.reader.read())
+        self.writer.write({'USD': 1, 'EUR': 0.8}, 1234.5)
+        rates, fetched_at, sequence = self.reader.read()
+        self.assertEqual((rates, fetched_at), ({'USD': 1, 'EUR': 0.8}, 1234.5))
+        self.assertIsNone(self.reader.read(newer_than=sequence))
+        self.writer.write({'USD': 1}, 1300)
+        self.assertEqual(self.reader.read(newer_than=sequence)[0], {'USD': 1})
+        self.assertEqual(self.reader.capacity, 4)
+
+    def test_capacity(self):
+        with self.assertRaises(ValueError):
+            self.writer.write({code: 1 for code in ('USD', 'EUR', 'GBP', 'RUB', 'CHF')}, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,152 @@
+"""Replays recorded user messages through telegramParser.parse and reports throughput and latency.
+Works offline: rates are frozen from a fixture (replay_rates.json), so results don't depend on network or date.
+Every round starts with empty caches, so repeated messages within the corpus hit the cache as they would in prod.
+
+python replay_benchmark.py                         # replay replay_corpus.jsonl
+python replay_benchmark.py --save before.json      # remember results of this revision...
+python replay_benchmark.py --baseline before.json  # ...and compare another one with them (exit code 1 on regression)
+
+Corpus is a jsonl file with {"text": "..."} on every line (e.g. exported from bot logs).
+Latency is reported per kind of message: the top operation of the expression ("in" for conversions, "+", "^"...)
+and "can't parse" for messages the bot doesn't understand.
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from rates import save_snapshot
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(DIRECTORY, 'replay_corpus.jsonl')
+RATES_PATH = os.path.join(DIRECTORY, 'replay_rates.json')
+FAILURE = "can't parse"
+
+
+def freeze_rates(rates_path: str) -> str:
+    """Makes bot_parser use rates from the fixture (must be called before bot_parser is imported).
+    Returns path of the snapshot made from the fixture.
+    """
+    with open(rates_path, encoding='utf-8') as file:
+        fixture = json.load(file)
+    snapshot_path = os.path.join(tempfile.mkdtemp(), 'rates.snapshot')
+    save_snapshot(snapshot_path, fixture['rates'], fixture['fetched_at'])
+    os.environ['BOT_RATES_SNAPSHOT'] = snapshot_path
+    os.environ['BOT_FROZEN_RATES'] = '1'
+    return snapshot_path
+
+
+def load_corpus(path: str) -> list:
+    with open(path, encoding='utf-8') as file:
+        return [json.loads(line)['text'] for line in file if line.strip()]
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest rank percentile of sorted values."""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def classify(parser, message: str) -> str:
+    """Kind of message: top operation of its expression, or FAILURE."""
+    from parser_ import Apply, ExpressionParser
+
+    if ExpressionParser.parse(parser, message).startswith("Can't parse"):  # not cached, so cache stats stay clean
+        return FAILURE
+    tree = parser.compile(message).tree
+    if isinstance(tree, Apply):
+        return tree.operation.operator.operator or 'implicit'
+    return 'value'
+
+
+def replay(corpus: list, rounds: int = 10) -> dict:
+    from bot_parser import telegramParser
+
+    kinds = {message: classify(telegramParser, message) for message in corpus}
+    cache_before = telegramParser.cache_stats()
+    plans_before = telegramParser.plan_stats()
+    latencies = {kind: [] for kind in kinds.values()}
+    elapsed = 0.0
+    for _ in range(rounds):
+        telegramParser.clear_cache()
+        telegramParser.clear_plans()
+        for message in corpus:
+            started = time.perf_counter()
+            telegramParser.parse(message)
+            latency = time.perf_counter() - started
+            elapsed += latency
+            latencies[kinds[message]].append(latency)
+
+    report = {'messages': len(corpus) * rounds,
+              'messages_per_second': len(corpus) * rounds / elapsed,
+              'kinds': {}}
+    everything = []
+    for kind, values in sorted(latencies.items()):
+        everything.extend(values)
+        values.sort()
+        report['kinds'][kind] = {'count': len(values) // rounds,
+                                 'p50_us': percentile(values, 0.5) * 1e6,
+                                 'p99_us': percentile(values, 0.99) * 1e6,
+                                 'share_of_time': sum(values) / elapsed}
+    everything.sort()
+    report['p50_us'] = percentile(everything, 0.5) * 1e6
+    report['p99_us'] = percentile(everything, 0.99) * 1e6
+    report['cache'] = {key: value - cache_before[key]
+                       for key, value in telegramParser.cache_stats().items() if key != 'size'}
+    report['plans'] = {key: value - plans_before[key]
+                       for key, value in telegramParser.plan_stats().items() if key not in ('size', 'hit_rate')}
+    return report
+
+
+def print_report(report: dict):
+    print(f'{report["messages"]} messages, {report["messages_per_second"]:.0f} messages/s, '
+          f'p50 {report["p50_us"]:.1f} us, p99 {report["p99_us"]:.1f} us')
+    print(f'{"kind":<15}{"messages":>10}{"p50, us":>12}{"p99, us":>12}{"time, %":>10}')
+    for kind, stats in report['kinds'].items():
+        print(f'{kind:<15}{stats["count"]:>10}{stats["p50_us"]:>12.1f}{stats["p99_us"]:>12.1f}'
+              f'{stats["share_of_time"] * 100:>10.1f}')
+    print(f'answer cache: {report["cache"]}')
+    print(f'plan cache: {report["plans"]}')
+
+
+def regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """What got worse than baseline by more than tolerance (0.2 is 20%).
+    Only p50 is compared per kind of message: there are too few messages of some kinds for a stable p99.
+    """
+    found = []
+    if report['messages_per_second'] < baseline['messages_per_second'] * (1 - tolerance):
+        found.append(f'throughput: {baseline["messages_per_second"]:.0f} -> {report["messages_per_second"]:.0f} '
+                     f'messages/s')
+    if report['p99_us'] > baseline['p99_us'] * (1 + tolerance):
+        found.append(f'p99: {baseline["p99_us"]:.1f} -> {report["p99_us"]:.1f} us')
+    for kind, stats in report['kinds'].items():
+        before = baseline['kinds'].get(kind)
+        if before is not None and stats['p50_us'] > before['p50_us'] * (1 + tolerance):
+            found.append(f'{kind} p50: {before["p50_us"]:.1f} -> {stats["p50_us"]:.1f} us')
+    return found
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Replays recorded messages through the parser.')
+    arguments.add_argument('--corpus', default=CORPUS_PATH, help='jsonl file with {"text": ...} per line')
+    arguments.add_argument('--rates', default=RATES_PATH, help='json file with {"fetched_at": ..., "rates": {...}}')
+    arguments.add_argument('--rounds', type=int, default=10, help='how many times to replay the corpus')
+    arguments.add_argument('--save', metavar='PATH', help='save results as json')
+    arguments.add_argument('--baseline', metavar='PATH', help='compare with results saved by --save')
+    arguments.add_argument('--tolerance', type=float, default=0.2,
+                           help='how much worse than baseline is still fine (0.2 is 20%%)')
+    arguments = arguments.parse_args()
+
+    freeze_rates(arguments.rates)
+    result = replay(load_corpus(arguments.corpus), arguments.rounds)
+    print_report(result)
+    if arguments.save:
+        with open(arguments.save, 'w', encoding='utf-8') as output:
+            json.dump(result, output, indent=4, ensure_ascii=False)
+    if arguments.baseline:
+        with open(arguments.baseline, encoding='utf-8') as baseline_file:
+            problems = regressions(result, json.load(baseline_file), arguments.tolerance)
+        for problem in problems:
+            print(f'REGRESSION {problem}')
+        sys.exit(1 if problems else 0)
@@ -0,0 +1,70 @@
+"""Measures how fast the bot starts: import time of bot_parser and time until it can answer the first message.
+Every measurement runs in a fresh interpreter, as a restarted bot would. Rates are frozen from the fixture
+(replay_rates.json), so nothing is fetched from the network.
+
+python startup_benchmark.py             # median of 10 runs
+python startup_benchmark.py --runs 30
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from replay_benchmark import RATES_PATH, freeze_rates
+
+DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+
+# Each script prints json with its timings (seconds)
+SCRIPTS = {
+    'import': """
+import time
+started = time.perf_counter()
+import bot_parser
+print(json.dumps({'import': time.perf_counter() - started}))
+""",
+    'first reply': """
+import time
+started = time.perf_counter()
+import bot_parser
+imported = time.perf_counter()
+bot_parser.engine.telegram_parser.parse('100 usd in eur')
+print(json.dumps({'import': imported - started, 'first reply': time.perf_counter() - started}))
+""",
+    'warmed up': """
+import time
+started = time.perf_counter()
+import bot_parser
+bot_parser.engine.warm_up().join()
+warmed_up = time.perf_counter()
+bot_parser.engine.telegram_parser.parse('100 usd in eur')
+print(json.dumps({'warm up': warmed_up - started, 'reply after warm up': time.perf_counter() - warmed_up}))
+""",
+}
+
+
+def measure(script: str) -> dict:
+    output = subprocess.run([sys.executable, '-c', 'import json\n' + script], cwd=DIRECTORY, env=os.environ,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def run(runs: int = 10) -> dict:
+    timings = {}
+    for _ in range(runs):
+        for script in SCRIPTS.values():
+            for name, seconds in measure(script).items():
+                timings.setdefault(name, []).append(seconds)
+    return {name: statistics.median(values) for name, values in timings.items()}
+
+
+if __name__ == '__main__':
+    arguments = argparse.ArgumentParser(description='Measures startup of the bot.')
+    arguments.add_argument('--runs', type=int, default=10, help='how many fresh interpreters to start per script')
+    arguments.add_argument('--rates', default=RATES_PATH, help='json file with {"fetched_at": ..., "rates": {...}}')
+    arguments = arguments.parse_args()
+
+    freeze_rates(arguments.rates)  # environment is inherited by the subprocesses
+    for name, seconds in run(arguments.runs).items():
+        print(f'{name:<20}{seconds * 1000:>10.1f} ms')
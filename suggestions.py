@@ -0,0 +1,66 @@
+"""This file defines PrefixIndex: a trie that suggests values (e.g. currency codes) for the beginning of a word.
+It is used by inline mode of the bot, which answers on every keystroke, so lookups must be cheap:
+walking the trie takes one dict lookup per typed character and every node has its answer prepared beforehand.
+"""
+
+from typing import Union
+
+
+class _Node:
+    __slots__ = ('children', 'values', 'open_values', 'subtree')
+
+    def __init__(self):
+        self.children = {}
+        self.values = set()  # values of keys ending here
+        self.open_values = set()  # values of open keys ending here (they match longer words as well)
+        self.subtree = ()  # sorted values of every key in this subtree, filled by PrefixIndex.freeze
+
+
+class PrefixIndex:
+    """Maps keys (case-insensitive) to values, and finds values of every key that starts with a prefix.
+    An open key also matches words that start with it: open key "бакс" matches "баксов" and "бак" (like
+    synonym regex "бакс[\\w]*" would).
+    Add keys, then call freeze() before looking anything up. Keys added after freeze() are not seen until
+    it is called again.
+    """
+
+    def __init__(self):
+        self._root = _Node()
+
+    def add(self, key: str, value, open_key: bool = False):
+        node = self._root
+        for char in key.lower():
+            node = node.children.setdefault(char, _Node())
+        (node.open_values if open_key else node.values).add(value)
+
+    def freeze(self) -> 'PrefixIndex':
+        """Prepares answers of every node. Returns self, so the index can be frozen and stored in one go."""
+        stack = [(self._root, False)]
+        while stack:  # post order, without recursion
+            node, children_done = stack.pop()
+            if children_done:
+                values = node.values | node.open_values
+                for child in node.children.values():
+                    values.update(child.subtree)
+                node.subtree = tuple(sorted(values))
+            else:
+                stack.append((node, True))
+                stack.extend((child, False) for child in node.children.values())
+        return self
+
+    def lookup(self, prefix: str, limit: Union[int, None] = None) -> tuple:
+        """Values of keys starting with prefix (and of open keys prefix starts with), sorted."""
+        node = self._root
+        passed_open_values = set()
+        for char in prefix.lower():
+            passed_open_values.update(node.open_values)
+            node = node.children.get(char)
+            if node is None:
+                return tuple(sorted(passed_open_values))[:limit]
+        if not passed_open_values:
+            return node.subtree[:limit]
+        return tuple(sorted(passed_open_values.union(node.subtree)))[:limit]
+
+
+if __name__ == '__main__':
+    print(__doc__)
@@ -0,0 +1,34 @@
+import unittest
+from suggestions import *
+
+
+class PrefixIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = PrefixIndex()
+        for code, name in (('USD', 'US Dollar'), ('AUD', 'Australian Dollar'), ('EUR', 'Euro'), ('UAH', 'Hryvnia')):
+            self.index.add(code, code)
+            for word in name.split():
+                self.index.add(word, code)
+        self.index.add('бакс', 'USD', open_key=True)
+        self.index.add('$', 'USD')
+        self.index.freeze()
+
+    def test_lookup(self):
+        self.assertEqual(self.index.lookup('u'), ('UAH', 'USD'))
+        self.assertEqual(self.index.lookup('Dol'), ('AUD', 'USD'))
+        self.assertEqual(self.index.lookup('eur'), ('EUR',))
+        self.assertEqual(self.index.lookup('$'), ('USD',))
+        self.assertEqual(self.index.lookup(''), ('AUD', 'EUR', 'UAH', 'USD'))
+        self.assertEqual(self.index.lookup('', limit=2), ('AUD', 'EUR'))
+        self.assertEqual(self.index.lookup('euros'), ())
+        self.assertEqual(self.index.lookup('x'), ())
+
+    def test_open_keys(self):
+        self.assertEqual(self.index.lookup('бак'), ('USD',))
+        self.assertEqual(self.index.lookup('баксов'), ('USD',))
+        self.assertEqual(self.index.lookup('бакин'), ())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,106 @@
+"""This file defines WebhookServer: a tiny asyncio HTTP server that accepts Telegram updates (webhook mode).
+It only speaks plain HTTP, so put it behind a reverse proxy / load balancer that terminates TLS.
+With reuse_port=True several bot processes can listen on the same port and the OS spreads connections between them.
+"""
+
+import asyncio
+import traceback
+from typing import Union
+
+SECRET_TOKEN_HEADER = 'x-telegram-bot-api-secret-token'
+MAX_BODY_SIZE = 1024 * 1024  # Telegram updates are way smaller than that
+
+
+class WebhookServer:
+    """Every POST to path is handed to on_update (as a json string) on a thread pool, so a slow
+    on_update never blocks the event loop. If secret_token is given, requests without it are refused.
+    Example: WebhookServer(lambda json_string: bot.process_new_updates([Update.de_json(json_string)])).run()
+    """
+
+    def __init__(self, on_update: callable, path: str = '/', secret_token: Union[str, None] = None,
+                 host: str = '0.0.0.0', port: int = 8443, reuse_port: bool = False):
+        self.on_update = on_update
+        self.path = path
+        self.secret_token = secret_token
+        self.host = host
+        self.port = port
+        self.reuse_port = reuse_port
+        self._server = None
+
+    async def start(self) -> int:
+        """Starts listening, returns the port (handy if port was 0)."""
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port,
+                                                  reuse_port=self.reuse_port or None)
+        return self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+
+    async def serve_forever(self):
+        if self._server is None:
+            await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    def run(self):
+        """Blocks forever serving updates."""
+        asyncio.run(self.serve_forever())
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Serves requests on one (possibly keep-alive) connection."""
+        try:
+            keep_alive = True
+            while keep_alive:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await self._respond(writer, 400, 'Bad Request', keep_alive=False)
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if not 0 <= length <= MAX_BODY_SIZE:
+                    await self._respond(writer, 413, 'Payload Too Large', keep_alive=False)
+                    break
+                body = await reader.readexactly(length)
+
+                if path != self.path:
+                    await self._respond(writer, 404, 'Not Found', keep_alive)
+                elif method != 'POST':
+                    await self._respond(writer, 405, 'Method Not Allowed', keep_alive)
+                elif self.secret_token is not None and headers.get(SECRET_TOKEN_HEADER) != self.secret_token:
+                    await self._respond(writer, 403, 'Forbidden', keep_alive)
+                else:
+                    try:
+                        await asyncio.get_running_loop().run_in_executor(None, self.on_update, body.decode('utf-8'))
+                    except Exception:  # Telegram will send the update again
+                        traceback.print_exc()
+                        await self._respond(writer, 500, 'Internal Server Error', keep_alive)
+                    else:
+                        await self._respond(writer, 200, 'OK', keep_alive)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: int, reason: str, keep_alive: bool):
+        writer.write(f'HTTP/1.1 {status} {reason}\r\n'
+                     f'Content-Length: 0\r\n'
+                     f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode('latin-1'))
+        await writer.drain()
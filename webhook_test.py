@@ -0,0 +1,52 @@
+import asyncio
+import http.client
+import json
+import unittest
+from webhook import *
+
+# recorded update, as Telegram sends it
+UPDATE = {'update_id': 10000,
+          'message': {'message_id': 1365,
+                      'date': 1441645532,
+                      'chat': {'id': 1111111, 'type': 'private', 'first_name': 'Test'},
+                      'from': {'id': 1111111, 'is_bot': False, 'first_name': 'Test'},
+                      'text': '100 usd in eur'}}
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.updates = []
+        self.server = WebhookServer(self.updates.append, path='/bot', secret_token='secret', host='127.0.0.1', port=0)
+        self.port = await self.server.start()
+
+    async def asyncTearDown(self):
+        await self.server.stop()
+
+    def post(self, requests: list) -> list:
+        """Sends (path, headers) requests over a single connection, returns response statuses."""
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=5)
+        statuses = []
+        for path, headers in requests:
+            connection.request('POST', path, body=json.dumps(UPDATE), headers=headers)
+            response = connection.getresponse()
+            response.read()
+            statuses.append(response.status)
+        connection.close()
+        return statuses
+
+    async def test_updates(self):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': 'secret', 'Content-Type': 'application/json'}
+        statuses = await asyncio.to_thread(self.post, [('/bot', headers), ('/bot', headers)])
+        self.assertEqual(statuses, [200, 200])
+        self.assertEqual([json.loads(update) for update in self.updates], [UPDATE, UPDATE])
+
+    async def test_refused(self):
+        statuses = await asyncio.to_thread(self.post, [('/bot', {}),
+                                                       ('/other', {'X-Telegram-Bot-Api-Secret-Token': 'secret'})])
+        self.assertEqual(statuses, [403, 404])
+        self.assertEqual(self.updates, [])
+
+
+if __name__ == '__main__':
+    unittest.main()